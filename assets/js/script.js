@@ -52,4 +52,114 @@ $(document).ready(function () {
     });
 });
 
+/* Load older dishes into the home feed carousel as the reader nears its end */
+$(document).ready(function () {
+    var $carousel = $('#foodjournal-carousel'),
+        loading = false;
+
+    function addItem(item) {
+        var $caption = $('<div class="carousel-caption d-none d-md-block">')
+            .append($('<h5>').text(item.title))
+            .append($('<p>').text(item.comment || ''))
+            .append($('<p>').text('submitted by ' + item.author + ' on ' + moment(item.created_at).format('LL')));
+        var sizes = '(min-width: 768px) 50vw, 100vw',
+            $picture = $('<picture>');
+        $.each(item.image_srcset, function (fmt, srcset) {
+            if (fmt !== 'jpeg') {
+                $('<source>').attr({type: 'image/' + fmt, srcset: srcset, sizes: sizes}).appendTo($picture);
+            }
+        });
+        $('<img class="d-block my-0 mx-auto foodjournal-picture" alt="">')
+            .attr('src', item.image_url)
+            .attr(item.image_srcset.jpeg ? {srcset: item.image_srcset.jpeg, sizes: sizes} : {})
+            .appendTo($picture);
+        $('<div class="carousel-item">')
+            .append($picture)
+            .append($caption)
+            .appendTo($carousel.find('.carousel-inner'));
+    }
+
+    $carousel.on('slide.bs.carousel', function (e) {
+        var next = $carousel.data('next'),
+            count = $carousel.find('.carousel-item').length;
+
+        if (!next || loading || e.to < count - 2) {
+            return;
+        }
+        loading = true;
+        $.getJSON($carousel.data('feed-url'), {before: next})
+            .done(function (page) {
+                $.each(page.items, addItem);
+                $carousel.data('next', page.next || '');
+            })
+            .always(function () {
+                loading = false;
+            });
+    });
+});
+
+/* Upload the dish's image straight to S3, falling back to a normal form post */
+$(document).ready(function () {
+    var $form = $('#addDishForm');
+
+    $form.submit(function (event) {
+        var file = $form.find('input[type=file]')[0].files[0],
+            csrfToken = $form.find('input[name=csrf_token]').val();
+        if (!file || !window.FormData) {
+            return;
+        }
+        event.preventDefault();
 
+        function post(url, data) {
+            return $.ajax({url: url, method: 'POST', data: data, processData: false, contentType: false,
+                           headers: {'X-CSRFToken': csrfToken}});
+        }
+
+        var presign = new FormData();
+        presign.append('filename', file.name);
+        post($form.data('presign-url'), presign).then(function (upload) {
+            var data = new FormData();
+            $.each(upload.fields, function (name, value) {
+                data.append(name, value);
+            });
+            data.append('file', file);
+            return $.ajax({url: upload.url, method: 'POST', data: data, processData: false, contentType: false})
+                .then(function () {
+                    var dish = new FormData($form[0]);
+                    dish.delete('image');
+                    dish.append('key', upload.key);
+                    return post($form.data('finalize-url'), dish);
+                });
+        }).then(function (response) {
+            window.location = response.redirect;
+        }, function () {
+            $form.off('submit').submit();
+        });
+    });
+});
+
+/* Suggest members while typing in the directory's search box */
+$(document).ready(function () {
+    var $input = $('input[data-typeahead-url]'),
+        $suggestions = $('#member-suggestions'),
+        pending = null;
+
+    $input.on('input', function () {
+        var prefix = $input.val().trim();
+        if (pending) {
+            pending.abort();
+        }
+        if (!prefix) {
+            $suggestions.empty();
+            return;
+        }
+        pending = $.getJSON($input.data('typeahead-url'), {q: prefix}).done(function (data) {
+            $suggestions.empty();
+            $.each(data.items, function (i, item) {
+                $('<option>').attr('value', item.username)
+                    .text([item.first_name, item.last_name].filter(Boolean).join(' '))
+                    .appendTo($suggestions);
+            });
+        });
+    });
+});
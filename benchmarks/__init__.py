@@ -0,0 +1,4 @@
+"""Benchmarks for the app's hot paths.
+
+Run them as modules from the project root, e.g. ``python -m benchmarks.feed_queries --help``.
+"""
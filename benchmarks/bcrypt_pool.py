@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Latency of an unrelated page while a burst of logins hashes passwords.
+
+Serves the app from one gevent WSGI server, as a ``gunicorn -k gevent``
+worker does, fires ``--logins`` concurrent logins and meanwhile times
+requests for the about page. Compare hashing inline with hashing on the pool::
+
+    python -m benchmarks.bcrypt_pool --pool-size 0
+    python -m benchmarks.bcrypt_pool --pool-size 4
+
+Inline, every about page requested during the burst waits for the hashes
+queued ahead of it, so its p99 grows with the burst; on the pool it stays
+near its idle latency.
+"""
+from gevent import monkey  # isort:skip
+
+monkey.patch_all()  # isort:skip
+
+import statistics  # noqa: E402
+import time  # noqa: E402
+
+import click  # noqa: E402
+import gevent  # noqa: E402
+import requests  # noqa: E402
+from gevent.pool import Group  # noqa: E402
+from gevent.pywsgi import WSGIServer  # noqa: E402
+
+from food_journal.app import create_app  # noqa: E402
+from food_journal.database import db  # noqa: E402
+from food_journal.extensions import bcrypt, passwords  # noqa: E402
+from food_journal.user.models import User  # noqa: E402
+
+
+def percentile(samples, fraction):
+    """The sample ``fraction`` of the way up ``samples``, such as 0.99 for the p99."""
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+@click.command()
+@click.option(
+    "--pool-size",
+    default=4,
+    show_default=True,
+    help="BCRYPT_POOL_SIZE; 0 hashes inline.",
+)
+@click.option("--rounds", default=12, show_default=True, help="BCRYPT_LOG_ROUNDS.")
+@click.option(
+    "--logins", default=50, show_default=True, help="Concurrent logins in the burst."
+)
+@click.option(
+    "--probe-interval",
+    default=0.01,
+    show_default=True,
+    help="Seconds between about page requests.",
+)
+def main(pool_size, rounds, logins, probe_interval):
+    """Time the about page during a login burst."""
+    app = create_app("benchmarks.settings")
+    app.config.update(
+        BCRYPT_LOG_ROUNDS=rounds, BCRYPT_POOL_SIZE=pool_size, WTF_CSRF_ENABLED=False
+    )
+    bcrypt.init_app(app)
+    passwords.init_app(app)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        User.create(
+            username="bench",
+            email="bench@example.com",
+            password="bench-password",
+            active=True,
+        )
+
+    server = WSGIServer(("127.0.0.1", 0), app, log=None)
+    server.start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    def login():
+        requests.post(
+            f"{base}/login", data={"username": "bench", "password": "bench-password"}
+        )
+
+    def probe(samples, until):
+        while not until.ready():
+            started = time.perf_counter()
+            requests.get(f"{base}/about/")
+            samples.append((time.perf_counter() - started) * 1000)
+            gevent.sleep(probe_interval)
+
+    idle = []
+    for _ in range(20):
+        started = time.perf_counter()
+        requests.get(f"{base}/about/")
+        idle.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    burst = Group()
+    for _ in range(logins):
+        burst.spawn(login)
+    done = gevent.spawn(burst.join)
+    during = []
+    gevent.spawn(probe, during, done).join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        metrics = passwords.metrics()
+    server.stop()
+
+    click.echo(
+        f"pool size {pool_size}, {rounds} rounds, {logins} logins in {elapsed:.2f}s"
+    )
+    click.echo(
+        f"about page idle:         p50 {statistics.median(idle):8.1f} ms  p99 {percentile(idle, 0.99):8.1f} ms"
+    )
+    click.echo(
+        f"about page during burst: p50 {statistics.median(during):8.1f} ms  p99 {percentile(during, 0.99):8.1f} ms"
+        f"  ({len(during)} requests)"
+    )
+    click.echo(f"pool: {metrics}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""CRUDMixin bulk writes against one ``create``/``update``/``delete`` per row.
+
+Times writing ``--rows`` users (a hundred thousand by default) with
+``bulk_create``, with and without ORM events, then ``bulk_update``,
+``upsert`` and ``bulk_delete`` over all of them. The per-row methods commit
+every row, so they are timed over the first ``--sample`` rows only and
+reported as rows per second like the rest::
+
+    python -m benchmarks.bulk_writes
+    python -m benchmarks.bulk_writes --rows 20000 --chunk-size 5000
+"""
+import time
+
+import click
+
+from food_journal.app import create_app
+from food_journal.database import db
+from food_journal.user.models import User
+
+
+def rows(count, start=0, first_name="Bulk"):
+    """User rows with unique usernames and emails."""
+    return [
+        {
+            "username": f"bulk{i}",
+            "email": f"bulk{i}@example.com",
+            "first_name": first_name,
+            "active": True,
+        }
+        for i in range(start, start + count)
+    ]
+
+
+def reset():
+    """Empty the benchmark database."""
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+
+
+def report(label, count, func):
+    """Run ``func`` and print its throughput."""
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    click.echo(
+        f"{label:<32} {count:>7,} rows in {elapsed:7.2f}s, {count / elapsed:>9,.0f} rows/s"
+    )
+
+
+@click.command()
+@click.option("--rows", "count", default=100000, show_default=True)
+@click.option(
+    "--sample", default=2000, show_default=True, help="Rows written one at a time."
+)
+@click.option(
+    "--chunk-size",
+    default=None,
+    type=int,
+    help="Rows per statement; BULK_CHUNK_SIZE by default.",
+)
+def main(count, sample, chunk_size):
+    """Time bulk writes."""
+    app = create_app("benchmarks.settings")
+    with app.test_request_context():
+        click.echo(
+            f"{db.engine.dialect.name}, chunks of {chunk_size or app.config['BULK_CHUNK_SIZE']} rows"
+        )
+
+        reset()
+        report(
+            "create, a commit per row",
+            sample,
+            lambda: [User.create(**row) for row in rows(sample)],
+        )
+        ids = [user_id for user_id, in db.session.query(User.id)]
+        report(
+            "update, a commit per row",
+            sample,
+            lambda: [
+                User.get_by_id(user_id).update(first_name="Updated") for user_id in ids
+            ],
+        )
+        report(
+            "delete, a commit per row",
+            sample,
+            lambda: [User.get_by_id(user_id).delete() for user_id in ids],
+        )
+
+        reset()
+        report(
+            "bulk_create, ORM events",
+            count,
+            lambda: User.bulk_create(rows(count), chunk_size, orm_events=True),
+        )
+        reset()
+        report("bulk_create", count, lambda: User.bulk_create(rows(count), chunk_size))
+        reset()
+        keys = []
+        report(
+            "bulk_create, returning keys",
+            count,
+            lambda: keys.extend(User.bulk_create(rows(count), chunk_size, True)),
+        )
+        report(
+            "bulk_update",
+            count,
+            lambda: User.bulk_update(
+                [{"id": user_id, "first_name": "Updated"} for user_id in keys],
+                chunk_size,
+            ),
+        )
+        half = count // 2
+        report(
+            "upsert, half of them new",
+            count,
+            lambda: User.upsert(
+                rows(count, start=half, first_name="Upserted"),
+                ["username"],
+                ["first_name"],
+                chunk_size,
+            ),
+        )
+        ids = [user_id for user_id, in db.session.query(User.id)]
+        assert len(ids) == count + half
+        report("bulk_delete", len(ids), lambda: User.bulk_delete(ids, chunk_size))
+        assert User.query.count() == 0
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Query plans and timings for the feed, ``is_following`` and profile queries.
+
+Fills the benchmark database with a synthetic social graph, then prints the
+plan of each hot query (``EXPLAIN QUERY PLAN`` on SQLite, ``EXPLAIN ANALYZE``
+on Postgres) and its median and 95th percentile latency.
+"""
+import datetime as dt
+import random
+import statistics
+import time
+
+import click
+
+from food_journal.app import create_app
+from food_journal.database import db
+from food_journal.public.feed import followed_feed_query, page_query
+from food_journal.public.models import FoodItem
+from food_journal.user.models import TimelineEntry, User, followers
+
+
+def populate(users, follows, dishes, seed=0):
+    """Insert a synthetic dataset with bulk Core inserts."""
+    rng = random.Random(seed)
+    start = dt.datetime(2020, 1, 1)
+    db.drop_all()
+    db.create_all()
+    db.session.execute(
+        User.__table__.insert(),
+        [
+            {
+                "username": f"user{i}",
+                "email": f"user{i}@example.com",
+                "active": True,
+                "fanout_on_read": False,
+            }
+            for i in range(1, users + 1)
+        ],
+    )
+    edges = set()
+    for follower_id in range(1, users + 1):
+        for followed_id in rng.sample(range(1, users + 1), min(follows, users)):
+            if followed_id != follower_id:
+                edges.add((follower_id, followed_id))
+    db.session.execute(
+        followers.insert(), [{"follower_id": a, "followed_id": b} for a, b in edges]
+    )
+    batch = []
+    for i in range(dishes):
+        batch.append(
+            {
+                "title": f"dish{i}",
+                "aws_key": f"bench/dish{i}.jpg",
+                "user_id": rng.randint(1, users),
+                "is_public": rng.random() < 0.8,
+                "created_at": start + dt.timedelta(seconds=i * 30),
+            }
+        )
+        if len(batch) == 10000:
+            db.session.execute(FoodItem.__table__.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(FoodItem.__table__.insert(), batch)
+    TimelineEntry.rebuild()
+    db.session.commit()
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute("ANALYZE")
+        db.session.commit()
+
+
+def explain(query):
+    """Return the plan of ``query`` as lines of text."""
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    prefix = (
+        "EXPLAIN QUERY PLAN "
+        if db.engine.dialect.name == "sqlite"
+        else "EXPLAIN ANALYZE "
+    )
+    cursor = db.session.connection().connection.cursor()
+    cursor.execute(prefix + str(compiled), params)
+    return [" ".join(str(column) for column in row) for row in cursor.fetchall()]
+
+
+def timed(func, repeat):
+    """Median and 95th percentile wall time of ``func`` in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        db.session.expire_all()
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+@click.command()
+@click.option("--users", default=2000, show_default=True)
+@click.option("--follows", default=20, show_default=True, help="Follows per user.")
+@click.option("--dishes", default=50000, show_default=True)
+@click.option("--repeat", default=200, show_default=True)
+@click.option("--reuse", is_flag=True, help="Reuse the data from a previous run.")
+def main(users, follows, dishes, repeat, reuse):
+    """Print plans and timings of the hot read queries."""
+    app = create_app("benchmarks.settings")
+    with app.test_request_context():
+        if not reuse:
+            click.echo(
+                f"Populating {users} users, ~{users * follows} follows, {dishes} dishes..."
+            )
+            populate(users, follows, dishes)
+        page_size = app.config["FEED_PAGE_SIZE"]
+        user = User.query.get(1)
+        other = User.query.get(2)
+
+        def public():
+            return page_query(FoodItem.query.filter_by(is_public=True), None, page_size)
+
+        def followed():
+            query, keys = followed_feed_query(user)
+            return page_query(query, None, page_size, keys)
+
+        def is_following():
+            return user.followed.filter(followers.c.followed_id == other.id)
+
+        def profile():
+            return other.food_items.order_by(
+                FoodItem.created_at.desc(), FoodItem.id.desc()
+            ).limit(page_size)
+
+        cases = [
+            ("public feed", public, lambda: public().all()),
+            ("followed feed", followed, lambda: followed().all()),
+            ("is_following", is_following, lambda: user.is_following(other)),
+            ("profile dishes", profile, lambda: profile().all()),
+        ]
+        for name, build, run in cases:
+            click.echo(f"\n== {name}")
+            for line in explain(build()):
+                click.echo(f"   {line}")
+            median, p95 = timed(run, repeat)
+            click.echo(
+                f"   median {median:.3f} ms, p95 {p95:.3f} ms over {repeat} runs"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""Follow checks against a large synthetic follow graph.
+
+Fills the benchmark database with ``--users`` users following ``--follows``
+others each (two million edges by default), then times rendering follow
+buttons for ``--page`` users three ways: a ``COUNT`` query per user, as
+``is_following`` used to do, a cold :func:`are_following` that rebuilds the
+cached follow list, and a warm one served from the cache::
+
+    python -m benchmarks.follow_graph
+    python -m benchmarks.follow_graph --reuse --page 200
+"""
+import random
+import statistics
+import time
+
+import click
+
+from food_journal.app import create_app
+from food_journal.database import db
+from food_journal.extensions import cache
+from food_journal.user.graph import are_following, followed_ids, followed_version_key
+from food_journal.user.models import User, followers
+from food_journal.utils import bump_cache_versions
+
+
+def populate(users, follows, seed=0):
+    """Insert users and a random follow graph with bulk Core inserts."""
+    rng = random.Random(seed)
+    db.drop_all()
+    db.create_all()
+    db.session.execute(
+        User.__table__.insert(),
+        [
+            {
+                "username": f"user{i}",
+                "email": f"user{i}@example.com",
+                "active": True,
+                "fanout_on_read": False,
+            }
+            for i in range(1, users + 1)
+        ],
+    )
+    batch = []
+    for follower_id in range(1, users + 1):
+        for followed_id in set(rng.sample(range(1, users + 1), follows + 1)) - {
+            follower_id
+        }:
+            batch.append({"follower_id": follower_id, "followed_id": followed_id})
+        if len(batch) >= 50000:
+            db.session.execute(followers.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(followers.insert(), batch)
+    db.session.commit()
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute("ANALYZE")
+        db.session.commit()
+
+
+def timed(func, repeat):
+    """Median and 95th percentile wall time of ``func`` in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+@click.command()
+@click.option("--users", default=100000, show_default=True)
+@click.option("--follows", default=20, show_default=True, help="Follows per user.")
+@click.option(
+    "--page", default=50, show_default=True, help="Users with a follow button per page."
+)
+@click.option("--repeat", default=200, show_default=True)
+@click.option("--reuse", is_flag=True, help="Reuse the data from a previous run.")
+def main(users, follows, page, repeat, reuse):
+    """Time follow checks for a page of users."""
+    app = create_app("benchmarks.settings")
+    cache.init_app(app, config={"CACHE_TYPE": "simple", "CACHE_THRESHOLD": users})
+    with app.test_request_context():
+        if not reuse:
+            click.echo(f"Populating {users:,} users, ~{users * follows:,} follows...")
+            started = time.perf_counter()
+            populate(users, follows)
+            click.echo(f"   done in {time.perf_counter() - started:.1f}s")
+        edges = db.session.execute(
+            db.select([db.func.count()]).select_from(followers)
+        ).scalar()
+        rng = random.Random(1)
+        user_id = rng.randint(1, users)
+        followed = list(followed_ids(user_id))
+        shown = (followed + rng.sample(range(1, users + 1), page))[:page]
+
+        def count_per_user():
+            return {
+                other_id: db.session.execute(
+                    db.select([db.func.count()]).where(
+                        db.and_(
+                            followers.c.follower_id == user_id,
+                            followers.c.followed_id == other_id,
+                        )
+                    )
+                ).scalar()
+                > 0
+                for other_id in shown
+            }
+
+        def cold():
+            bump_cache_versions([followed_version_key(user_id)])
+            return are_following(user_id, shown)
+
+        def warm():
+            return are_following(user_id, shown)
+
+        assert count_per_user() == cold() == warm()
+        click.echo(
+            f"{edges:,} edges; user {user_id} follows {len(followed)}; {page} follow buttons per page"
+        )
+        cases = [
+            ("COUNT per user", count_per_user),
+            ("are_following, cold", cold),
+            ("are_following, warm", warm),
+        ]
+        for name, func in cases:
+            median, p95 = timed(func, repeat)
+            click.echo(
+                f"{name:<22} median {median:8.3f} ms, p95 {p95:8.3f} ms over {repeat} runs"
+            )
+
+        sizes = [
+            len(followed_ids(other_id).tobytes())
+            for other_id in rng.sample(range(1, users + 1), 100)
+        ]
+        click.echo(f"cached follow list: {statistics.mean(sizes):.0f} bytes on average")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Follow suggestions: precomputed top lists against a self-join per page view.
+
+Fills the benchmark database with ``--users`` users following ``--follows``
+others each, times ``flask suggest-follows`` over all of them, then times
+showing one user's suggestions by counting friends of friends with a self-join,
+as a page would have to without the table, and by reading the stored top list.
+Finally it times a follow and an unfollow, which update the stored lists::
+
+    python -m benchmarks.follow_suggestions
+    python -m benchmarks.follow_suggestions --reuse --repeat 500
+"""
+import random
+import statistics
+import time
+
+import click
+
+from benchmarks.follow_graph import populate
+from food_journal.app import create_app
+from food_journal.database import db
+from food_journal.user.models import FollowSuggestion, User
+from food_journal.user.suggestions import mutual_counts, rebuild, suggested_users
+
+
+def timed(func, repeat):
+    """Median and 95th percentile wall time of ``func`` in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        db.session.expire_all()
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+@click.command()
+@click.option("--users", default=20000, show_default=True)
+@click.option("--follows", default=20, show_default=True, help="Follows per user.")
+@click.option("--repeat", default=200, show_default=True)
+@click.option("--reuse", is_flag=True, help="Reuse the data from a previous run.")
+def main(users, follows, repeat, reuse):
+    """Time computing, showing and updating follow suggestions."""
+    app = create_app("benchmarks.settings")
+    with app.test_request_context():
+        if not reuse:
+            click.echo(f"Populating {users:,} users, ~{users * follows:,} follows...")
+            started = time.perf_counter()
+            populate(users, follows)
+            click.echo(f"   done in {time.perf_counter() - started:.1f}s")
+            started = time.perf_counter()
+            written = rebuild()
+            click.echo(
+                f"suggest-follows: {written:,} suggestions in {time.perf_counter() - started:.1f}s"
+            )
+        rng = random.Random(1)
+        user = User.query.get(rng.randint(1, users))
+        shown = app.config["FOLLOW_SUGGESTIONS_SHOWN"]
+
+        def self_join():
+            counted = mutual_counts(
+                lambda mine, theirs: mine.c.follower_id == user.id
+            ).alias()
+            return db.session.execute(
+                db.select([counted.c.suggested_id, counted.c.mutual_count])
+                .order_by(
+                    counted.c.mutual_count.desc(),
+                    counted.c.active_at.desc(),
+                    counted.c.suggested_id.desc(),
+                )
+                .limit(shown)
+            ).fetchall()
+
+        def stored():
+            return [
+                (other.id, mutual_count)
+                for other, mutual_count in suggested_users(user)
+            ]
+
+        assert [tuple(row) for row in self_join()] == stored()
+        click.echo(
+            f"user {user.id}: {FollowSuggestion.query.filter_by(user_id=user.id).count()} stored suggestions"
+        )
+        for label, func in [
+            ("self-join per view", self_join),
+            ("stored top list", stored),
+        ]:
+            median, p95 = timed(func, repeat)
+            click.echo(
+                f"   {label:<22} median {median:8.3f} ms, p95 {p95:8.3f} ms over {repeat} runs"
+            )
+
+        others = [
+            User.query.get(other_id)
+            for other_id in rng.sample(range(1, users + 1), repeat)
+        ]
+        others = [
+            other
+            for other in others
+            if other.id != user.id and not user.follows_in_session(other)
+        ]
+        db.session.commit()
+
+        def toggle(change):
+            user = User.query.get(user_id)
+            other = User.query.get(next(pending))
+            change(user, other)
+            db.session.commit()
+
+        user_id = user.id
+        for label, change in [
+            ("follow + commit", User.follow),
+            ("unfollow + commit", User.unfollow),
+        ]:
+            pending = iter([other.id for other in others])
+            median, p95 = timed(lambda: toggle(change), len(others))
+            click.echo(
+                f"   {label:<22} median {median:8.3f} ms, p95 {p95:8.3f} ms over {len(others)} runs"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Derivative encoding throughput, per core and across cores.
+
+Encodes synthetic photo-sized images (noise over a gradient, which compresses
+about as badly as a real photo) with the same code the upload path uses.
+"""
+import io
+import os
+import time
+from multiprocessing import Pool
+
+import click
+from PIL import Image
+
+from food_journal.app import create_app
+from food_journal.public.images import make_derivatives
+
+
+def synthetic_jpeg(width, height, seed):
+    """A JPEG of the given size that does not compress unrealistically well."""
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 64 + seed % 32)
+    image = Image.merge("RGB", (gradient, noise, Image.blend(gradient, noise, 0.5)))
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+def encode(data):
+    """Encode all derivatives of one image; return how many bytes were produced."""
+    with APP.app_context():
+        return sum(len(d[3]) for d in make_derivatives(io.BytesIO(data)))
+
+
+def init_worker():
+    """Create the app each worker process encodes in."""
+    global APP
+    APP = create_app("benchmarks.settings")
+
+
+@click.command()
+@click.option("--images", default=24, show_default=True)
+@click.option("--width", default=4032, show_default=True)
+@click.option("--height", default=3024, show_default=True)
+@click.option("--processes", default=os.cpu_count(), show_default=True)
+def main(images, width, height, processes):
+    """Report derivative encoding throughput."""
+    click.echo(f"Generating {images} images of {width}x{height}...")
+    inputs = [synthetic_jpeg(width, height, seed) for seed in range(images)]
+
+    for workers in sorted({1, processes}):
+        with Pool(workers, initializer=init_worker) as pool:
+            started = time.perf_counter()
+            produced = sum(pool.map(encode, inputs, chunksize=1))
+            elapsed = time.perf_counter() - started
+        rate = images / elapsed
+        click.echo(
+            f"{workers:3} process(es): {rate:6.2f} images/s, {rate / workers:6.2f} images/s per core, "
+            f"{produced / images / 1024:7.1f} KiB of derivatives per image"
+        )
+
+
+if __name__ == "__main__":
+    main()
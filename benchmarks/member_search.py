@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Member search: prefix index range scans against ``ILIKE`` scans.
+
+Fills the benchmark database with ``--users`` members with random usernames
+and names (a million by default), then times typeahead suggestions and the
+first directory page for prefixes from common to unmatched, once through
+:mod:`food_journal.user.directory` and once with the ``ILIKE 'prefix%'``
+query a directory would naively run::
+
+    python -m benchmarks.member_search
+    python -m benchmarks.member_search --reuse --repeat 500
+"""
+import random
+import statistics
+import time
+
+import click
+
+from food_journal.app import create_app
+from food_journal.database import db
+from food_journal.user.directory import SEARCH_COLUMNS, members_page, typeahead
+from food_journal.user.models import User
+
+SYLLABLES = [
+    "an",
+    "ba",
+    "ce",
+    "do",
+    "el",
+    "fi",
+    "ga",
+    "ho",
+    "is",
+    "ju",
+    "ka",
+    "lo",
+    "ma",
+    "ne",
+    "or",
+    "pa",
+    "ri",
+    "sa",
+]
+
+
+def name(rng, syllables):
+    """A random name of ``syllables`` syllables."""
+    return "".join(rng.choice(SYLLABLES) for _ in range(syllables))
+
+
+def populate(users, seed=0):
+    """Insert ``users`` members with bulk Core inserts."""
+    rng = random.Random(seed)
+    db.drop_all()
+    db.create_all()
+    batch = []
+    for i in range(1, users + 1):
+        batch.append(
+            {
+                "username": f"{name(rng, 3)}{i}",
+                "email": f"user{i}@example.com",
+                "first_name": name(rng, 2).capitalize(),
+                "last_name": name(rng, 3).capitalize(),
+                "active": True,
+                "fanout_on_read": False,
+            }
+        )
+        if len(batch) == 50000:
+            db.session.execute(User.__table__.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(User.__table__.insert(), batch)
+    db.session.commit()
+    db.session.execute("ANALYZE")
+    db.session.commit()
+
+
+def matching(prefix):
+    """Members matching ``prefix`` in any column, with ILIKE."""
+    pattern = f"{prefix}%"
+    return User.query.filter(
+        User.active.is_(True),
+        db.or_(*(column.ilike(pattern) for column in SEARCH_COLUMNS)),
+    )
+
+
+def ilike(prefix, limit):
+    """The naive query: match every column with ILIKE, then sort by username."""
+    return (
+        matching(prefix)
+        .order_by(db.func.lower(User.username), User.id)
+        .limit(limit)
+        .all()
+    )
+
+
+def timed(func, repeat):
+    """Median and 95th percentile wall time of ``func`` in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        db.session.expire_all()
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+@click.command()
+@click.option("--users", default=1000000, show_default=True)
+@click.option("--repeat", default=50, show_default=True)
+@click.option("--reuse", is_flag=True, help="Reuse the data from a previous run.")
+def main(users, repeat, reuse):
+    """Time prefix searches."""
+    app = create_app("benchmarks.settings")
+    with app.test_request_context():
+        if not reuse:
+            click.echo(f"Populating {users:,} users...")
+            started = time.perf_counter()
+            populate(users)
+            click.echo(f"   done in {time.perf_counter() - started:.1f}s")
+        limit = app.config["TYPEAHEAD_LIMIT"]
+        page_size = app.config["MEMBERS_PAGE_SIZE"]
+        # ILIKE walks the username index until it has a page, so the rarer the match the longer it scans
+        for prefix in ("m", "ma", "man", "mane", "manema", "zq"):
+            found = {user.id for user in members_page(prefix, page_size=page_size)}
+            assert len(found) == len(ilike(prefix, page_size))
+            assert {
+                user.id for user in matching(prefix).filter(User.id.in_(found))
+            } == found
+            click.echo(f"\n== prefix {prefix!r}")
+            cases = [
+                ("typeahead", lambda: typeahead(prefix, limit)),
+                ("directory page", lambda: members_page(prefix, page_size=page_size)),
+                ("ILIKE", lambda: ilike(prefix, page_size)),
+            ]
+            for label, func in cases:
+                median, p95 = timed(func, repeat)
+                click.echo(
+                    f"   {label:<15} median {median:9.3f} ms, p95 {p95:9.3f} ms over {repeat} runs"
+                )
+
+
+if __name__ == "__main__":
+    main()
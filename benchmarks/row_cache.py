@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Loading rows by id: the session only, against the row cache.
+
+Fills the benchmark database with ``--users`` users, then times loading
+``--page`` of them by id in a fresh session, as each request starts with:
+one ``query.get`` per id, one ``get_many_by_id`` batch with a cold cache, and
+``get_by_id`` and ``get_many_by_id`` with a warm one::
+
+    python -m benchmarks.row_cache
+    python -m benchmarks.row_cache --reuse --page 200
+"""
+import random
+import statistics
+import time
+
+import click
+
+from food_journal.app import create_app
+from food_journal.database import db
+from food_journal.extensions import row_cache
+from food_journal.user.models import User
+
+
+def populate(users):
+    """Insert ``users`` users."""
+    db.drop_all()
+    db.create_all()
+    User.bulk_create(
+        {
+            "username": f"user{i}",
+            "email": f"user{i}@example.com",
+            "first_name": "Cook",
+            "active": True,
+        }
+        for i in range(1, users + 1)
+    )
+
+
+def timed(func, repeat):
+    """Median and 95th percentile wall time of ``func`` in a fresh session, in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        db.session.remove()
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+@click.command()
+@click.option("--users", default=100000, show_default=True)
+@click.option("--page", default=50, show_default=True, help="Users loaded per request.")
+@click.option("--repeat", default=200, show_default=True)
+@click.option("--reuse", is_flag=True, help="Reuse the data from a previous run.")
+def main(users, page, repeat, reuse):
+    """Time loading users by id."""
+    app = create_app("benchmarks.settings")
+    with app.test_request_context():
+        if not reuse:
+            click.echo(f"Populating {users:,} users...")
+            populate(users)
+        ids = random.Random(0).sample(range(1, users + 1), page)
+
+        def cold():
+            row_cache.clear()
+            return User.get_many_by_id(ids)
+
+        cases = [
+            ("query.get per id", lambda: [User.query.get(user_id) for user_id in ids]),
+            ("get_many_by_id, cold", cold),
+            (
+                "get_by_id per id, warm",
+                lambda: [User.get_by_id(user_id) for user_id in ids],
+            ),
+            ("get_many_by_id, warm", lambda: User.get_many_by_id(ids)),
+        ]
+        click.echo(f"{page} users per request")
+        for label, func in cases:
+            median, p95 = timed(func, repeat)
+            click.echo(
+                f"   {label:<24} median {median:8.3f} ms, p95 {p95:8.3f} ms over {repeat} runs"
+            )
+        click.echo(f"   {row_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Cost of building an S3 client per upload versus reusing the app's client.
+
+Without ``--bucket`` only client construction is timed. With it, each sample
+also makes a request (``HeadBucket``), so the cost of opening a fresh
+connection, TLS handshake included, shows up next to a pooled one.
+"""
+import statistics
+import time
+
+import boto3
+import click
+
+from food_journal.app import create_app
+from food_journal.extensions import s3
+
+
+def timed(func, repeat):
+    """Median and 95th percentile wall time of ``func`` in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+@click.command()
+@click.option("--repeat", default=100, show_default=True)
+@click.option(
+    "--bucket", help="Also make a request against this bucket on each sample."
+)
+def main(repeat, bucket):
+    """Compare per-call client construction with the shared client."""
+    app = create_app("benchmarks.settings")
+    with app.app_context():
+
+        def request(client):
+            if bucket:
+                client.head_bucket(Bucket=bucket)
+
+        cases = [
+            ("boto3.client('s3') per call", lambda: request(boto3.client("s3"))),
+            ("shared s3.client", lambda: request(s3.client)),
+        ]
+        s3.client  # build the shared client outside the timings
+        for name, run in cases:
+            median, p95 = timed(run, repeat)
+            click.echo(
+                f"{name:30} median {median:8.3f} ms, p95 {p95:8.3f} ms over {repeat} runs"
+            )
+
+
+if __name__ == "__main__":
+    main()
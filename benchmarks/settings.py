@@ -0,0 +1,49 @@
+"""Settings module for benchmarks.
+
+Point BENCHMARK_DATABASE_URL at a scratch Postgres database to get
+representative plans; the default SQLite file is only good for smoke runs.
+"""
+import os
+
+ENV = "production"
+SQLALCHEMY_DATABASE_URI = os.environ.get(
+    "BENCHMARK_DATABASE_URL", "sqlite:////tmp/food_journal_benchmark.db"
+)
+SECRET_KEY = "not-so-secret-in-benchmarks"
+BCRYPT_LOG_ROUNDS = 4
+BCRYPT_POOL_SIZE = 2
+DEBUG_TB_ENABLED = False
+CACHE_TYPE = "null"
+SQLALCHEMY_TRACK_MODIFICATIONS = False
+SQLALCHEMY_BINDS = {}
+REPLICA_MAX_LAG = 5.0
+BULK_CHUNK_SIZE = 1000
+STORAGE_BACKEND = os.environ.get("BENCHMARK_STORAGE_BACKEND", "memory")
+STORAGE_LOCAL_ROOT = "/tmp/food_journal_benchmark/media"
+STORAGE_CACHE_TIMEOUT = 3600
+S3_BUCKET_NAME = "food-journal-benchmark"
+S3_OBJECT_URL_TEMPLATE = "https://{}.s3.amazonaws.com/{}"
+S3_BLOB_PREFIX = "blobs/"
+S3_UPLOAD_MODE = "sync"
+S3_PRESIGNED_POST_EXPIRES = 600
+IMAGE_DERIVATIVE_FORMATS = ["webp"]
+IMAGE_QUALITY = 80
+S3_MAX_POOL_CONNECTIONS = 10
+S3_MAX_ATTEMPTS = 1
+S3_CONNECT_TIMEOUT = 5.0
+S3_READ_TIMEOUT = 30.0
+FEED_PAGE_SIZE = 20
+TIMELINE_FANOUT_LIMIT = 5000
+TIMELINE_BACKFILL_SIZE = 200
+FEED_CACHE_TIMEOUT = 300
+IDENTITY_CACHE_TIMEOUT = 60
+FOLLOW_GRAPH_CACHE_TIMEOUT = 3600
+ROW_CACHE_TIMEOUT = 30
+ROW_CACHE_SIZE = 10000
+MEMBERS_PAGE_SIZE = 30
+TYPEAHEAD_LIMIT = 10
+FOLLOW_SUGGESTIONS_SIZE = 20
+FOLLOW_SUGGESTIONS_SHOWN = 5
+FOLLOW_SUGGESTIONS_ACTIVE_DAYS = 90
+LAST_SEEN_INTERVAL = 300
+LAST_SEEN_FLUSH_INTERVAL = 30.0
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Coalesced ``last_seen`` writes.
+
+Recording when a user was last seen used to commit an UPDATE on every
+request, a write transaction and a row lock just for viewing a page. Instead,
+:meth:`ActivityTracker.seen` buffers the time in memory and a background
+thread writes the buffer every ``LAST_SEEN_FLUSH_INTERVAL`` seconds, in one
+executemany UPDATE. A user is buffered at most once per
+``LAST_SEEN_INTERVAL`` seconds, so ``last_seen`` is that precise and most
+page views write nothing.
+
+The buffer belongs to the process, and the thread is started in each process
+on first use, after gunicorn has forked. What is still buffered when the
+process exits is written then; a crash loses at most one flush interval.
+"""
+import atexit
+import datetime as dt
+import threading
+import time
+
+from flask import current_app
+
+from food_journal.process import ProcessState
+
+
+class _ActivityState(ProcessState):
+    """Per-app buffer; it and the flushing thread are per process."""
+
+    def __init__(self, app, tracker):
+        super().__init__()
+        self.app = app
+        self.tracker = tracker
+        self.interval = app.config["LAST_SEEN_INTERVAL"]
+        self.flush_interval = app.config["LAST_SEEN_FLUSH_INTERVAL"]
+        self.pending = {}
+        self.next_write = {}
+        self.flushed = 0
+
+    def reset(self):
+        """Start the flushing thread of a new process."""
+        # a forked child must not write what the parent buffered
+        self.pending = {}
+        self.next_write = {}
+        thread = threading.Thread(
+            target=self.tracker.run, args=(self.app,), name="last-seen", daemon=True
+        )
+        thread.start()
+        atexit.register(self.tracker.flush_logged, self.app)
+
+
+class ActivityTracker(object):
+    """Flask extension buffering when users were last seen."""
+
+    def __init__(self, app=None):
+        """Create instance."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Register the extension; the flushing thread starts on first use."""
+        app.extensions["activity"] = _ActivityState(app, self)
+
+    def seen(self, user_id):
+        """Record that ``user_id`` is active now, unless they were recorded within ``LAST_SEEN_INTERVAL``."""
+        state = current_app.extensions["activity"].for_process()
+        now = time.monotonic()
+        with state.lock:
+            if state.next_write.get(user_id, 0) > now:
+                return
+            state.next_write[user_id] = now + state.interval
+            state.pending[user_id] = dt.datetime.utcnow()
+
+    def flush(self):
+        """Write the buffered times in one statement; return how many users were written."""
+        from food_journal.database import db
+        from food_journal.user.models import User
+
+        state = current_app.extensions["activity"]
+        with state.lock:
+            pending, state.pending = state.pending, {}
+            now = time.monotonic()
+            # forget users whose interval is over, so the map only holds recent users
+            state.next_write = {
+                user_id: at for user_id, at in state.next_write.items() if at > now
+            }
+        if not pending:
+            return 0
+        with db.engine.begin() as connection:
+            connection.execute(
+                User.__table__.update()
+                .where(User.id == db.bindparam("user_id"))
+                .values(last_seen=db.bindparam("seen")),
+                [
+                    {"user_id": user_id, "seen": seen}
+                    for user_id, seen in pending.items()
+                ],
+            )
+        with state.lock:
+            state.flushed += len(pending)
+        return len(pending)
+
+    def run(self, app):
+        """Flush every ``LAST_SEEN_FLUSH_INTERVAL`` seconds, for good."""
+        state = app.extensions["activity"]
+        while True:
+            time.sleep(state.flush_interval)
+            self.flush_logged(app)
+
+    def flush_logged(self, app):
+        """Flush the buffer of ``app``, logging rather than raising errors."""
+        with app.app_context():
+            try:
+                self.flush()
+            except Exception:
+                app.logger.exception("Could not write last_seen times")
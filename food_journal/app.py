@@ -7,6 +7,7 @@ from flask import Flask, render_template
 
 from food_journal import commands, public, user
 from food_journal.extensions import (
+    activity,
     bcrypt,
     cache,
     csrf_protect,
@@ -16,6 +17,10 @@ from food_journal.extensions import (
     login_manager,
     migrate,
     moment,
+    passwords,
+    row_cache,
+    s3,
+    storage,
 )
 
 
@@ -26,7 +31,7 @@ def create_app(config_object="food_journal.settings"):
     """
     app = Flask(__name__.split(".")[0])
     app.config.from_object(config_object)
-    #print(app.config)
+    # print(app.config)
     register_extensions(app)
     register_blueprints(app)
     register_errorhandlers(app)
@@ -39,6 +44,7 @@ def create_app(config_object="food_journal.settings"):
 def register_extensions(app):
     """Register Flask extensions."""
     bcrypt.init_app(app)
+    passwords.init_app(app)
     cache.init_app(app)
     db.init_app(app)
     csrf_protect.init_app(app)
@@ -47,6 +53,10 @@ def register_extensions(app):
     migrate.init_app(app, db)
     flask_static_digest.init_app(app)
     moment.init_app(app)
+    s3.init_app(app)
+    storage.init_app(app)
+    activity.init_app(app)
+    row_cache.init_app(app)
     return None
 
 
@@ -55,11 +65,11 @@ def register_blueprints(app):
     app.register_blueprint(public.views.blueprint)
     app.register_blueprint(user.views.blueprint)
     return None
- 
+
 
 def register_errorhandlers(app):
     """Register error handlers."""
-    
+
     def render_error(error):
         """Render error template."""
         # If a HTTPException, pull the `code` attribute; default to 500
@@ -85,6 +95,13 @@ def register_commands(app):
     """Register Click commands."""
     app.cli.add_command(commands.test)
     app.cli.add_command(commands.lint)
+    app.cli.add_command(commands.rebuild_timelines)
+    app.cli.add_command(commands.reconcile_counters)
+    app.cli.add_command(commands.suggest_follows)
+    app.cli.add_command(commands.upload_worker)
+    app.cli.add_command(commands.prune_blobs)
+    app.cli.add_command(commands.import_dishes)
+    app.cli.add_command(commands.bcrypt_calibrate)
 
 
 def configure_logger(app):
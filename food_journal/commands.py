@@ -5,6 +5,7 @@ from glob import glob
 from subprocess import call
 
 import click
+from flask.cli import with_appcontext
 
 HERE = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT = os.path.join(HERE, os.pardir)
@@ -63,3 +64,176 @@ def lint(fix_imports, check):
         execute_tool("Fixing import order", "isort", *isort_args)
     execute_tool("Formatting style", "black", *black_args)
     execute_tool("Checking code style", "flake8")
+
+
+@click.command("rebuild-timelines")
+@with_appcontext
+def rebuild_timelines():
+    """Rebuild every user's home timeline from the follow graph."""
+    from food_journal.database import db
+    from food_journal.user.models import TimelineEntry
+
+    count = TimelineEntry.rebuild()
+    db.session.commit()
+    click.echo(f"Rebuilt timelines with {count} entries.")
+
+
+@click.command("reconcile-counters")
+@with_appcontext
+def reconcile_counters():
+    """Recompute every user's follower, following and dish counts."""
+    from food_journal.database import db
+    from food_journal.user.models import User
+
+    count = User.reconcile_counters()
+    db.session.commit()
+    click.echo(f"Repaired the counters of {count} users.")
+
+
+@click.command("suggest-follows")
+@click.option(
+    "--batch-size", default=1000, show_default=True, help="Users per transaction."
+)
+@with_appcontext
+def suggest_follows(batch_size):
+    """Recompute every user's follow suggestions; run it periodically, e.g. nightly."""
+    from food_journal.user.suggestions import rebuild
+
+    written = rebuild(batch_size=batch_size)
+    click.echo(f"Wrote {written} follow suggestions.")
+
+
+@click.command("upload-worker")
+@click.option(
+    "--once", is_flag=True, help="Exit once no uploads are due, instead of polling."
+)
+@with_appcontext
+def upload_worker(once):
+    """Send queued uploads to S3 (for S3_UPLOAD_MODE=async)."""
+    from food_journal.public.uploads import run_worker
+
+    processed = run_worker(once=once)
+    click.echo(f"Processed {processed} uploads.")
+
+
+@click.command("prune-blobs")
+@with_appcontext
+def prune_blobs():
+    """Delete stored images no dish references any more."""
+    from food_journal.public.uploads import prune_blobs
+
+    pruned = prune_blobs()
+    click.echo(f"Deleted {pruned} unreferenced blobs.")
+
+
+@click.command("import-dishes")
+@click.argument("source", type=click.Path(exists=True))
+@click.option(
+    "--manifest",
+    required=True,
+    type=click.Path(exists=True, dir_okay=False),
+    help="CSV, JSON or JSON Lines file with image, title, comment, is_public, created_at and username.",
+)
+@click.option(
+    "--workers",
+    default=8,
+    show_default=True,
+    help="Images read, resized and stored at once.",
+)
+@click.option(
+    "--batch-size",
+    default=500,
+    show_default=True,
+    help="Dishes inserted per transaction.",
+)
+@click.option(
+    "--name",
+    help="Name the progress is saved under; defaults to the manifest's file name.",
+)
+@click.option(
+    "--restart", is_flag=True, help="Start from the first row, ignoring saved progress."
+)
+@with_appcontext
+def import_dishes(source, manifest, workers, batch_size, name, restart):
+    """Import the dishes in a directory or zip archive of images."""
+    from food_journal.public import imports
+    from food_journal.storage import StorageError
+
+    try:
+        rows = imports.read_manifest(manifest)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--manifest")
+    try:
+        stats = imports.import_dishes(
+            imports.ImageSource(source),
+            rows,
+            name or os.path.basename(manifest),
+            workers=workers,
+            batch_size=batch_size,
+            restart=restart,
+            report=click.echo,
+        )
+    except StorageError as e:
+        raise click.ClickException(f"{e}; run the command again to resume")
+    click.echo(f"Done in {stats.elapsed:.1f}s.")
+
+
+@click.command("bcrypt-calibrate")
+@click.option(
+    "--target-ms",
+    default=250,
+    show_default=True,
+    help="Time one password check should take.",
+)
+@click.option(
+    "--min-rounds",
+    type=click.IntRange(4, 31),
+    default=10,
+    show_default=True,
+    help="Never recommend a lower cost, however slow the host.",
+)
+@click.option(
+    "--write-env",
+    type=click.Path(dir_okay=False),
+    help="Set BCRYPT_LOG_ROUNDS to the recommended cost in this .env file.",
+)
+@with_appcontext
+def bcrypt_calibrate(target_ms, min_rounds, write_env):
+    """Recommend the bcrypt cost that takes about --target-ms on this host."""
+    from flask import current_app
+
+    from food_journal.passwords import calibrate
+
+    rounds, timings = calibrate(target_ms / 1000, minimum=min_rounds)
+    for cost, seconds in timings.items():
+        marker = " <- recommended" if cost == rounds else ""
+        click.echo(f"{cost:>2} rounds: {seconds * 1000:9.1f} ms{marker}")
+    if timings[rounds] > target_ms / 1000:
+        click.echo(
+            f"Even {rounds} rounds, the minimum, take longer than {target_ms} ms on this host."
+        )
+    click.echo(
+        f"Current BCRYPT_LOG_ROUNDS is {current_app.config['BCRYPT_LOG_ROUNDS']}."
+    )
+    if write_env:
+        set_env_value(write_env, "BCRYPT_LOG_ROUNDS", rounds)
+        click.echo(
+            f"Set BCRYPT_LOG_ROUNDS={rounds} in {write_env}; restart the app to apply it."
+        )
+
+
+def set_env_value(path, name, value):
+    """Set ``name`` in a .env file, replacing an existing assignment."""
+    lines = []
+    if os.path.exists(path):
+        with open(path) as env_file:
+            lines = env_file.read().splitlines()
+    assignment = f"{name}={value}"
+    for index, line in enumerate(lines):
+        if line.split("=", 1)[0].strip() == name:
+            lines[index] = assignment
+            break
+    else:
+        lines.append(assignment)
+    with open(path, "w") as env_file:
+        env_file.write("\n".join(lines) + "\n")
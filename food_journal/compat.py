@@ -16,3 +16,14 @@ else:
     string_types = (str,)
     unicode = str
     basestring = (str, bytes)
+
+try:
+    import orjson
+
+    json_dumps = orjson.dumps
+except ImportError:
+    import json
+
+    def json_dumps(obj):
+        """Serialize ``obj`` to compact JSON bytes."""
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
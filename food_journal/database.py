@@ -1,15 +1,79 @@
 # -*- coding: utf-8 -*-
 """Database module, including the SQLAlchemy database object and DB-related utilities."""
+import pickle
+from itertools import chain
+
+from flask import current_app
+from sqlalchemy.dialects import mysql, postgresql
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import String
+
 from .compat import basestring
-from .extensions import db
+from .extensions import db, row_cache
+from .routing import reads_from_replica, stick_to_primary
 
 # Alias common SQLAlchemy names
 Column = db.Column
 relationship = db.relationship
 
 
+def chunked(items, size):
+    """Split the iterable ``items`` into lists of at most ``size`` items."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _matching(columns, keys):
+    """Filter on ``columns`` having the values of one of the tuples ``keys``."""
+    if len(columns) == 1:
+        return columns[0].in_([key[0] for key in keys])
+    return db.tuple_(*columns).in_(keys)
+
+
+def _update_statement(table, match, names):
+    """An UPDATE setting ``names`` on the row matching ``match``, to execute with :func:`_update_params`."""
+    return (
+        table.update()
+        .where(
+            db.and_(*(table.c[name] == db.bindparam(f"match_{name}") for name in match))
+        )
+        .values({name: db.bindparam(f"set_{name}") for name in names})
+    )
+
+
+def _update_params(rows, match, names):
+    # bound parameters may not be named after the updated columns
+    return [
+        dict(
+            {f"match_{name}": row[name] for name in match},
+            **{f"set_{name}": row[name] for name in names},
+        )
+        for row in rows
+    ]
+
+
 class CRUDMixin(object):
-    """Mixin that adds convenience methods for CRUD (create, read, update, delete) operations."""
+    """Mixin that adds convenience methods for CRUD (create, read, update, delete) operations.
+
+    The ``bulk_*`` and ``upsert`` class methods write many rows at once, given as
+    dicts keyed by column name. Rows are sent BULK_CHUNK_SIZE at a time, or
+    ``chunk_size``, as one multi-row ``VALUES`` statement on Postgres and MySQL
+    and as an executemany elsewhere, and committed once at the end unless
+    ``commit`` is false. By default they bypass the ORM: no instances are
+    loaded or created, so ``__init__``, Python-side validation and session
+    events such as ``AWS_Mixin.before_commit``, ``count_food_items`` and the
+    timeline fan-out do not run for these rows, and their callers take care of
+    what those would have done. Pass ``orm_events=True`` to go through the
+    session instead, still one flush per chunk.
+    """
 
     @classmethod
     def create(cls, **kwargs):
@@ -35,6 +99,251 @@ class CRUDMixin(object):
         db.session.delete(self)
         return commit and db.session.commit()
 
+    @classmethod
+    def _primary_key(cls):
+        return [column.key for column in cls.__mapper__.primary_key]
+
+    @classmethod
+    def _dialect(cls):
+        return db.session.get_bind(mapper=cls.__mapper__).dialect.name
+
+    @classmethod
+    def _chunks(cls, rows, chunk_size):
+        return chunked(rows, chunk_size or current_app.config["BULK_CHUNK_SIZE"])
+
+    @classmethod
+    def _load(cls, keys):
+        """The instances with the primary key tuples ``keys``, by primary key tuple."""
+        instances = db.session.query(cls).filter(
+            _matching(cls.__mapper__.primary_key, keys)
+        )
+        return {db.inspect(instance).identity: instance for instance in instances}
+
+    @classmethod
+    def _key_tuples(cls, idents):
+        return [ident if isinstance(ident, tuple) else (ident,) for ident in idents]
+
+    @staticmethod
+    def _ident(key):
+        return key[0] if len(key) == 1 else tuple(key)
+
+    @staticmethod
+    def _finish(commit):
+        if commit:
+            db.session.commit()
+
+    @classmethod
+    def _forget_cached(cls, idents):
+        """Evict written rows of a model cached by id once the transaction ends; None evicts them all."""
+        if getattr(cls, "__cache_by_id__", False):
+            forget_on_commit(db.session, [(cls.__name__, ident) for ident in idents])
+
+    @classmethod
+    def _returned_keys(cls, chunk, match):
+        """Insert ``chunk`` in one statement; the new primary keys, in the order of ``chunk`` by ``match``."""
+        table = cls.__table__
+        matched = [table.c[match]] if match else []
+        result = db.session.execute(
+            table.insert().values(chunk).returning(*table.primary_key, *matched)
+        )
+        if not match:
+            return [cls._ident(row) for row in result]
+        keys = {row[-1]: cls._ident(row[:-1]) for row in result}
+        return [keys[row[match]] for row in chunk]
+
+    @classmethod
+    def _before_bulk_delete(cls, keys):
+        """Hook run before the records with the primary key tuples ``keys`` are deleted without the ORM."""
+
+    @classmethod
+    def bulk_create(
+        cls,
+        rows,
+        chunk_size=None,
+        return_keys=False,
+        match=None,
+        orm_events=False,
+        commit=True,
+    ):
+        """Insert a record for each dict in ``rows``; every dict must have the same keys.
+
+        With ``return_keys``, returns the primary keys of the new records:
+        tuples for a composite primary key. Postgres returns them from the
+        multi-row ``INSERT`` in no promised order; name a unique column set in
+        ``rows`` as ``match`` to get them in the order of ``rows``. Other
+        databases, which cannot return them, insert one row per statement
+        instead, and their keys are always in the order of ``rows``.
+        """
+        keys = [] if return_keys else None
+        table = cls.__table__
+        dialect = cls._dialect()
+        compiled = {}
+        for chunk in cls._chunks(rows, chunk_size):
+            if orm_events:
+                instances = [cls(**row) for row in chunk]
+                db.session.add_all(instances)
+                db.session.flush()
+                if return_keys:
+                    keys.extend(
+                        cls._ident(db.inspect(instance).identity)
+                        for instance in instances
+                    )
+            elif return_keys and dialect == "postgresql":
+                keys.extend(cls._returned_keys(chunk, match))
+            elif return_keys:
+                # compiled once for every row, which takes longer than running it on SQLite
+                connection = db.session.connection(
+                    mapper=cls.__mapper__
+                ).execution_options(compiled_cache=compiled)
+                statement = table.insert()
+                keys.extend(
+                    cls._ident(connection.execute(statement, row).inserted_primary_key)
+                    for row in chunk
+                )
+            elif dialect in ("postgresql", "mysql"):
+                db.session.execute(table.insert().values(chunk))
+            else:
+                db.session.execute(table.insert(), chunk)
+        if not orm_events:
+            # nothing to evict, but rows read in this transaction must not be cached
+            cls._forget_cached([])
+        cls._finish(commit)
+        return keys
+
+    @classmethod
+    def bulk_update(cls, rows, chunk_size=None, orm_events=False, commit=True):
+        """Update records from dicts of their primary key and the columns to set.
+
+        Every dict must have the same keys; the values are set as they are, so
+        use a SQL statement for relative changes such as counters.
+        """
+        names = cls._primary_key()
+        for chunk in cls._chunks(rows, chunk_size):
+            columns = [name for name in chunk[0] if name not in names]
+            if orm_events:
+                instances = cls._load(
+                    [tuple(row[name] for name in names) for row in chunk]
+                )
+                for row in chunk:
+                    instance = instances.get(tuple(row[name] for name in names))
+                    if instance is not None:
+                        for name in columns:
+                            setattr(instance, name, row[name])
+                db.session.flush()
+            elif columns:
+                db.session.execute(
+                    _update_statement(cls.__table__, names, columns),
+                    _update_params(chunk, names, columns),
+                )
+                cls._forget_cached(
+                    cls._ident([row[name] for name in names]) for row in chunk
+                )
+        cls._finish(commit)
+
+    @classmethod
+    def bulk_delete(cls, idents, chunk_size=None, orm_events=False, commit=True):
+        """Delete the records with the primary keys ``idents``; tuples for a composite primary key.
+
+        Returns the number of records deleted.
+        """
+        deleted = 0
+        for chunk in cls._chunks(idents, chunk_size):
+            keys = cls._key_tuples(chunk)
+            if orm_events:
+                instances = cls._load(keys).values()
+                for instance in instances:
+                    db.session.delete(instance)
+                db.session.flush()
+                deleted += len(instances)
+            else:
+                cls._before_bulk_delete(keys)
+                result = db.session.execute(
+                    cls.__table__.delete().where(
+                        _matching(cls.__mapper__.primary_key, keys)
+                    )
+                )
+                deleted += result.rowcount
+                cls._forget_cached(cls._ident(key) for key in keys)
+        cls._finish(commit)
+        return deleted
+
+    @classmethod
+    def upsert(
+        cls, rows, index_elements=None, update=None, chunk_size=None, commit=True
+    ):
+        """Insert the dicts in ``rows``, updating the records that already exist instead.
+
+        A record exists if it has the same values for the unique columns
+        ``index_elements``, the primary key by default. ``update`` names the
+        columns set on existing records, by default every other column in the
+        rows; pass an empty list to leave them untouched. Every dict must have
+        the same keys.
+
+        Postgres (``INSERT ... ON CONFLICT``) and MySQL (``INSERT ... ON
+        DUPLICATE KEY UPDATE``) do this atomically. Elsewhere each chunk's
+        existing records are looked up first and updated, and the others
+        inserted, so a record inserted by a concurrent transaction in between
+        fails the insert with an :class:`~sqlalchemy.exc.IntegrityError`. There
+        is no ORM event path: upserted rows are never loaded into the session.
+        """
+        table = cls.__table__
+        index_elements = list(index_elements or cls._primary_key())
+        by_primary_key = sorted(index_elements) == sorted(cls._primary_key())
+        dialect = cls._dialect()
+        for chunk in cls._chunks(rows, chunk_size):
+            if by_primary_key:
+                cls._forget_cached(
+                    cls._ident([row[name] for name in cls._primary_key()])
+                    for row in chunk
+                )
+            else:
+                cls._forget_cached([None])
+            columns = (
+                list(update)
+                if update is not None
+                else [name for name in chunk[0] if name not in index_elements]
+            )
+            if dialect == "postgresql":
+                statement = postgresql.insert(table).values(chunk)
+                if columns:
+                    statement = statement.on_conflict_do_update(
+                        index_elements=index_elements,
+                        set_={name: statement.excluded[name] for name in columns},
+                    )
+                else:
+                    statement = statement.on_conflict_do_nothing(
+                        index_elements=index_elements
+                    )
+                db.session.execute(statement)
+            elif dialect == "mysql":
+                statement = mysql.insert(table).values(chunk)
+                # setting a column to itself leaves the existing row as it is
+                assignments = columns or index_elements[:1]
+                db.session.execute(
+                    statement.on_duplicate_key_update(
+                        {name: statement.inserted[name] for name in assignments}
+                    )
+                )
+            else:
+                match = [table.c[name] for name in index_elements]
+                keys = [tuple(row[name] for name in index_elements) for row in chunk]
+                found = {
+                    tuple(row)
+                    for row in db.session.execute(
+                        db.select(match).where(_matching(match, keys))
+                    )
+                }
+                existing = [row for row, key in zip(chunk, keys) if key in found]
+                new = [row for row, key in zip(chunk, keys) if key not in found]
+                if existing and columns:
+                    db.session.execute(
+                        _update_statement(table, index_elements, columns),
+                        _update_params(existing, index_elements, columns),
+                    )
+                if new:
+                    db.session.execute(table.insert(), new)
+        cls._finish(commit)
+
 
 class Model(CRUDMixin, db.Model):
     """Base model class that includes CRUD convenience methods."""
@@ -45,9 +354,17 @@ class Model(CRUDMixin, db.Model):
 # From Mike Bayer's "Building the app" talk
 # https://speakerdeck.com/zzzeek/building-the-app
 class SurrogatePK(object):
-    """A mixin that adds a surrogate integer 'primary key' column named ``id`` to any declarative-mapped class."""
+    """A mixin that adds a surrogate integer 'primary key' column named ``id`` to any declarative-mapped class.
+
+    Models setting ``__cache_by_id__`` have the rows loaded by :meth:`get_by_id`
+    and :meth:`get_many_by_id` kept in :mod:`food_journal.row_cache`, except
+    for the columns in ``__cache_by_id_exclude__``, which are loaded when first
+    accessed.
+    """
 
     __table_args__ = {"extend_existing": True}
+    __cache_by_id__ = False
+    __cache_by_id_exclude__ = frozenset()
 
     id = Column(db.Integer, primary_key=True)
 
@@ -60,9 +377,81 @@ class SurrogatePK(object):
                 isinstance(record_id, (int, float)),
             )
         ):
+            if cls.__cache_by_id__:
+                return cls.get_many_by_id([int(record_id)]).get(int(record_id))
             return cls.query.get(int(record_id))
         return None
 
+    @classmethod
+    def get_many_by_id(cls, record_ids):
+        """Map each of ``record_ids`` to its record, leaving out those that do not exist.
+
+        Records already in the session are used as they are, then those in the
+        row cache if the model is cached, and the rest are loaded with one
+        ``IN`` query.
+        """
+        record_ids = list(dict.fromkeys(int(record_id) for record_id in record_ids))
+        found = {}
+        for record_id in record_ids:
+            instance = db.session.identity_map.get(
+                cls.__mapper__.identity_key_from_primary_key([record_id])
+            )
+            if instance is not None:
+                found[record_id] = instance
+        missing = [record_id for record_id in record_ids if record_id not in found]
+        if missing and cls.__cache_by_id__:
+            cached = row_cache.get_many(
+                [(cls.__name__, record_id) for record_id in missing]
+            )
+            for (_, record_id), row in cached.items():
+                found[record_id] = cls.from_cached_row(row)
+            missing = [record_id for record_id in missing if record_id not in found]
+        if missing:
+            loaded = cls.query.filter(cls.id.in_(missing)).all()
+            found.update((instance.id, instance) for instance in loaded)
+            # rows this transaction wrote might yet be rolled back, and replicas lag behind
+            if (
+                cls.__cache_by_id__
+                and "row_cache_evictions" not in db.session.info
+                and not reads_from_replica()
+            ):
+                row_cache.set_many(
+                    {
+                        (cls.__name__, instance.id): cls.to_cached_row(instance)
+                        for instance in loaded
+                    }
+                )
+        return {
+            record_id: found[record_id]
+            for record_id in record_ids
+            if record_id in found
+        }
+
+    @classmethod
+    def _cached_columns(cls):
+        return [
+            column.key
+            for column in cls.__mapper__.column_attrs
+            if column.key not in cls.__cache_by_id_exclude__
+        ]
+
+    @classmethod
+    def to_cached_row(cls, instance):
+        """``instance`` as a compact value to cache, without the ``__cache_by_id_exclude__`` columns."""
+        return pickle.dumps(
+            tuple(getattr(instance, name) for name in cls._cached_columns()),
+            pickle.HIGHEST_PROTOCOL,
+        )
+
+    @classmethod
+    def from_cached_row(cls, row):
+        """Attach the record cached as ``row`` by :meth:`to_cached_row` to the session, without a query."""
+        instance = cls.__mapper__.class_manager.new_instance()
+        # as a query loads a row: values in the instance dict without history are unchanged
+        db.inspect(instance).dict.update(zip(cls._cached_columns(), pickle.loads(row)))
+        make_transient_to_detached(instance)
+        return db.session.merge(instance, load=False)
+
 
 def reference_col(
     tablename, nullable=False, pk_name="id", foreign_key_kwargs=None, column_kwargs=None
@@ -82,3 +471,66 @@ def reference_col(
         nullable=nullable,
         **column_kwargs,
     )
+
+
+class prefix_key(FunctionElement):  # noqa: N801 -- used like a SQL function
+    """The lower case form of a string column, to index and search by prefix.
+
+    A prefix is matched with the range ``prefix <= key < successor``, so the
+    order of the key must be that of its code points: ``lower(column)`` in
+    SQLite's default ``BINARY`` collation, and in the ``"C"`` collation on
+    Postgres. Index and query it with the same expression.
+    """
+
+    type = String()
+    name = "prefix_key"
+
+
+@compiles(prefix_key)
+def compile_prefix_key(element, compiler, **kw):
+    """``lower(column)``."""
+    return f"lower({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(prefix_key, "postgresql")
+def compile_prefix_key_postgresql(element, compiler, **kw):
+    """``lower(column)`` in the collation ordered by code points."""
+    return f'lower({compiler.process(element.clauses, **kw)}) COLLATE "C"'
+
+
+def forget_on_commit(session, keys):
+    """Evict the ``(class name, id)`` keys from the row cache when the transaction ends.
+
+    Rows read in the meantime are not cached, as the transaction's writes may
+    be rolled back.
+    """
+    session.info.setdefault("row_cache_evictions", set()).update(keys)
+
+
+def collect_cached_rows(session, flush_context):
+    """Remember which rows of models cached by id this flush wrote."""
+    keys = [
+        (model.__class__.__name__, model.id)
+        for model in chain(session.new, session.dirty, session.deleted)
+        if getattr(model, "__cache_by_id__", False)
+    ]
+    if keys:
+        forget_on_commit(session, keys)
+
+
+def evict_cached_rows(session):
+    """Evict the rows written by the transaction that just ended."""
+    keys = session.info.pop("row_cache_evictions", None)
+    if keys:
+        row_cache.delete_many(keys)
+
+
+def evict_rolled_back_rows(session, previous_transaction):
+    """Rows may have been cached from rolled back writes; evict them too."""
+    evict_cached_rows(session)
+
+
+db.event.listen(db.session, "after_flush", collect_cached_rows)
+db.event.listen(db.session, "after_commit", evict_cached_rows)
+db.event.listen(db.session, "after_soft_rollback", evict_rolled_back_rows)
+db.event.listen(db.session, "after_commit", stick_to_primary)
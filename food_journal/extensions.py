@@ -5,17 +5,28 @@ from flask_caching import Cache
 from flask_debugtoolbar import DebugToolbarExtension
 from flask_login import LoginManager
 from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
+from flask_moment import Moment
 from flask_static_digest import FlaskStaticDigest
 from flask_wtf.csrf import CSRFProtect
-from flask_moment import Moment
+
+from food_journal.activity import ActivityTracker
+from food_journal.passwords import PasswordHasher
+from food_journal.routing import RoutingSQLAlchemy
+from food_journal.row_cache import RowCache
+from food_journal.s3 import S3
+from food_journal.storage import Storage
 
 bcrypt = Bcrypt()
+passwords = PasswordHasher(bcrypt=bcrypt)
 csrf_protect = CSRFProtect()
 login_manager = LoginManager()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 migrate = Migrate()
 cache = Cache()
 debug_toolbar = DebugToolbarExtension()
 flask_static_digest = FlaskStaticDigest()
 moment = Moment()
+s3 = S3()
+storage = Storage()
+activity = ActivityTracker()
+row_cache = RowCache()
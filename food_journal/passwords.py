@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Password hashing on a bounded pool of native threads.
+
+A bcrypt hash at ``BCRYPT_LOG_ROUNDS`` 13 is a few hundred milliseconds of
+CPU. Under gunicorn's gevent workers every request of a process shares one OS
+thread, so hashing inline stalls all of them for that long. The ``bcrypt``
+package releases the GIL while hashing, so running it on a native thread lets
+the other greenlets carry on; the caller's greenlet waits cooperatively.
+
+When gevent has monkey-patched ``threading`` the pool is gevent's native
+``ThreadPoolExecutor``; otherwise it is the standard library's. At most
+``BCRYPT_POOL_SIZE`` hashes run at once per process, which also bounds how
+much CPU a login burst can take; the rest wait in the pool's queue, see
+:meth:`PasswordHasher.metrics`. A size of 0 hashes in the calling thread.
+
+``flask bcrypt-calibrate`` picks the ``BCRYPT_LOG_ROUNDS`` that makes a check
+take about a target time on the host, see :func:`calibrate`. Hashes stored at
+another cost are rehashed at the next successful login.
+"""
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt as _bcrypt
+from flask import current_app
+
+from food_journal.process import ProcessState
+
+#: the range of costs the bcrypt algorithm accepts
+MIN_ROUNDS = 4
+MAX_ROUNDS = 31
+#: the lowest cost calibration recommends unless told otherwise
+MIN_RECOMMENDED_ROUNDS = 10
+
+
+def hash_rounds(pw_hash):
+    """The cost a bcrypt hash (``$2b$<cost>$<salt and hash>``) was made at."""
+    if isinstance(pw_hash, str):
+        pw_hash = pw_hash.encode("ascii")
+    return int(pw_hash.split(b"$")[2])
+
+
+def time_hash(rounds, samples=3):
+    """Median seconds one bcrypt hash at ``rounds`` takes on this host; checks cost the same."""
+    salt = _bcrypt.gensalt(rounds)
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        _bcrypt.hashpw(b"calibration password", salt)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def calibrate(target_seconds, measure=None, minimum=MIN_RECOMMENDED_ROUNDS):
+    """The highest cost whose hash takes at most ``target_seconds``, and the timings measured.
+
+    Each extra round doubles the time, so costs are timed upwards from
+    ``minimum`` until one exceeds the target. Returns ``minimum`` if even that
+    is too slow: a slow host or a small target must not weaken the hashes.
+    ``measure(rounds)`` defaults to :func:`time_hash`.
+    """
+    measure = measure or time_hash
+    timings = {}
+    rounds = minimum
+    for cost in range(minimum, MAX_ROUNDS + 1):
+        timings[cost] = measure(cost)
+        if timings[cost] > target_seconds:
+            break
+        rounds = cost
+    return rounds, timings
+
+
+def _gevent_patched():
+    if "gevent.monkey" not in sys.modules:
+        return False
+    return sys.modules["gevent.monkey"].is_module_patched("threading")
+
+
+class _PoolState(ProcessState):
+    """Per-app pool state; the pool is rebuilt in each process after a fork.
+
+    Counters are only updated by callers, never by the pool's threads, so the
+    (possibly monkey-patched) lock below is always used from the kind of
+    thread it was made for.
+    """
+
+    def __init__(self, config):
+        super().__init__()
+        self.config = config
+        self.size = config["BCRYPT_POOL_SIZE"]
+        self.executor = None
+        self.in_flight = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    def reset(self):
+        """Create the pool of a new process."""
+        self.executor = PasswordHasher.create_executor(self.size)
+
+
+class PasswordHasher(object):
+    """Flask extension hashing and checking passwords with Flask-Bcrypt, off the calling thread."""
+
+    def __init__(self, app=None, bcrypt=None):
+        """Create instance."""
+        self.bcrypt = bcrypt
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Register the extension; the pool itself is created on first use."""
+        app.extensions["passwords"] = _PoolState(app.config)
+
+    def generate_password_hash(self, password):
+        """Hash ``password`` at ``BCRYPT_LOG_ROUNDS``."""
+        return self.run(
+            self.bcrypt.generate_password_hash,
+            password,
+            current_app.config["BCRYPT_LOG_ROUNDS"],
+        )
+
+    def check_password_hash(self, pw_hash, password):
+        """Whether ``password`` matches ``pw_hash``."""
+        return self.run(self.bcrypt.check_password_hash, pw_hash, password)
+
+    @staticmethod
+    def needs_rehash(pw_hash):
+        """Whether ``pw_hash`` was made at another cost than ``BCRYPT_LOG_ROUNDS``."""
+        return hash_rounds(pw_hash) != current_app.config["BCRYPT_LOG_ROUNDS"]
+
+    def run(self, func, *args):
+        """Call ``func(*args)`` on the pool and wait for its result."""
+        state = current_app.extensions["passwords"]
+        if not state.size:
+            return func(*args)
+
+        def timed():
+            started = time.perf_counter()
+            return started, func(*args), time.perf_counter() - started
+
+        with state.lock:
+            state.in_flight += 1
+            state.max_queued = max(state.max_queued, state.in_flight - state.size)
+        submitted = time.perf_counter()
+        try:
+            started, result, elapsed = (
+                state.for_process().executor.submit(timed).result()
+            )
+        finally:
+            with state.lock:
+                state.in_flight -= 1
+        with state.lock:
+            state.completed += 1
+            state.wait_seconds += started - submitted
+            state.run_seconds += elapsed
+        return result
+
+    @staticmethod
+    def create_executor(size):
+        """A pool of ``size`` native threads, cooperative with gevent when it is in use."""
+        if _gevent_patched():
+            from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+
+            return NativeThreadPoolExecutor(max_workers=size)
+        return ThreadPoolExecutor(max_workers=size, thread_name_prefix="bcrypt")
+
+    def metrics(self):
+        """Pool counters of the current process.
+
+        ``queued`` is how many hashes are waiting for a thread right now and
+        ``max_queued`` the most that ever waited; ``wait_seconds`` and
+        ``run_seconds`` add up the time hashes spent queued and running.
+        """
+        state = current_app.extensions["passwords"]
+        with state.lock:
+            return {
+                "size": state.size,
+                "in_flight": state.in_flight,
+                "queued": max(0, state.in_flight - state.size),
+                "max_queued": state.max_queued,
+                "completed": state.completed,
+                "wait_seconds": state.wait_seconds,
+                "run_seconds": state.run_seconds,
+            }
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""Extension state that each worker process builds for itself.
+
+Gunicorn imports the app in its master and then forks the workers. Thread
+pools, background threads, connection pools and in-memory caches must not be
+shared across that fork, so extensions keep them on a :class:`ProcessState`
+and build them on first use in each process.
+"""
+import os
+import threading
+
+
+class ProcessState(object):
+    """Per-app extension state, part of which is rebuilt in each process.
+
+    Subclasses build that part in :meth:`reset`; :meth:`for_process` calls it
+    once per process, the first time the state is used there.
+    """
+
+    def __init__(self):
+        """Create instance."""
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def reset(self):
+        """Build the per-process part of the state; called with ``lock`` held."""
+        raise NotImplementedError
+
+    def for_process(self):
+        """This state, reset first if the current process has not used it yet."""
+        pid = os.getpid()
+        if self.pid != pid:
+            with self.lock:
+                if self.pid != pid:
+                    self.reset()
+                    self.pid = pid
+        return self
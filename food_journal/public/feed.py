@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""Home feed queries, paginated by an opaque ``(created_at, id)`` cursor.
+
+Keyset pagination keeps every page an index range scan, no matter how deep
+into the feed a reader scrolls, unlike ``OFFSET`` which has to skip over
+every preceding row.
+
+Rendered pages are cached, versioned per feed. Commits that add, change or
+remove dishes, or change who a user follows, bump the versions of exactly the
+feeds they affect.
+"""
+import base64
+import binascii
+import datetime as dt
+import hashlib
+
+from flask import current_app, render_template
+from markupsafe import Markup
+from sqlalchemy.orm.attributes import set_committed_value
+
+from food_journal.compat import json_dumps
+from food_journal.database import db
+from food_journal.extensions import cache
+from food_journal.public.models import FoodItem
+from food_journal.user.models import TimelineEntry, User, followers
+from food_journal.utils import (
+    InvalidCursor,
+    Page,
+    bump_on_commit,
+    cache_version,
+    reads_for_version,
+)
+
+CURSOR_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+PUBLIC_FEED_VERSION_KEY = "feed/public/version"
+
+
+def encode_cursor(created_at, item_id):
+    """Encode a ``(created_at, id)`` position as an opaque, URL-safe token."""
+    raw = f"{created_at.strftime(CURSOR_DATETIME_FORMAT)}|{item_id}".encode("ascii")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token):
+    """Decode a token produced by :func:`encode_cursor`.
+
+    :raises InvalidCursor: if the token is malformed.
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode("ascii")).decode("ascii")
+        created_at, item_id = raw.split("|")
+        return dt.datetime.strptime(created_at, CURSOR_DATETIME_FORMAT), int(item_id)
+    except (binascii.Error, UnicodeError, ValueError) as e:
+        raise InvalidCursor(token) from e
+
+
+def paginate(query, before=None, page_size=None, keys=None):
+    """Return a :class:`~food_journal.utils.Page` of ``query``, newest first.
+
+    :param query: A query over ``FoodItem``.
+    :param before: Opaque cursor; only rows strictly older than it are returned.
+    :param page_size: Number of rows per page; defaults to ``FEED_PAGE_SIZE``.
+    :param keys: The ``(created_at, id)`` columns to sort and seek on.
+    """
+    page_size = page_size or current_app.config["FEED_PAGE_SIZE"]
+    rows = page_query(query, before, page_size, keys).all()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    load_authors(rows)
+    return Page(rows, next_cursor)
+
+
+def load_authors(items):
+    """Set the author of each of ``items``, from the row cache where it can.
+
+    Templates show the author of every dish. Authors already in the session or
+    the row cache cost no query, and the rest are loaded with one.
+    """
+    authors = User.get_many_by_id({item.user_id for item in items})
+    for item in items:
+        set_committed_value(item, "author", authors.get(item.user_id))
+
+
+def page_query(query, before, page_size, keys=None):
+    """The query :func:`paginate` runs: one extra row tells whether an older page exists."""
+    created_col, id_col = keys or (FoodItem.created_at, FoodItem.id)
+    query = query.order_by(None)
+    if before:
+        created_at, item_id = decode_cursor(before)
+        query = query.filter(
+            db.or_(
+                created_col < created_at,
+                db.and_(created_col == created_at, id_col < item_id),
+            )
+        )
+    return query.order_by(created_col.desc(), id_col.desc()).limit(page_size + 1)
+
+
+def public_feed(before=None, page_size=None):
+    """Page of every user's public dishes."""
+    query = FoodItem.query.filter_by(is_public=True, upload_state=FoodItem.UPLOAD_READY)
+    return paginate(query, before, page_size)
+
+
+def followed_feed(user, before=None, page_size=None):
+    """Page of the dishes posted by ``user`` and the users they follow."""
+    query, keys = followed_feed_query(user)
+    return paginate(query, before, page_size, keys)
+
+
+def followed_feed_query(user):
+    """The query behind :func:`followed_feed` and the keys to seek on.
+
+    When ``user`` follows no high-follower accounts this seeks directly on the
+    timeline index; otherwise the timeline is merged with the pulled dishes.
+    """
+    pulled = user.pulled_food_items()
+    if pulled is None:
+        keys = (TimelineEntry.created_at, TimelineEntry.food_id)
+        return user.timeline_food_items(), keys
+    return user.timeline_food_items().union(pulled), None
+
+
+def user_feed_version_key(user_id):
+    """Cache key holding the version of a user's followed feed."""
+    return f"feed/user/{user_id}/version"
+
+
+def render_public_feed(before=None):
+    """Rendered page of the public feed, from the cache when possible."""
+    return Markup(
+        _cached_page(
+            PUBLIC_FEED_VERSION_KEY,
+            "feed/public/html",
+            before,
+            lambda before: _render(public_feed(before)),
+        )
+    )
+
+
+def render_followed_feed(user, before=None):
+    """Rendered page of ``user``'s followed feed, from the cache when possible."""
+    return Markup(
+        _cached_page(
+            user_feed_version_key(user.id),
+            f"feed/user/{user.id}/html",
+            before,
+            lambda before: _render(followed_feed(user, before=before)),
+        )
+    )
+
+
+def serialize_public_feed(before=None):
+    """Serialized page of the public feed, from the cache when possible.
+
+    Returns a ``(body, etag, last_modified)`` tuple, see :func:`serialize_page`.
+    """
+    return _cached_page(
+        PUBLIC_FEED_VERSION_KEY,
+        "feed/public/json",
+        before,
+        lambda before: serialize_page(public_feed(before)),
+    )
+
+
+def serialize_followed_feed(user, before=None):
+    """Serialized page of ``user``'s followed feed, from the cache when possible.
+
+    Returns a ``(body, etag, last_modified)`` tuple, see :func:`serialize_page`.
+    """
+    return _cached_page(
+        user_feed_version_key(user.id),
+        f"feed/user/{user.id}/json",
+        before,
+        lambda before: serialize_page(followed_feed(user, before=before)),
+    )
+
+
+def serialize_page(page):
+    """Serialize a page to JSON with only the fields the carousel shows.
+
+    Returns the body, a strong ETag of the body, and the creation time of the
+    newest dish on the page (None when the page is empty).
+    """
+    body = json_dumps(
+        {
+            "items": [
+                {
+                    "id": food.id,
+                    "title": food.title,
+                    "comment": food.comment,
+                    "author": food.author.username,
+                    "image_url": food.image_url(),
+                    "image_srcset": {
+                        fmt: food.srcset(fmt) for fmt in food.image_formats
+                    },
+                    "created_at": food.created_at.isoformat() + "Z",
+                }
+                for food in page.items
+            ],
+            "next": page.next_cursor,
+        }
+    )
+    last_modified = max((food.created_at for food in page.items), default=None)
+    return body, hashlib.sha1(body).hexdigest(), last_modified
+
+
+def _render(page):
+    return render_template("public/_feed.html", page=page).strip()
+
+
+def _cached_page(version_key, prefix, before, build):
+    if before:
+        decode_cursor(before)  # never cache under a key built from a bad token
+    version = cache_version(version_key)
+    key = f"{prefix}/{version}/{before or ''}"
+    value = cache.get(key)
+    if value is None:
+        with reads_for_version(version):
+            value = build(before)
+        cache.set(key, value, timeout=current_app.config["FEED_CACHE_TIMEOUT"])
+    return value
+
+
+def collect_changed_food_items(session, flush_context):
+    """Remember which feeds the dishes in this flush appear in."""
+    keys = set()
+    changed = [model for model in session.dirty if session.is_modified(model)]
+    for model in list(session.new) + list(session.deleted) + changed:
+        if not isinstance(model, FoodItem) or model.user_id is None:
+            continue
+        keys.add(PUBLIC_FEED_VERSION_KEY)
+        keys.add(user_feed_version_key(model.user_id))
+        # dishes created with only a user_id have no author loaded, and loading it here finds none
+        author = model.__dict__.get("author") or session.query(User).get(model.user_id)
+        # followers of high-follower accounts pull at read time; let their pages expire instead
+        if not author.fanout_on_read:
+            follower_ids = session.execute(
+                db.select([followers.c.follower_id]).where(
+                    followers.c.followed_id == model.user_id
+                )
+            )
+            keys.update(
+                user_feed_version_key(follower_id) for follower_id, in follower_ids
+            )
+    bump_on_commit(session, keys)
+
+
+def invalidate_on_commit(user_ids):
+    """Invalidate the feeds new dishes by ``user_ids`` appear in, once committed.
+
+    For dishes inserted without the ORM, which :func:`collect_changed_food_items` does not see.
+    """
+    keys = {PUBLIC_FEED_VERSION_KEY}
+    keys.update(user_feed_version_key(user_id) for user_id in user_ids)
+    follower_ids = db.session.execute(
+        db.select([followers.c.follower_id])
+        .distinct()
+        .select_from(followers.join(User.__table__, User.id == followers.c.followed_id))
+        .where(
+            db.and_(
+                followers.c.followed_id.in_(user_ids), User.fanout_on_read.is_(False)
+            )
+        )
+    )
+    keys.update(user_feed_version_key(follower_id) for follower_id, in follower_ids)
+    bump_on_commit(db.session, keys)
+
+
+def collect_follow_change(user, followed, initiator):
+    """Remember that ``user`` followed or unfollowed someone."""
+    bump_on_commit(db.session, [user_feed_version_key(user.id)])
+
+
+db.event.listen(db.session, "after_flush", collect_changed_food_items)
+db.event.listen(User.followed, "append", collect_follow_change)
+db.event.listen(User.followed, "remove", collect_follow_change)
@@ -1,26 +1,42 @@
 # -*- coding: utf-8 -*-
 """Public forms."""
 from flask_wtf import FlaskForm
-from flask_wtf.file import  FileField, FileRequired, FileAllowed
-from wtforms import PasswordField, StringField, TextAreaField, BooleanField
-from wtforms.validators import DataRequired, Regexp
+from flask_wtf.file import FileAllowed, FileField, FileRequired
+from wtforms import BooleanField, HiddenField, PasswordField, StringField, TextAreaField
+from wtforms.validators import DataRequired
 
 from food_journal.user.models import User
 
+
 class FoodForm(FlaskForm):
     """Food form."""
-    ALLOWED_EXTENSIONS = ['png', 'jpg', 'jpeg', 'gif']
-    
+
+    ALLOWED_EXTENSIONS = ["png", "jpg", "jpeg", "gif"]
+
     title = StringField("Title", validators=[DataRequired()])
-    image = FileField('Image', validators=[FileRequired(), FileAllowed(ALLOWED_EXTENSIONS, 'Images only!')])
-    #tags = ""
-    comment = TextAreaField(u'Image Description')
-    is_public = BooleanField('Make this image public', default="checked")
-    
+    image = FileField(
+        "Image",
+        validators=[FileRequired(), FileAllowed(ALLOWED_EXTENSIONS, "Images only!")],
+    )
+    # tags = ""
+    comment = TextAreaField(u"Image Description")
+    is_public = BooleanField("Make this image public", default="checked")
+
     def __repr__(self):
+        """Represent instance with the submitted title and image."""
         str = super(FoodForm, self).__repr__
         return "{}\nTitle: {}; Image: {}".format(str, self.title.data, self.image.data)
 
+
+class DirectUploadForm(FlaskForm):
+    """Details of a dish whose image the browser uploaded straight to S3."""
+
+    title = StringField("Title", validators=[DataRequired()])
+    comment = TextAreaField(u"Image Description")
+    is_public = BooleanField("Make this image public", default="checked")
+    key = HiddenField("Key", validators=[DataRequired()])
+
+
 class LoginForm(FlaskForm):
     """Login form."""
 
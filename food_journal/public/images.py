@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Resized, metadata-free derivatives of uploaded images.
+
+Feeds show derivatives instead of the original upload: a few widths in
+modern formats (WebP, AVIF where Pillow supports it) plus a JPEG fallback,
+so browsers can pick the smallest file that fits the screen.
+"""
+import io
+import os
+
+from flask import current_app
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+from food_journal.extensions import storage
+
+#: derivative name -> maximum width and height in pixels, smallest first
+DERIVATIVE_SIZES = {"thumb": 320, "carousel": 1024, "full": 2048}
+
+#: format name -> (Pillow format, file extension, MIME type)
+FORMATS = {
+    "avif": ("AVIF", "avif", "image/avif"),
+    "webp": ("WEBP", "webp", "image/webp"),
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+}
+
+
+def derivative_formats():
+    """Configured formats that this Pillow build can encode; JPEG always comes last."""
+    configured = [
+        name
+        for name in current_app.config["IMAGE_DERIVATIVE_FORMATS"]
+        if name != "jpeg"
+    ]
+    return [name for name in configured if features.check(name)] + ["jpeg"]
+
+
+def derivative_key(aws_key, name, fmt):
+    """The key a derivative of the object stored under ``aws_key`` is stored under."""
+    stem, _ = os.path.splitext(aws_key)
+    return f"{stem}-{name}.{FORMATS[fmt][1]}"
+
+
+def make_derivatives(fileobj):
+    """Decode an image and encode each derivative size in each format.
+
+    Sizes wider than the original are skipped, except the smallest. EXIF
+    orientation is applied and all metadata is dropped.
+
+    Returns a list of ``(name, width, fmt, data)`` tuples, or an empty list
+    when the file is not an image Pillow can read, or has more than twice
+    ``Image.MAX_IMAGE_PIXELS`` pixels.
+    """
+    try:
+        original = Image.open(fileobj)
+        original = ImageOps.exif_transpose(original)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        return []
+    if original.mode not in ("RGB", "RGBA"):
+        original = original.convert("RGBA" if "A" in original.getbands() else "RGB")
+    largest = max(original.size)
+
+    quality = current_app.config["IMAGE_QUALITY"]
+    derivatives = []
+    for index, (name, size) in enumerate(DERIVATIVE_SIZES.items()):
+        if index and size > largest:
+            break
+        resized = original.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        for fmt in derivative_formats():
+            image = resized
+            if fmt == "jpeg" and image.mode == "RGBA":
+                image = Image.new("RGB", image.size, "white")
+                image.paste(resized, mask=resized.getchannel("A"))
+            out = io.BytesIO()
+            image.save(out, FORMATS[fmt][0], quality=quality, optimize=fmt == "jpeg")
+            derivatives.append((name, resized.width, fmt, out.getvalue()))
+    return derivatives
+
+
+def store_derivatives(aws_key, derivatives):
+    """Store the output of :func:`make_derivatives` next to the original under ``aws_key``.
+
+    Returns the ``image_variants`` describing them, or None when there are none.
+
+    :raises StorageError: if a derivative could not be stored.
+    """
+    variants = {}
+    for name, width, fmt, data in derivatives:
+        key = derivative_key(aws_key, name, fmt)
+        storage.backend.put(io.BytesIO(data), key, FORMATS[fmt][2])
+        variants.setdefault(name, {"width": width})[fmt] = key
+    return variants or None
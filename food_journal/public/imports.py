@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+"""Bulk import of dishes, see ``flask import-dishes``.
+
+Images come from a directory or a zip archive. A CSV, JSON or JSON Lines
+manifest describes each dish: ``image`` (its path in the source), ``title``,
+``comment``, ``is_public``, ``created_at`` and ``username``.
+
+Manifest rows are imported in batches:
+
+1. a pool of threads reads and hashes the batch's images;
+2. the pool resizes and stores the images whose content is not stored yet,
+   once per distinct image;
+3. the blobs, dishes and timeline entries of the whole batch are inserted in
+   one transaction, together with the run's :class:`ImportRun` checkpoint.
+
+The checkpoint commits with the rows it counts, so an interrupted import
+resumes after its last committed batch without duplicating dishes. A failed
+upload stops the import. Rows with a missing image, an unknown user or
+invalid fields are logged, counted and skipped.
+"""
+import csv
+import datetime as dt
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from werkzeug.security import safe_join
+
+from food_journal.database import db
+from food_journal.extensions import storage
+from food_journal.public.feed import invalidate_on_commit
+from food_journal.public.forms import FoodForm
+from food_journal.public.images import make_derivatives, store_derivatives
+from food_journal.public.models import AWS_Mixin, Blob, FoodItem, ImportRun
+from food_journal.user.models import TimelineEntry, User
+
+#: ISO 8601 timestamps, as ``datetime.isoformat`` writes them, with an optional UTC offset or "Z"
+TIMESTAMP = re.compile(
+    r"(?P<date>\d{4}-\d{2}-\d{2})"
+    r"(?:[T ](?P<hour>\d{2}):(?P<minute>\d{2})(?::(?P<second>\d{2})(?:\.(?P<fraction>\d{1,6}))?)?)?"
+    r"(?P<offset>Z|[+-]\d{2}:?\d{2})?$"
+)
+
+
+class ImageSource(object):
+    """Images in a directory or a zip archive, by their path inside it."""
+
+    def __init__(self, path):
+        """Create instance."""
+        self.path = path
+        self.is_zip = os.path.isfile(path) and zipfile.is_zipfile(path)
+        # ZipFile objects share one file position; give each worker thread its own
+        self._local = threading.local()
+
+    def read(self, name):
+        """The bytes of the image ``name``.
+
+        :raises FileNotFoundError: if there is no such image.
+        """
+        if not self.is_zip:
+            path = safe_join(self.path, name)
+            if path is None:
+                raise FileNotFoundError(name)
+            with open(path, "rb") as image:
+                return image.read()
+        archive = getattr(self._local, "archive", None)
+        if archive is None:
+            archive = self._local.archive = zipfile.ZipFile(self.path)
+        try:
+            return archive.read(name)
+        except KeyError:
+            raise FileNotFoundError(name)
+
+
+class ImportStats(object):
+    """Counters reported after every batch."""
+
+    def __init__(self, total, done=0):
+        """Create instance."""
+        self.total = total
+        self.done = done
+        self.resumed_at = done
+        self.imported = 0
+        self.deduplicated = 0
+        self.rejected = 0
+        self.bytes_stored = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        """Seconds since the import started."""
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        """Rows processed per second, not counting those imported by earlier runs."""
+        return (self.done - self.resumed_at) / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def megabytes_per_second(self):
+        """Image data stored per second."""
+        return self.bytes_stored / 1024 / 1024 / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        """Progress, counters and throughput on one line."""
+        return (
+            f"{self.done:,}/{self.total:,} rows: {self.imported:,} imported "
+            f"({self.deduplicated:,} already stored), {self.rejected:,} rejected; "
+            f"{self.rows_per_second:,.1f} rows/s, {self.megabytes_per_second:,.1f} MB/s stored"
+        )
+
+
+def read_manifest(path):
+    """Rows of a ``.csv``, ``.json`` (a list of objects) or ``.jsonl`` manifest, as dicts."""
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline="", encoding="utf-8") as manifest:
+        if extension == ".csv":
+            return list(csv.DictReader(manifest))
+        if extension == ".json":
+            return json.load(manifest)
+        if extension == ".jsonl":
+            return [json.loads(line) for line in manifest if line.strip()]
+    raise ValueError(
+        f"Unsupported manifest format {extension!r}; use .csv, .json or .jsonl"
+    )
+
+
+def parse_row(row):
+    """Validate a manifest row; return the dish's fields.
+
+    :raises ValueError: if the row cannot be imported.
+    """
+    image = (row.get("image") or "").strip()
+    if image.rsplit(".", 1)[-1].lower() not in FoodForm.ALLOWED_EXTENSIONS:
+        raise ValueError(f"not an image: {image!r}")
+    title = (row.get("title") or "").strip()
+    if not title or len(title) > FoodItem.title.type.length:
+        raise ValueError("missing or too long title")
+    comment = row.get("comment") or None
+    if comment and len(comment) > FoodItem.comment.type.length:
+        raise ValueError("comment too long")
+    is_public = row.get("is_public", True)
+    if isinstance(is_public, str):
+        is_public = is_public.strip().lower() not in ("0", "false", "no", "n", "")
+    created_at = row.get("created_at")
+    if created_at:
+        created_at = parse_timestamp(str(created_at))
+    return {
+        "image": image,
+        "title": title,
+        "comment": comment,
+        "is_public": bool(is_public),
+        "created_at": created_at or dt.datetime.utcnow(),
+        "username": (row.get("username") or "").strip(),
+    }
+
+
+def parse_timestamp(value):
+    """The naive UTC datetime an ISO 8601 timestamp stands for.
+
+    ``datetime.fromisoformat`` is not available before Python 3.7.
+
+    :raises ValueError: if ``value`` is not such a timestamp.
+    """
+    match = TIMESTAMP.match(value.strip())
+    if match is None:
+        raise ValueError(f"invalid timestamp {value!r}")
+    timestamp = dt.datetime.strptime(match.group("date"), "%Y-%m-%d").replace(
+        hour=int(match.group("hour") or 0),
+        minute=int(match.group("minute") or 0),
+        second=int(match.group("second") or 0),
+        microsecond=int((match.group("fraction") or "0").ljust(6, "0")),
+    )
+    offset = match.group("offset")
+    if offset and offset != "Z":
+        hours, minutes = int(offset[1:3]), int(offset[-2:])
+        sign = -1 if offset[0] == "-" else 1
+        timestamp -= sign * dt.timedelta(hours=hours, minutes=minutes)
+    return timestamp
+
+
+def in_app_context(app, func):
+    """``func``, called in an app context of ``app``; for the worker threads."""
+
+    def run_in_app_context(*args):
+        with app.app_context():
+            return func(*args)
+
+    return run_in_app_context
+
+
+def import_dishes(
+    source, rows, run_name, workers=8, batch_size=500, restart=False, report=None
+):
+    """Import the manifest ``rows`` with images from the :class:`ImageSource` ``source``.
+
+    Resumes after the rows the run ``run_name`` already imported, unless
+    ``restart`` is set. ``report`` is called with the :class:`ImportStats`
+    after every batch.
+
+    Returns the final :class:`ImportStats`.
+
+    :raises StorageError: if an image could not be stored.
+    """
+    run = ImportRun.query.filter_by(name=run_name).first() or ImportRun(
+        name=run_name, rows_done=0
+    )
+    if restart:
+        run.rows_done = 0
+    stats = ImportStats(len(rows), run.rows_done)
+    usernames = {}
+    app = current_app._get_current_object()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(run.rows_done, len(rows), batch_size):
+            batch = rows[start : start + batch_size]
+            dishes = parse_batch(batch, start + 1, usernames, stats)
+            stats.imported += import_batch(pool, app, source, dishes, usernames, stats)
+            run.rows_done = start + len(batch)
+            db.session.add(run)
+            db.session.commit()
+            stats.done = run.rows_done
+            if report:
+                report(stats)
+    return stats
+
+
+def parse_batch(batch, first_number, usernames, stats):
+    """The dishes of the manifest rows ``batch``; invalid rows and unknown users are rejected."""
+    dishes = []
+    for number, row in enumerate(batch, first_number):
+        try:
+            dishes.append(dict(parse_row(row), row=number))
+        except ValueError as e:
+            reject(stats, number, e)
+
+    lookup_users(usernames, {dish["username"] for dish in dishes})
+    known = []
+    for dish in dishes:
+        if usernames[dish["username"]] is None:
+            reject(stats, dish["row"], f"unknown user {dish['username']!r}")
+        else:
+            known.append(dish)
+    return known
+
+
+def import_batch(pool, app, source, dishes, usernames, stats):
+    """Hash and store the images of ``dishes`` on ``pool``, then insert them; nothing is committed.
+
+    Returns the number of dishes inserted.
+    """
+    accepted = []
+    for dish, error in zip(
+        dishes,
+        pool.map(in_app_context(app, lambda dish: hash_image(source, dish)), dishes),
+    ):
+        if error:
+            reject(stats, dish["row"], error)
+        else:
+            accepted.append(dish)
+
+    digests = {dish["digest"] for dish in accepted}
+    stored = {
+        digest
+        for digest, in db.session.query(Blob.digest).filter(Blob.digest.in_(digests))
+    }
+    first_of_digest = {}
+    for dish in accepted:
+        if dish["digest"] in stored:
+            stats.deduplicated += 1
+        else:
+            first_of_digest.setdefault(dish["digest"], dish)
+    store = in_app_context(app, lambda dish: store_image(source, dish))
+    new_blobs = list(pool.map(store, first_of_digest.values()))
+    stats.bytes_stored += sum(blob["size"] for blob in new_blobs)
+
+    insert_batch(accepted, new_blobs, usernames)
+    return len(accepted)
+
+
+def reject(stats, number, reason):
+    """Log and count the rejected row ``number``."""
+    current_app.logger.warning(f"Skipping row {number}: {reason}")
+    stats.rejected += 1
+
+
+def lookup_users(usernames, wanted):
+    """Add the ids of the ``wanted`` usernames to the ``usernames`` cache; unknown ones map to None."""
+    missing = wanted - usernames.keys()
+    if missing:
+        usernames.update(dict.fromkeys(missing))
+        usernames.update(
+            db.session.query(User.username, User.id).filter(User.username.in_(missing))
+        )
+
+
+def hash_image(source, dish):
+    """Add the digest and size of the dish's image to it; return an error, or None."""
+    try:
+        data = source.read(dish["image"])
+    except OSError as e:
+        return f"cannot read {dish['image']!r}: {e}"
+    if len(data) > current_app.config["MAX_CONTENT_LENGTH"]:
+        return f"{dish['image']!r} is larger than MAX_CONTENT_LENGTH"
+    dish["digest"] = hashlib.sha256(data).hexdigest()
+    return None
+
+
+def store_image(source, dish):
+    """Store the dish's image and its derivatives; return the new blob's row."""
+    data = source.read(dish["image"])
+    aws_key = AWS_Mixin.aws_key_for(dish["digest"], dish["image"])
+    content_type = mimetypes.guess_type(dish["image"])[0]
+    storage.backend.put(io.BytesIO(data), aws_key, content_type)
+    return {
+        "digest": dish["digest"],
+        "aws_key": aws_key,
+        "content_type": content_type,
+        "size": len(data),
+        "image_variants": store_derivatives(
+            aws_key, make_derivatives(io.BytesIO(data))
+        ),
+    }
+
+
+def insert_batch(dishes, new_blobs, user_ids):
+    """Insert a batch's new blobs, its dishes and their timeline entries; nothing is committed."""
+    if new_blobs:
+        now = dt.datetime.utcnow()
+        Blob.bulk_create(
+            [dict(blob, ref_count=0, created_at=now) for blob in new_blobs],
+            commit=False,
+        )
+    if not dishes:
+        return
+    blobs = {
+        blob.digest: blob
+        for blob in Blob.query.filter(
+            Blob.digest.in_({dish["digest"] for dish in dishes})
+        )
+    }
+
+    references = {}
+    for dish in dishes:
+        references[dish["digest"]] = references.get(dish["digest"], 0) + 1
+    db.session.execute(
+        Blob.__table__.update()
+        .where(Blob.id == db.bindparam("blob_id"))
+        .values(ref_count=Blob.ref_count + db.bindparam("references")),
+        [
+            {"blob_id": blobs[digest].id, "references": count}
+            for digest, count in references.items()
+        ],
+    )
+
+    rows = [
+        {
+            "title": dish["title"],
+            "comment": dish["comment"],
+            "is_public": dish["is_public"],
+            "created_at": dish["created_at"],
+            "user_id": user_ids[dish["username"]],
+            "aws_key": blobs[dish["digest"]].aws_key,
+            "image_variants": blobs[dish["digest"]].image_variants,
+            "blob_id": blobs[dish["digest"]].id,
+            "upload_state": FoodItem.UPLOAD_READY,
+        }
+        for dish in dishes
+    ]
+    # in the batch's single transaction and without the per-object ORM events of FoodItem.create
+    food_ids = FoodItem.bulk_create(rows, return_keys=True, commit=False)
+    dishes_per_user = {}
+    for row in rows:
+        dishes_per_user[row["user_id"]] = dishes_per_user.get(row["user_id"], 0) + 1
+    db.session.execute(
+        User.__table__.update()
+        .where(User.id == db.bindparam("author_id"))
+        .values(dish_count=User.dish_count + db.bindparam("dishes")),
+        [
+            {"author_id": user_id, "dishes": count}
+            for user_id, count in dishes_per_user.items()
+        ],
+    )
+    TimelineEntry.fan_out_many(food_ids)
+    invalidate_on_commit({row["user_id"] for row in rows})
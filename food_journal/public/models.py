@@ -1,17 +1,14 @@
-"""Food models"""
+"""Food models."""
 import datetime as dt
-from werkzeug.utils import secure_filename
-
+import hashlib
+import mimetypes
 import os
-import boto3
-import requests
 import tempfile
-
-from botocore.exceptions import ClientError, ParamValidationError
+from uuid import uuid4
 
 from flask import current_app
-
-from flask_login import UserMixin
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
 
 from food_journal.database import (
     Column,
@@ -21,50 +18,202 @@ from food_journal.database import (
     reference_col,
     relationship,
 )
+from food_journal.extensions import storage
+from food_journal.public.images import FORMATS, make_derivatives, store_derivatives
+from food_journal.storage import StorageError
+
+
+def content_digest(fileobj, chunk_size=1024 * 1024):
+    """SHA-256 hex digest and size of a file, read in chunks and rewound."""
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: fileobj.read(chunk_size), b""):
+        digest.update(chunk)
+        size += len(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest(), size
+
+
+def stored_keys(aws_key, image_variants):
+    """Every key stored for a file: ``aws_key`` and those of its derivatives."""
+    keys = [aws_key]
+    for variant in (image_variants or {}).values():
+        keys.extend(key for fmt, key in variant.items() if fmt != "width")
+    return keys
+
+
+class AWS_Mixin(object):  # noqa: N801
+    """Upload a model's file fields, listed in ``__sendtos3__``, to storage on commit."""
+
+    #: upload states; in "async" S3_UPLOAD_MODE rows are committed as pending and an
+    #: UploadJob is queued for the worker, which marks them ready once the image is on S3
+    UPLOAD_PENDING = "pending"
+    UPLOAD_READY = "ready"
+    UPLOAD_FAILED = "failed"
 
-class AWS_Mixin(object):
     @classmethod
     def upload_to_s3(cls, model):
+        """Upload the files of ``model``; whether all of them were stored."""
         current_app.logger.info("SENDINGTO S3")
-        BUCKET = current_app.config["S3_BUCKET_NAME"]
         for field in model.__sendtos3__:
             obj = getattr(model, field)
-            filename = secure_filename(obj.filename)
-            with tempfile.TemporaryDirectory() as tmpdirname:
-                full_filename = os.path.join(tmpdirname, filename)
-                obj.save(full_filename)
-                
-                if model.__aws_key_prefix__:
-                    aws_image_object_name = model.__aws_key_prefix__ + "/" + filename
-                else:
-                    aws_image_object_name = filename
-                model.aws_key = aws_image_object_name
-
-                s3_client = boto3.client('s3')
-                try:
-                    response = s3_client.upload_file(full_filename, BUCKET, aws_image_object_name, ExtraArgs={'ACL': 'public-read'})
-                except ParamValidationError as e:
-                    current_app.logger.error("ParamValidationError caught!!", e)
+            if obj is None:
+                # uploaded straight to S3 by the browser, see public.views.finalize_dish
+                if not cls.adopt_upload(model, field):
                     return False
-                except ClientError as e:
-                    current_app.logger.error("ClientError caught!!", e)
+                continue
+            obj.stream.seek(0)
+            digest, size = content_digest(obj.stream)
+            blob = Blob.find(digest)
+            if blob is not None:
+                # the same bytes are already on S3, with their derivatives
+                model.use_blob(blob)
+                continue
+            model.aws_key = cls.aws_key_for(digest, obj.filename)
+
+            # stream the upload werkzeug already buffered straight to S3, in parts,
+            # rather than copying it to a local file first
+            upload_derivatives = model.prepare_derivatives(field, obj.stream)
+            obj.stream.seek(0)
+            if not cls.put_to_s3(obj.stream, model.aws_key, obj.mimetype):
+                return False
+            if not upload_derivatives():
+                return False
+            model.use_blob(
+                Blob.add_or_find(Blob.for_upload(model, digest, size, obj.mimetype))
+            )
+        return True
+
+    @classmethod
+    def adopt_upload(cls, model, field):
+        """Deduplicate and derive the file the browser stored under ``model.aws_key`` itself.
+
+        As for a file posted with the form, a copy already stored is referenced
+        instead, and the upload deleted; otherwise its derivatives are built and
+        it becomes a new blob. Returns whether that succeeded.
+        """
+        key = model.aws_key
+        with tempfile.SpooledTemporaryFile(
+            max_size=current_app.config["MAX_CONTENT_LENGTH"]
+        ) as original:
+            try:
+                storage.backend.get(key, original)
+            except StorageError as e:
+                current_app.logger.error(f"StorageError caught!! {e}")
+                return False
+            original.seek(0)
+            digest, size = content_digest(original)
+            blob = Blob.find(digest)
+            if blob is None:
+                if not model.prepare_derivatives(field, original)():
                     return False
+                blob = Blob.add_or_find(
+                    Blob.for_upload(model, digest, size, mimetypes.guess_type(key)[0])
+                )
+        if blob.aws_key != key:
+            # the same bytes were already stored, maybe by a concurrent upload
+            cls.delete_stored(stored_keys(key, getattr(model, "image_variants", None)))
+        model.use_blob(blob)
         return True
-    
-    
+
     @classmethod
-    def before_commit(cls, session):
+    def delete_stored(cls, keys):
+        """Delete stray stored files, logging rather than raising errors."""
+        try:
+            storage.backend.delete(keys)
+        except StorageError as e:
+            current_app.logger.error(f"StorageError caught!! {e}")
+
+    def prepare_derivatives(self, field, fileobj):
+        """Hook to build derivatives of an uploaded file before it is sent.
+
+        Returns a callable that uploads them and reports success; it is
+        called once the original is on S3.
         """
-        Before we commit, attempt to save the image to the S3 bucket.
+        return lambda: True
+
+    def use_blob(self, blob):
+        """Reference the stored file ``blob`` instead of a copy of its own."""
+        blob.acquire()
+        self.aws_key = blob.aws_key
+
+    @classmethod
+    def aws_key_for(cls, digest, filename):
+        """The key a file with content ``digest`` is stored under on S3.
+
+        Keys are content-addressed, so identical files map to the same key
+        whoever uploads them and whatever they are called.
+        """
+        _, extension = os.path.splitext(secure_filename(filename))
+        return f"{current_app.config['S3_BLOB_PREFIX']}{digest}{extension.lower()}"
+
+    @classmethod
+    def put_to_s3(cls, fileobj, aws_key, content_type=None):
+        """Store ``fileobj`` with the configured storage backend; return whether it succeeded."""
+        try:
+            storage.backend.put(fileobj, aws_key, content_type)
+        except StorageError as e:
+            current_app.logger.error(f"StorageError caught!! {e}")
+            return False
+        return True
+
+    @classmethod
+    def enqueue_upload(cls, model, session):
+        """Spool the model's files to local disk and queue them for the upload worker.
+
+        Files the browser already uploaded straight to S3 are queued without a
+        spooled copy; the worker deduplicates and derives them, see :meth:`adopt_upload`.
+        """
+        spool_dir = current_app.config["UPLOAD_SPOOL_DIR"]
+        os.makedirs(spool_dir, exist_ok=True)
+        for field in model.__sendtos3__:
+            obj = getattr(model, field)
+            if obj is None:
+                session.add(UploadJob(food=model))
+                model.upload_state = cls.UPLOAD_PENDING
+                continue
+            obj.stream.seek(0)
+            digest, _ = content_digest(obj.stream)
+            blob = Blob.find(digest)
+            if blob is not None:
+                # already on S3; nothing for the worker to do
+                model.use_blob(blob)
+                continue
+            model.aws_key = cls.aws_key_for(digest, obj.filename)
+            spool_path = os.path.join(
+                spool_dir, f"{uuid4().hex}-{secure_filename(obj.filename)}"
+            )
+            obj.save(spool_path)
+            session.add(
+                UploadJob(
+                    food=model,
+                    spool_path=spool_path,
+                    content_type=obj.mimetype,
+                    digest=digest,
+                )
+            )
+            model.upload_state = cls.UPLOAD_PENDING
+
+    @classmethod
+    def before_commit(cls, session):
+        """Before we commit, attempt to save the image to the S3 bucket.
+
         If the upload is unsuccessful, remove the item from the session.
         This should prevent orphaned images on S3.
+
+        In "async" S3_UPLOAD_MODE the image is queued for the upload worker instead.
         """
-        #current_app.logger.info("BEFORE COMMIT")
+        # current_app.logger.info("BEFORE COMMIT")
+        upload_async = current_app.config["S3_UPLOAD_MODE"] == "async"
         for model in list(session.new):
             if isinstance(model, AWS_Mixin):
+                if upload_async:
+                    AWS_Mixin.enqueue_upload(model, session)
+                    model.persistent = True
+                    continue
                 sent_to_s3 = AWS_Mixin.upload_to_s3(model)
                 if not sent_to_s3:
-                    #current_app.logger.info("SEND TO S3 FAILED - REMOVING OBJ FROM SESSION")
+                    # current_app.logger.info("SEND TO S3 FAILED - REMOVING OBJ FROM SESSION")
                     session.expunge(model)
                     # setting this field to signal to the UI (view) that we did not save this obj
                     model.persistent = False
@@ -73,43 +222,256 @@ class AWS_Mixin(object):
                     model.persistent = True
 
 
-
 class FoodItem(SurrogatePK, Model, AWS_Mixin):
-    """Store an actual dish the user uploads"""
-    
-    # list of fields containing data that should be uploaded to s3; if the class extends AWS_Mixin, it must also include the list of fields to send to AWS
-    __sendtos3__ = ['image']
-  
-    
+    """Store an actual dish the user uploads."""
+
+    # list of fields containing data that should be uploaded to s3; if the class extends
+    # AWS_Mixin, it must also include the list of fields to send to AWS
+    __sendtos3__ = ["image"]
+
     __tablename__ = "food"
+    __table_args__ = (
+        # the public feed and profile listings seek on these, newest first
+        db.Index("ix_food_is_public_created_at", "is_public", "created_at", "id"),
+        db.Index("ix_food_user_id_created_at", "user_id", "created_at", "id"),
+        {"extend_existing": True},
+    )
     title = Column(db.String(80), nullable=False)
-    aws_key = Column(db.String(100), nullable=False, unique=True)
+    #: shared by every dish whose image has the same content, see Blob
+    aws_key = Column(db.String(100), nullable=False, index=True)
     comment = Column(db.String(200))
-    created_at = Column(db.DateTime, index=True, nullable=False, default=dt.datetime.utcnow)
-    user_id = Column(db.Integer, db.ForeignKey('users.id'))
+    created_at = Column(
+        db.DateTime, index=True, nullable=False, default=dt.datetime.utcnow
+    )
+    user_id = Column(db.Integer, db.ForeignKey("users.id"))
     is_public = Column(db.Boolean, default=True)
-    
+    upload_state = Column(db.String(10), nullable=False, default=AWS_Mixin.UPLOAD_READY)
+    #: resized copies of the image: {name: {"width": ..., format: aws_key, ...}}, see public.images
+    image_variants = Column(db.JSON)
+    #: None for dishes added before images were deduplicated
+    blob_id = reference_col("blobs", nullable=True)
+    blob = relationship("Blob")
+
     @property
     def aws_url(self):
-        # file should be formatted as follows: https://{bucket_name}.s3.amazonaws.com/{self.aws_key}"
-        return current_app.config["S3_OBJECT_URL_TEMPLATE"].format(current_app.config["S3_BUCKET_NAME"], self.aws_key) 
+        """URL of the image."""
+        return self.url_for_key(self.aws_key)
+
+    @staticmethod
+    def url_for_key(aws_key):
+        """URL of the file stored under ``aws_key``."""
+        return storage.backend.url(aws_key)
+
+    @classmethod
+    def _before_bulk_delete(cls, keys):
+        """Drop the references of dishes deleted without the ORM to their blobs, as release_blobs does."""
+        ids = [key[0] for key in keys]
+        references = (
+            db.select([db.func.count()])
+            .where(db.and_(cls.blob_id == Blob.id, cls.id.in_(ids)))
+            .as_scalar()
+        )
+        db.session.execute(
+            Blob.__table__.update()
+            .where(Blob.id.in_(db.select([cls.blob_id]).where(cls.id.in_(ids))))
+            .values(ref_count=Blob.ref_count - references)
+        )
+
+    def image_url(self, name="carousel", fmt="jpeg"):
+        """URL of a derivative, falling back to the original upload."""
+        variant = (self.image_variants or {}).get(name)
+        if variant is None and self.image_variants:
+            # small originals have no large derivatives; use the largest there is
+            variant = list(self.image_variants.values())[-1]
+        if variant is None or fmt not in variant:
+            return self.aws_url
+        return self.url_for_key(variant[fmt])
+
+    def srcset(self, fmt="jpeg"):
+        """``srcset`` attribute value listing the derivatives in ``fmt``, or None."""
+        variants = [v for v in (self.image_variants or {}).values() if fmt in v]
+        if not variants:
+            return None
+        return ", ".join(f"{self.url_for_key(v[fmt])} {v['width']}w" for v in variants)
 
     @property
-    def __aws_key_prefix__(self):
-        # if the objects should be prepended with a prefix before going into the AWS bucket
-        # Note - author is a backref defined in the User model
-        return self.author.username
-    
+    def image_formats(self):
+        """Formats the derivatives are available in, preferred first."""
+        return [
+            fmt
+            for fmt in FORMATS
+            if any(fmt in v for v in (self.image_variants or {}).values())
+        ]
+
+    def prepare_derivatives(self, field, fileobj):
+        """Resize the image now, and upload the results after the original."""
+        derivatives = make_derivatives(fileobj)
+
+        def upload():
+            try:
+                self.image_variants = store_derivatives(self.aws_key, derivatives)
+            except StorageError as e:
+                current_app.logger.error(f"StorageError caught!! {e}")
+                return False
+            return True
+
+        return upload
+
+    def use_blob(self, blob):
+        """Reference ``blob`` and the derivatives stored with it."""
+        AWS_Mixin.use_blob(self, blob)
+        self.blob = blob
+        self.image_variants = blob.image_variants
+
     def __init__(self, title, image=None, **kwargs):
         """Create instance."""
-        self.image = image 
+        self.image = image
         db.Model.__init__(self, title=title, **kwargs)
-        
 
     def __repr__(self):
         """Represent instance as a unique string."""
-        return f"<FoodItem({self.title})>"  
-    
-    
-    
-db.event.listen(db.session, 'before_commit', AWS_Mixin.before_commit)
\ No newline at end of file
+        return f"<FoodItem({self.title})>"
+
+
+class UploadJob(SurrogatePK, Model):
+    """An image spooled to local disk, waiting for the upload worker to send it to S3."""
+
+    __tablename__ = "upload_jobs"
+    food_id = reference_col("food", foreign_key_kwargs={"ondelete": "CASCADE"})
+    food = relationship("FoodItem")
+    #: None when the original is already on S3 and only derivatives are needed
+    spool_path = Column(db.String(255))
+    content_type = Column(db.String(100))
+    #: SHA-256 of the spooled file, see Blob
+    digest = Column(db.String(64))
+    attempts = Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = Column(
+        db.DateTime, index=True, nullable=False, default=dt.datetime.utcnow
+    )
+    last_error = Column(db.String(255))
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<UploadJob({self.food_id}, attempts={self.attempts})>"
+
+
+class Blob(SurrogatePK, Model):
+    """A file stored once on S3, under a key derived from its SHA-256.
+
+    Dishes with identical images reference the same blob instead of uploading
+    another copy. ``ref_count`` counts them; blobs no dish references any more
+    are removed by the ``prune-blobs`` command.
+
+    Two identical first uploads racing each other both reach S3 (under the same
+    key); the second to insert its blob references the first one's instead,
+    see :meth:`add_or_find`.
+    """
+
+    __tablename__ = "blobs"
+    digest = Column(db.String(64), nullable=False, unique=True)
+    aws_key = Column(db.String(100), nullable=False)
+    content_type = Column(db.String(100))
+    size = Column(db.Integer, nullable=False)
+    ref_count = Column(db.Integer, nullable=False, default=0)
+    #: derivatives of the file, in the format of FoodItem.image_variants
+    image_variants = Column(db.JSON)
+    created_at = Column(db.DateTime, nullable=False, default=dt.datetime.utcnow)
+
+    @classmethod
+    def find(cls, digest):
+        """The blob holding content ``digest``, or None.
+
+        The blob is share-locked until the transaction ends, so
+        :func:`~food_journal.public.uploads.prune_blobs` cannot delete it
+        while a reference to it is being added.
+        """
+        # called from before_commit, while the dish being uploaded is pending without an aws_key
+        with db.session.no_autoflush:
+            return cls.query.filter_by(digest=digest).with_for_update(read=True).first()
+
+    @classmethod
+    def for_upload(cls, model, digest, size, content_type):
+        """A new blob for the file just uploaded for ``model``."""
+        return cls(
+            digest=digest,
+            aws_key=model.aws_key,
+            size=size,
+            content_type=content_type,
+            image_variants=getattr(model, "image_variants", None),
+        )
+
+    @classmethod
+    def add_or_find(cls, blob):
+        """Insert the new ``blob``, or return the blob a concurrent upload of the same content stored first.
+
+        The insert runs in a savepoint, so losing the race on the unique digest
+        leaves the rest of the transaction alone. Pending objects are flushed first.
+        """
+        try:
+            with db.session.begin_nested():
+                db.session.add(blob)
+        except IntegrityError:
+            return cls.find(blob.digest)
+        return blob
+
+    def acquire(self):
+        """Count one more reference."""
+        if self.id is None:
+            self.ref_count = (self.ref_count or 0) + 1
+        else:
+            # increment in SQL, so concurrent references are not lost
+            self.ref_count = Blob.ref_count + 1
+
+    @property
+    def keys(self):
+        """Every S3 key stored for this blob: the file and its derivatives."""
+        return stored_keys(self.aws_key, self.image_variants)
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<Blob({self.digest[:12]}, refs={self.ref_count})>"
+
+
+class ImportRun(SurrogatePK, Model):
+    """Progress of a ``flask import-dishes`` run, see public.imports.
+
+    ``rows_done`` is committed together with the batch of dishes it counts.
+    """
+
+    __tablename__ = "import_runs"
+    name = Column(db.String(255), nullable=False, unique=True)
+    rows_done = Column(db.Integer, nullable=False, default=0)
+    updated_at = Column(
+        db.DateTime,
+        nullable=False,
+        default=dt.datetime.utcnow,
+        onupdate=dt.datetime.utcnow,
+    )
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<ImportRun({self.name}, rows={self.rows_done})>"
+
+
+def release_blobs(session, flush_context):
+    """Drop the references of deleted dishes to their blobs."""
+    for model in session.deleted:
+        if isinstance(model, FoodItem) and model.blob_id is not None:
+            session.execute(
+                Blob.__table__.update()
+                .where(Blob.id == model.blob_id)
+                .values(ref_count=Blob.ref_count - 1)
+            )
+
+
+def with_author():
+    """Query option loading ``FoodItem.author`` in the same query, for listings.
+
+    Templates show the author of every dish, so without it a listing of N dishes
+    issues N extra queries for the (lazy) author backref.
+    """
+    return db.joinedload(FoodItem.author)
+
+
+db.event.listen(db.session, "before_commit", AWS_Mixin.before_commit)
+db.event.listen(db.session, "after_flush", release_blobs)
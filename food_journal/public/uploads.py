@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""Background upload worker, used when ``S3_UPLOAD_MODE`` is "async".
+
+Requests only spool images to ``UPLOAD_SPOOL_DIR`` and queue an
+:class:`UploadJob` in the same transaction as the dish, so a slow S3 call
+never holds a database transaction or a web worker. This worker sends the
+spooled files to S3, retrying with exponential backoff, and marks the dishes
+ready so they show up in feeds.
+
+It also removes blobs no dish references any more, see :func:`prune_blobs`.
+"""
+import datetime as dt
+import os
+import time
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from food_journal.database import db
+from food_journal.extensions import storage
+from food_journal.public.models import AWS_Mixin, Blob, UploadJob
+from food_journal.storage import StorageError
+
+
+def claim_job(now=None):
+    """Lock and return the next job that is due, or None."""
+    now = now or dt.datetime.utcnow()
+    return (
+        UploadJob.query.filter(UploadJob.next_attempt_at <= now)
+        .order_by(UploadJob.next_attempt_at, UploadJob.id)
+        .with_for_update(skip_locked=True)
+        .first()
+    )
+
+
+def process_job(job, now=None):
+    """Upload one spooled file; return whether it reached S3."""
+    now = now or dt.datetime.utcnow()
+    food = job.food
+    # a failed attempt undoes its writes, but the job stays locked until that is recorded
+    savepoint = db.session.begin_nested()
+    uploaded, error = attempt_upload(job)
+    if uploaded:
+        savepoint.commit()
+        spool_path = job.spool_path
+        food.upload_state = AWS_Mixin.UPLOAD_READY
+        db.session.delete(job)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # another worker stored the same content first; the retry will reference its blob
+            db.session.rollback()
+            return False
+        if spool_path:
+            os.remove(spool_path)
+        return True
+
+    savepoint.rollback()
+    job.attempts += 1
+    job.last_error = error[:255]
+    if job.attempts >= current_app.config["UPLOAD_MAX_ATTEMPTS"]:
+        # keep the spooled file so the upload can be investigated and retried by hand
+        current_app.logger.error(f"Giving up on uploading {food.aws_key}: {error}")
+        food.upload_state = AWS_Mixin.UPLOAD_FAILED
+        db.session.delete(job)
+    else:
+        backoff = current_app.config["UPLOAD_RETRY_BACKOFF"] * 2 ** (job.attempts - 1)
+        job.next_attempt_at = now + dt.timedelta(seconds=backoff)
+    db.session.commit()
+    return False
+
+
+def attempt_upload(job):
+    """Send the job's file to S3; return whether it did, and the error if not."""
+    try:
+        if job.spool_path is None:
+            uploaded = AWS_Mixin.adopt_upload(job.food, "image")
+        else:
+            uploaded = upload_spooled(job)
+    except (OSError, StorageError) as e:
+        return False, str(e)
+    except Exception as e:
+        # count anything else as a failed attempt too, so one bad upload cannot stop the queue
+        current_app.logger.exception(f"Uploading {job.food.aws_key} failed")
+        return False, f"{type(e).__name__}: {e}"
+    return uploaded, None if uploaded else "S3 upload failed"
+
+
+def upload_spooled(job):
+    """Send a spooled file and its derivatives to S3, unless its content is already there."""
+    food = job.food
+    blob = Blob.find(job.digest) if job.digest else None
+    if blob is not None:
+        food.use_blob(blob)
+        return True
+    with open(job.spool_path, "rb") as spooled:
+        upload_derivatives = food.prepare_derivatives("image", spooled)
+        spooled.seek(0)
+        if not (
+            AWS_Mixin.put_to_s3(spooled, food.aws_key, job.content_type)
+            and upload_derivatives()
+        ):
+            return False
+    if job.digest:
+        size = os.path.getsize(job.spool_path)
+        food.use_blob(Blob.for_upload(food, job.digest, size, job.content_type))
+    return True
+
+
+def run_worker(poll_interval=None, once=False):
+    """Process due jobs until interrupted; with ``once``, stop when none are due.
+
+    Returns the number of jobs processed.
+    """
+    poll_interval = poll_interval or current_app.config["UPLOAD_WORKER_POLL_INTERVAL"]
+    processed = 0
+    while True:
+        job = claim_job()
+        if job is None:
+            db.session.rollback()  # release the snapshot before sleeping
+            if once:
+                return processed
+            time.sleep(poll_interval)
+            continue
+        process_job(job)
+        processed += 1
+
+
+def prune_blobs():
+    """Delete blobs no dish references, and their stored files.
+
+    Returns the number of blobs deleted.
+    """
+    pruned = 0
+    while True:
+        # skips blobs that uploads are adding references to, see Blob.find
+        candidates = (
+            Blob.query.filter(Blob.ref_count <= 0)
+            .order_by(Blob.id)
+            .limit(100)
+            .with_for_update(skip_locked=True)
+            .populate_existing()
+            .all()
+        )
+        if not candidates:
+            db.session.rollback()
+            return pruned
+        # checked again as read under the lock, rather than as this session last saw them
+        blobs = [blob for blob in candidates if blob.ref_count <= 0]
+        keys = [key for blob in blobs for key in blob.keys]
+        for blob in blobs:
+            db.session.delete(blob)
+        db.session.commit()
+        # only once the rows are gone: a failed delete leaves stray files, not blobs without files
+        storage.backend.delete(keys)
+        pruned += len(blobs)
@@ -1,60 +1,101 @@
 # -*- coding: utf-8 -*-
 """Public section, including homepage and signup."""
+import mimetypes
+from uuid import uuid4
+
 from flask import (
     Blueprint,
+    Response,
+    abort,
     current_app,
     flash,
+    jsonify,
     redirect,
     render_template,
     request,
     url_for,
-    Response,
 )
-from flask_login import login_required, login_user, logout_user, current_user
+from flask_login import current_user, login_required, login_user, logout_user
 
-from food_journal.extensions import login_manager
-from food_journal.public.forms import LoginForm, FoodForm
+from food_journal.database import db
+from food_journal.extensions import activity, login_manager, storage
+from food_journal.public.feed import (
+    InvalidCursor,
+    render_followed_feed,
+    render_public_feed,
+    serialize_followed_feed,
+    serialize_public_feed,
+)
+from food_journal.public.forms import DirectUploadForm, FoodForm, LoginForm
+from food_journal.public.models import FoodItem
+from food_journal.routing import read_only
+from food_journal.storage import StorageError
 from food_journal.user.forms import RegisterForm
+from food_journal.user.identity import load_identity
 from food_journal.user.models import User
-from food_journal.public.models import FoodItem
 from food_journal.utils import flash_errors
-from food_journal.database import db
-
-from werkzeug.utils import secure_filename
-
-from datetime import datetime
-
 
 blueprint = Blueprint("public", __name__, static_folder="../static")
 
 
-
 @blueprint.before_request
 def before_request():
+    """Record that the logged-in user was active."""
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
-        db.session.commit()
+        activity.seen(current_user.id)
 
 
 @login_manager.user_loader
 def load_user(user_id):
     """Load user by ID."""
-    return User.get_by_id(int(user_id))
+    return load_identity(int(user_id))
+
 
-    
 @blueprint.route("/")
 @blueprint.route("/index")
+@read_only
 def index():
+    """Home page, with the public feed."""
     form = LoginForm()
+    before = request.args.get("before")
 
-    if current_user and current_user.is_authenticated:
-        #foodList = current_user.food_items.order_by(FoodItem.created_at.desc()).all()
-        foodList = current_user.followed_food_items().all()
-    else:
-        # arbitrarily limiting num results to 20 -- FIX ME
-        foodList = FoodItem.query.filter_by(is_public=True).order_by(FoodItem.created_at.desc()).all()    
+    try:
+        if current_user and current_user.is_authenticated:
+            feed = render_followed_feed(current_user, before=before)
+        else:
+            feed = render_public_feed(before=before)
+    except InvalidCursor:
+        abort(400)
+
+    return render_template("public/index.html", form=form, feed=feed)
 
-    return render_template("public/index.html", form=form, foodList=foodList)
+
+@blueprint.route("/api/feed")
+@read_only
+def feed_api():
+    """A page of the home feed as JSON, for loading more dishes on demand."""
+    before = request.args.get("before")
+    authenticated = current_user and current_user.is_authenticated
+
+    try:
+        if authenticated:
+            body, etag, last_modified = serialize_followed_feed(
+                current_user, before=before
+            )
+        else:
+            body, etag, last_modified = serialize_public_feed(before=before)
+    except InvalidCursor:
+        abort(400)
+
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # let clients keep the page, but revalidate it every time
+    response.cache_control.no_cache = True
+    if authenticated:
+        response.cache_control.private = True
+    response.vary.add("Cookie")
+    return response.make_conditional(request)
 
 
 @blueprint.route("/logout/")
@@ -84,30 +125,119 @@ def register():
     return render_template("public/register.html", form=form)
 
 
+@blueprint.route("/media/<path:key>")
+def media(key):
+    """Serve a stored image, for storage backends that browsers cannot reach directly."""
+    return storage.backend.send(key)
+
+
 @blueprint.route("/add/", methods=["GET", "POST"])
 def add_dish():
-    """Add a new image"""    
+    """Add a new image."""
     form = FoodForm()
-    
+
     if form.validate_on_submit():
 
         fooditem = FoodItem.create(
             title=form.title.data,
             comment=form.comment.data,
-            image = form.image.data,
-            author= current_user,
-            is_public = form.is_public.data
-        )                       
-        if fooditem.persistent:
-            flash("Thank you for adding a dish.", "success")
-        else:
-            flash("Sorry, there was an error uploading your image. Please try again later.", "danger")
+            image=form.image.data,
+            author=current_user,
+            is_public=form.is_public.data,
+        )
+        flash_added(fooditem)
         return redirect(url_for("public.index"))
     else:
         flash_errors(form)
     return render_template("public/add-dish.html", form=form)
 
 
+@blueprint.route("/add/presign", methods=["POST"])
+@login_required
+def presign_dish():
+    """Let the browser upload an image straight to S3.
+
+    Returns a presigned POST whose policy only accepts one new key under the
+    user's prefix, an allowed image type and at most MAX_CONTENT_LENGTH bytes.
+    The bucket needs a CORS rule allowing POSTs from the site's origin.
+    """
+    filename = request.form.get("filename", "")
+    extension = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    if extension not in FoodForm.ALLOWED_EXTENSIONS:
+        return jsonify(errors=["Images only!"]), 400
+
+    key = f"{current_user.username}/uploads/{uuid4().hex}.{extension}"
+    post = storage.backend.presigned_post(
+        key,
+        mimetypes.guess_type(filename)[0],
+        current_app.config["MAX_CONTENT_LENGTH"],
+        current_app.config["S3_PRESIGNED_POST_EXPIRES"],
+    )
+    if post is None:
+        # the storage backend is not reachable from browsers; post the form instead
+        return jsonify(errors=["Direct uploads are not available"]), 404
+    return jsonify(url=post["url"], fields=post["fields"], key=key)
+
+
+@blueprint.route("/add/finalize", methods=["POST"])
+@login_required
+def finalize_dish():
+    """Create the dish for an image the browser uploaded with :func:`presign_dish`."""
+    form = DirectUploadForm()
+    if not form.validate_on_submit():
+        return (
+            jsonify(
+                errors=[error for errors in form.errors.values() for error in errors]
+            ),
+            400,
+        )
+
+    key = form.key.data
+    extension = key.rsplit(".", 1)[-1]
+    if (
+        not key.startswith(f"{current_user.username}/uploads/")
+        or extension not in FoodForm.ALLOWED_EXTENSIONS
+    ):
+        return jsonify(errors=["Unknown upload"]), 400
+    try:
+        head = storage.backend.head(key)
+    except StorageError:
+        head = None
+    if head is None:
+        return jsonify(errors=["Unknown upload"]), 400
+    if head["size"] > current_app.config["MAX_CONTENT_LENGTH"] or not (
+        head["content_type"] or ""
+    ).startswith("image/"):
+        return jsonify(errors=["Images only!"]), 400
+    if db.session.query(FoodItem.query.filter_by(aws_key=key).exists()).scalar():
+        # each presigned upload makes one dish
+        return jsonify(errors=["Unknown upload"]), 400
+
+    fooditem = FoodItem.create(
+        title=form.title.data,
+        comment=form.comment.data,
+        aws_key=key,
+        author=current_user,
+        is_public=form.is_public.data,
+    )
+    flash_added(fooditem)
+    return jsonify(redirect=url_for("public.index"))
+
+
+def flash_added(fooditem):
+    """Tell the user how adding their dish went."""
+    if fooditem.upload_state == FoodItem.UPLOAD_PENDING:
+        flash(
+            "Thank you for adding a dish. It will appear as soon as its image is uploaded.",
+            "success",
+        )
+    elif fooditem.persistent:
+        flash("Thank you for adding a dish.", "success")
+    else:
+        flash(
+            "Sorry, there was an error uploading your image. Please try again later.",
+            "danger",
+        )
 
 
 @blueprint.route("/login", methods=["GET", "POST"])
@@ -115,15 +245,16 @@ def login():
     """Home page."""
     form = LoginForm()
 
-    # Handle logging in 
+    # Handle logging in
     if form.validate_on_submit():
         login_user(form.user)
+        db.session.commit()  # saves a password rehashed at the current cost
         flash("You are logged in.", "success")
         redirect_url = request.args.get("next") or url_for("public.index")
         return redirect(redirect_url)
     else:
         flash_errors(form)
-    return redirect(url_for('public.index'))
+    return redirect(url_for("public.index"))
 
 
 @blueprint.route("/about/")
@@ -131,5 +262,3 @@ def about():
     """About page."""
     form = LoginForm(request.form)
     return render_template("public/about.html", form=form)
-
-
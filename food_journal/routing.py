@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Read replica routing.
+
+Each URL in ``DATABASE_REPLICA_URLS`` becomes a ``replicaN`` bind in
+``SQLALCHEMY_BINDS``. Queries go to the primary unless they are marked: views
+decorated with :func:`read_only`, and blocks run in :func:`replica_reads`, send
+their ``SELECT`` statements to one of the replicas, picked per session. Writes
+always go to the primary, and so does everything a session reads once it has
+written, flushed or executed anything but a ``SELECT``.
+
+Replicas lag behind the primary. For ``REPLICA_MAX_LAG`` seconds after a
+request commits a write, the browser's session cookie keeps that user's
+requests on the primary, so they see their own changes. Code that fills a
+cache from marked reads must not store what a lagging replica returns; see
+:func:`food_journal.utils.reads_for_version`.
+
+Without replicas configured everything goes to the primary. To try it
+locally, point ``DATABASE_REPLICA_URLS`` at a second database with the same
+schema (``flask db upgrade`` against it); it will only show what is copied
+into it, which makes stale reads easy to spot.
+"""
+import functools
+import random
+import time
+from contextlib import contextmanager
+
+from flask import current_app, has_request_context
+from flask import session as browser_session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import orm
+from sqlalchemy.sql.selectable import SelectBase
+
+REPLICA_BIND_PREFIX = "replica"
+#: key of the browser session holding when its user's reads may use replicas again
+PRIMARY_UNTIL = "_primary_until"
+
+
+def replica_binds(urls):
+    """``SQLALCHEMY_BINDS`` entries for the replica database URLs ``urls``."""
+    return {f"{REPLICA_BIND_PREFIX}{index}": url for index, url in enumerate(urls)}
+
+
+class RoutingSession(SignallingSession):
+    """Session sending marked reads to a replica and everything else to the primary."""
+
+    def __init__(self, db, **options):
+        """Create instance."""
+        SignallingSession.__init__(self, db, **options)
+        self.db = db
+        replicas = [
+            key
+            for key in self.app.config["SQLALCHEMY_BINDS"] or {}
+            if key.startswith(REPLICA_BIND_PREFIX)
+        ]
+        self.replica = random.choice(replicas) if replicas else None
+
+    def get_bind(self, mapper=None, clause=None):
+        """The replica for a marked ``SELECT``, otherwise what Flask-SQLAlchemy picks."""
+        if not isinstance(clause, SelectBase):
+            # flushes, DML, text and connection() calls; read from the primary from now on
+            self.info["wrote"] = True
+        elif self._reads_from_replica():
+            return self.db.get_engine(self.app, bind=self.replica)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+    def _reads_from_replica(self):
+        if self.replica is None or self._flushing or self.info.get("wrote"):
+            return False
+        if (
+            self.info.get("replica_reads", 0) <= 0
+            or self.info.get("primary_reads", 0) > 0
+        ):
+            return False
+        # the user committed a write recently; the replica may not have it yet
+        return not (
+            has_request_context()
+            and browser_session.get(PRIMARY_UNTIL, 0) > time.time()
+        )
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with a :class:`RoutingSession`."""
+
+    def create_session(self, options):
+        """Create the session factory used by :meth:`create_scoped_session`."""
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def stick_to_primary(session):
+    """After a request commits a write, keep its user on the primary until the replicas have it."""
+    if (
+        session.info.get("wrote")
+        and session.replica is not None
+        and has_request_context()
+    ):
+        browser_session[PRIMARY_UNTIL] = (
+            time.time() + current_app.config["REPLICA_MAX_LAG"]
+        )
+
+
+def _session():
+    return current_app.extensions["sqlalchemy"].db.session
+
+
+@contextmanager
+def _counting(name):
+    info = _session().info
+    info[name] = info.get(name, 0) + 1
+    try:
+        yield
+    finally:
+        info[name] -= 1
+
+
+def replica_reads():
+    """Send the ``SELECT`` statements of the block to a replica, unless the session has written."""
+    return _counting("replica_reads")
+
+
+def primary_reads():
+    """Read from the primary within the block, even in a :func:`replica_reads` block."""
+    return _counting("primary_reads")
+
+
+def reads_from_replica():
+    """Whether a ``SELECT`` run now would go to a replica."""
+    return _session()()._reads_from_replica()
+
+
+def read_only(view):
+    """Mark a view that only reads: its queries go to a replica, see :func:`replica_reads`."""
+
+    @functools.wraps(view)
+    def decorated(*args, **kwargs):
+        with replica_reads():
+            return view(*args, **kwargs)
+
+    return decorated
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""In-process cache of model rows, for ``SurrogatePK.get_by_id``.
+
+Models opt in with ``__cache_by_id__ = True``. Their rows are kept in each
+worker process as the pickled tuple of their column values, keyed by class
+name and primary key, for up to ``ROW_CACHE_TIMEOUT`` seconds. At most
+``ROW_CACHE_SIZE`` rows are kept; the least recently used go first. Pickling
+keeps entries compact and hands every session its own copy of mutable values
+such as JSON columns.
+
+Commits and rollbacks in a process evict the rows they changed from that
+process's cache, see :mod:`food_journal.database`. Other processes, and
+statements that bypass the ORM and the ``CRUDMixin`` bulk methods, such as the
+``last_seen`` writes, only show up once the entry expires, so only opt in
+models that may be that stale.
+"""
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from food_journal.process import ProcessState
+
+
+class _RowCacheState(ProcessState):
+    """Per-app settings; the entries are per process."""
+
+    def __init__(self, app):
+        super().__init__()
+        self.timeout = app.config["ROW_CACHE_TIMEOUT"]
+        self.size = app.config["ROW_CACHE_SIZE"]
+
+    def reset(self):
+        """Start empty, as a new process does."""
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+
+class RowCache(object):
+    """Flask extension keeping an LRU cache of rows, with a TTL, in each process."""
+
+    def __init__(self, app=None):
+        """Create instance."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Register the extension."""
+        app.extensions["row_cache"] = _RowCacheState(app)
+
+    def _state(self):
+        return current_app.extensions["row_cache"].for_process()
+
+    def get_many(self, keys):
+        """Map those of ``keys`` that are cached and not expired to their value."""
+        state = self._state()
+        found = {}
+        now = time.monotonic()
+        with state.lock:
+            for key in keys:
+                entry = state.entries.get(key)
+                if entry is not None and entry[0] <= now:
+                    del state.entries[key]
+                    entry = None
+                if entry is None:
+                    state.misses += 1
+                    continue
+                state.entries.move_to_end(key)
+                state.hits += 1
+                found[key] = entry[1]
+        return found
+
+    def set_many(self, values):
+        """Cache the ``{key: value}`` mapping ``values``, evicting the least recently used entries."""
+        state = self._state()
+        if state.size <= 0:
+            return
+        expires = time.monotonic() + state.timeout
+        with state.lock:
+            for key, value in values.items():
+                state.entries[key] = (expires, value)
+                state.entries.move_to_end(key)
+            while len(state.entries) > state.size:
+                state.entries.popitem(last=False)
+
+    def delete_many(self, keys):
+        """Evict ``keys``; a ``(name, None)`` key evicts every row of that class name."""
+        state = self._state()
+        with state.lock:
+            for key in keys:
+                if key[1] is None:
+                    for cached in [
+                        cached for cached in state.entries if cached[0] == key[0]
+                    ]:
+                        del state.entries[cached]
+                else:
+                    state.entries.pop(key, None)
+
+    def clear(self):
+        """Evict everything cached by this process."""
+        state = self._state()
+        with state.lock:
+            state.reset()
+
+    def stats(self):
+        """Hits, misses and size of the current process's cache."""
+        state = self._state()
+        with state.lock:
+            return {
+                "hits": state.hits,
+                "misses": state.misses,
+                "size": len(state.entries),
+            }
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""A process-wide, pooled S3 client for the app."""
+import boto3
+from botocore.config import Config
+from flask import current_app
+
+from food_journal.process import ProcessState
+
+
+class _S3State(ProcessState):
+    """Per-app client state; the client is rebuilt in each process after a fork."""
+
+    def __init__(self, config):
+        super().__init__()
+        self.config = config
+        self.client = None
+
+    def reset(self):
+        """Create the client of a new process."""
+        self.client = S3.create_client(self.config)
+
+
+class S3(object):
+    """Flask extension giving every request the same S3 client.
+
+    Creating a client resolves credentials, loads the service model and starts a
+    new connection pool, which costs far more than most small uploads. boto3
+    clients are safe to share between threads, and so between greenlets under
+    gunicorn's gevent workers, as long as the pool is large enough for the
+    concurrent uploads (``S3_MAX_POOL_CONNECTIONS``).
+    """
+
+    def __init__(self, app=None):
+        """Create instance."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Register the extension; the client itself is created on first use."""
+        app.extensions["s3"] = _S3State(app.config)
+
+    @property
+    def client(self):
+        """The S3 client of the current app and process."""
+        return current_app.extensions["s3"].for_process().client
+
+    @staticmethod
+    def create_client(config):
+        """Build a client from the app settings, with its own botocore session."""
+        return boto3.session.Session().client(
+            "s3",
+            config=Config(
+                max_pool_connections=config["S3_MAX_POOL_CONNECTIONS"],
+                connect_timeout=config["S3_CONNECT_TIMEOUT"],
+                read_timeout=config["S3_READ_TIMEOUT"],
+                retries={"max_attempts": config["S3_MAX_ATTEMPTS"], "mode": "standard"},
+            ),
+        )
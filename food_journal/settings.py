@@ -8,19 +8,99 @@ environment variables.
 """
 from environs import Env
 
+from food_journal.routing import replica_binds
+
 env = Env()
 env.read_env()
 
 ENV = env.str("FLASK_ENV", default="production")
 DEBUG = ENV == "development"
 SQLALCHEMY_DATABASE_URI = env.str("DATABASE_URL")
+# read replicas, used by views marked read-only, see food_journal.routing
+SQLALCHEMY_BINDS = replica_binds(env.list("DATABASE_REPLICA_URLS", default=[]))
+REPLICA_MAX_LAG = env.float(
+    "REPLICA_MAX_LAG", default=5.0
+)  # seconds writes take to reach every replica
 SECRET_KEY = env.str("SECRET_KEY")
 SEND_FILE_MAX_AGE_DEFAULT = env.int("SEND_FILE_MAX_AGE_DEFAULT")
 BCRYPT_LOG_ROUNDS = env.int("BCRYPT_LOG_ROUNDS", default=13)
+# native threads hashing passwords per process, off the gevent loop; 0 hashes inline
+BCRYPT_POOL_SIZE = env.int("BCRYPT_POOL_SIZE", default=2)
 DEBUG_TB_ENABLED = DEBUG
 DEBUG_TB_INTERCEPT_REDIRECTS = False
-CACHE_TYPE = "simple"  # Can be "memcached", "redis", etc.
+# Use a shared backend such as "redis" in production so every worker sees the same entries
+CACHE_TYPE = env.str("CACHE_TYPE", default="simple")
+CACHE_REDIS_URL = env.str("CACHE_REDIS_URL", default="redis://localhost:6379/0")
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+BULK_CHUNK_SIZE = env.int(
+    "BULK_CHUNK_SIZE", default=1000
+)  # rows per statement of CRUDMixin.bulk_* and upsert
 MAX_CONTENT_LENGTH = env.int("MAX_CONTENT_LENGTH")
-S3_BUCKET_NAME = env.str("S3_BUCKET_NAME")
-S3_OBJECT_URL_TEMPLATE = env.str("S3_OBJECT_URL_TEMPLATE")
+# "s3", "local" (files under STORAGE_LOCAL_ROOT, served by the app) or "memory", see food_journal.storage
+STORAGE_BACKEND = env.str("STORAGE_BACKEND", default="s3")
+STORAGE_LOCAL_ROOT = env.str("STORAGE_LOCAL_ROOT", default="/tmp/food_journal/media")
+STORAGE_CACHE_TIMEOUT = env.int(
+    "STORAGE_CACHE_TIMEOUT", default=365 * 24 * 60 * 60
+)  # stored keys never change
+S3_BUCKET_NAME = env.str("S3_BUCKET_NAME", default=None)  # required with the s3 backend
+S3_OBJECT_URL_TEMPLATE = env.str(
+    "S3_OBJECT_URL_TEMPLATE", default="https://{}.s3.amazonaws.com/{}"
+)
+S3_MULTIPART_THRESHOLD = env.int("S3_MULTIPART_THRESHOLD", default=8 * 1024 * 1024)
+S3_MULTIPART_CHUNKSIZE = env.int("S3_MULTIPART_CHUNKSIZE", default=8 * 1024 * 1024)
+S3_MAX_CONCURRENCY = env.int("S3_MAX_CONCURRENCY", default=4)
+# shared by every greenlet of a worker; size it for concurrent uploads x S3_MAX_CONCURRENCY
+S3_MAX_POOL_CONNECTIONS = env.int("S3_MAX_POOL_CONNECTIONS", default=50)
+S3_MAX_ATTEMPTS = env.int("S3_MAX_ATTEMPTS", default=3)
+S3_CONNECT_TIMEOUT = env.float("S3_CONNECT_TIMEOUT", default=5.0)
+S3_READ_TIMEOUT = env.float("S3_READ_TIMEOUT", default=30.0)
+S3_PRESIGNED_POST_EXPIRES = env.int("S3_PRESIGNED_POST_EXPIRES", default=600)  # seconds
+S3_BLOB_PREFIX = env.str(
+    "S3_BLOB_PREFIX", default="blobs/"
+)  # content-addressed image keys
+S3_UPLOAD_MODE = env.str(
+    "S3_UPLOAD_MODE", default="sync"
+)  # or "async", see `flask upload-worker`
+IMAGE_DERIVATIVE_FORMATS = env.list(
+    "IMAGE_DERIVATIVE_FORMATS", default=["webp"]
+)  # and/or "avif"; JPEG is always made
+IMAGE_QUALITY = env.int("IMAGE_QUALITY", default=80)
+UPLOAD_SPOOL_DIR = env.str("UPLOAD_SPOOL_DIR", default="/tmp/food_journal/uploads")
+UPLOAD_MAX_ATTEMPTS = env.int("UPLOAD_MAX_ATTEMPTS", default=8)
+UPLOAD_RETRY_BACKOFF = env.int(
+    "UPLOAD_RETRY_BACKOFF", default=5
+)  # seconds, doubled per attempt
+UPLOAD_WORKER_POLL_INTERVAL = env.float("UPLOAD_WORKER_POLL_INTERVAL", default=1.0)
+FEED_PAGE_SIZE = env.int(
+    "FEED_PAGE_SIZE", default=6
+)  # more are fetched from /api/feed on demand
+TIMELINE_FANOUT_LIMIT = env.int("TIMELINE_FANOUT_LIMIT", default=5000)
+TIMELINE_BACKFILL_SIZE = env.int("TIMELINE_BACKFILL_SIZE", default=200)
+FEED_CACHE_TIMEOUT = env.int("FEED_CACHE_TIMEOUT", default=300)
+IDENTITY_CACHE_TIMEOUT = env.int(
+    "IDENTITY_CACHE_TIMEOUT", default=60
+)  # seconds a logged-in user is cached
+FOLLOW_GRAPH_CACHE_TIMEOUT = env.int(
+    "FOLLOW_GRAPH_CACHE_TIMEOUT", default=3600
+)  # invalidated on follow/unfollow
+ROW_CACHE_TIMEOUT = env.int(
+    "ROW_CACHE_TIMEOUT", default=30
+)  # seconds other workers may serve a stale row
+ROW_CACHE_SIZE = env.int(
+    "ROW_CACHE_SIZE", default=10000
+)  # rows cached by get_by_id per process
+MEMBERS_PAGE_SIZE = env.int("MEMBERS_PAGE_SIZE", default=30)
+TYPEAHEAD_LIMIT = env.int("TYPEAHEAD_LIMIT", default=10)
+FOLLOW_SUGGESTIONS_SIZE = env.int(
+    "FOLLOW_SUGGESTIONS_SIZE", default=20
+)  # kept per user, see `flask suggest-follows`
+FOLLOW_SUGGESTIONS_SHOWN = env.int("FOLLOW_SUGGESTIONS_SHOWN", default=5)
+FOLLOW_SUGGESTIONS_ACTIVE_DAYS = env.int(
+    "FOLLOW_SUGGESTIONS_ACTIVE_DAYS", default=90
+)  # only suggest users seen since
+LAST_SEEN_INTERVAL = env.int(
+    "LAST_SEEN_INTERVAL", default=300
+)  # seconds; how stale last_seen may be
+LAST_SEEN_FLUSH_INTERVAL = env.float(
+    "LAST_SEEN_FLUSH_INTERVAL", default=30.0
+)  # seconds between bulk writes
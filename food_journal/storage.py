@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""Where uploaded images are stored, selected by the ``STORAGE_BACKEND`` setting.
+
+- ``s3``: the S3 bucket ``S3_BUCKET_NAME``, served straight from S3.
+- ``local``: files under ``STORAGE_LOCAL_ROOT``, served by the app.
+- ``memory``: a dict in the process, for tests and profiling without S3.
+
+Stored keys are content-addressed and never rewritten, so the app serves them
+with a long ``Cache-Control`` max-age plus ETag/Last-Modified validators.
+"""
+import abc
+import hashlib
+import mimetypes
+import os
+import shutil
+import threading
+from uuid import uuid4
+
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import BotoCoreError, ClientError
+from flask import abort, current_app, request, send_from_directory, url_for
+from werkzeug.security import safe_join
+
+
+def s3_transfer_config():
+    """Transfer settings for uploads: part size, parallelism and when to go multipart.
+
+    Memory held per upload is bounded by roughly chunksize * concurrency.
+    """
+    config = current_app.config
+    return TransferConfig(
+        multipart_threshold=config["S3_MULTIPART_THRESHOLD"],
+        multipart_chunksize=config["S3_MULTIPART_CHUNKSIZE"],
+        max_concurrency=config["S3_MAX_CONCURRENCY"],
+        use_threads=config["S3_MAX_CONCURRENCY"] > 1,
+    )
+
+
+class StorageError(Exception):
+    """Raised when a backend fails to store, read or delete a file."""
+
+
+class StorageBackend(abc.ABC):
+    """Interface every backend implements."""
+
+    def __init__(self, config):
+        """Create instance."""
+        self.config = config
+
+    @abc.abstractmethod
+    def put(self, fileobj, key, content_type=None):
+        """Store the contents of ``fileobj`` under ``key``, publicly readable."""
+
+    @abc.abstractmethod
+    def get(self, key, fileobj):
+        """Write the file stored under ``key`` to ``fileobj``."""
+
+    @abc.abstractmethod
+    def head(self, key):
+        """``{"size": ..., "content_type": ...}`` of the file under ``key``, or None."""
+
+    @abc.abstractmethod
+    def delete(self, keys):
+        """Delete the files under ``keys``; missing ones are ignored."""
+
+    def url(self, key):
+        """URL browsers fetch the file under ``key`` from."""
+        return url_for("public.media", key=key)
+
+    def send(self, key):
+        """Response serving the file under ``key``, for backends the app serves itself."""
+        abort(404)
+
+    def presigned_post(self, key, content_type, max_size, expires):
+        """Form fields letting a browser upload ``key`` directly, or None if it cannot."""
+        return None
+
+
+class S3Backend(StorageBackend):
+    """Files in an S3 bucket, through the app's shared client."""
+
+    def __init__(self, config):
+        """Create instance."""
+        if not config["S3_BUCKET_NAME"]:
+            raise RuntimeError("S3_BUCKET_NAME must be set to store images on S3")
+        super().__init__(config)
+
+    @property
+    def client(self):
+        """The app's shared S3 client."""
+        from food_journal.extensions import s3  # extensions imports this module
+
+        return s3.client
+
+    @property
+    def bucket(self):
+        """Name of the bucket files are stored in."""
+        return self.config["S3_BUCKET_NAME"]
+
+    def put(self, fileobj, key, content_type=None):
+        """Upload ``fileobj``, in parts when it is large."""
+        try:
+            self.client.upload_fileobj(
+                fileobj,
+                self.bucket,
+                key,
+                ExtraArgs={
+                    "ACL": "public-read",
+                    "ContentType": content_type or "application/octet-stream",
+                },
+                Config=s3_transfer_config(),
+            )
+        except (BotoCoreError, ClientError) as e:
+            raise StorageError(f"Uploading {key} failed: {e}") from e
+
+    def get(self, key, fileobj):
+        """Download the object ``key`` into ``fileobj``."""
+        try:
+            self.client.download_fileobj(self.bucket, key, fileobj)
+        except (BotoCoreError, ClientError) as e:
+            raise StorageError(f"Downloading {key} failed: {e}") from e
+
+    def head(self, key):
+        """Size and content type of the object ``key``, or None."""
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return None
+            raise StorageError(f"Checking {key} failed: {e}") from e
+        except BotoCoreError as e:
+            raise StorageError(f"Checking {key} failed: {e}") from e
+        return {"size": head["ContentLength"], "content_type": head.get("ContentType")}
+
+    def delete(self, keys):
+        """Delete the objects ``keys``, a thousand per request."""
+        objects = [{"Key": key} for key in keys]
+        try:
+            # S3 deletes at most 1000 keys per request
+            for start in range(0, len(objects), 1000):
+                self.client.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={"Objects": objects[start : start + 1000], "Quiet": True},
+                )
+        except (BotoCoreError, ClientError) as e:
+            raise StorageError(f"Deleting failed: {e}") from e
+
+    def url(self, key):
+        """Public URL of the object ``key`` in the bucket."""
+        # file should be formatted as follows: https://{bucket_name}.s3.amazonaws.com/{aws_key}"
+        return self.config["S3_OBJECT_URL_TEMPLATE"].format(self.bucket, key)
+
+    def presigned_post(self, key, content_type, max_size, expires):
+        """Presigned POST accepting one upload of ``key`` of at most ``max_size`` bytes."""
+        return self.client.generate_presigned_post(
+            Bucket=self.bucket,
+            Key=key,
+            Fields={"acl": "public-read", "Content-Type": content_type},
+            Conditions=[
+                {"acl": "public-read"},
+                {"Content-Type": content_type},
+                ["content-length-range", 1, max_size],
+            ],
+            ExpiresIn=expires,
+        )
+
+
+class LocalBackend(StorageBackend):
+    """Files under ``STORAGE_LOCAL_ROOT``, served by the app.
+
+    Responses are built by :func:`flask.send_from_directory`, which hands the
+    open file to the server's ``wsgi.file_wrapper``; gunicorn sends it with
+    ``sendfile(2)``, without copying it through Python. Set ``USE_X_SENDFILE``
+    to let a fronting nginx or Apache send the file instead.
+    """
+
+    @property
+    def root(self):
+        """Directory files are stored under."""
+        return self.config["STORAGE_LOCAL_ROOT"]
+
+    def path(self, key):
+        """Path of the file ``key``, which must stay under :attr:`root`."""
+        path = safe_join(self.root, key)
+        if path is None:
+            raise StorageError(f"Invalid key {key!r}")
+        return path
+
+    def put(self, fileobj, key, content_type=None):
+        """Write ``fileobj`` to a temporary file, then move it into place."""
+        path = self.path(key)
+        partial = f"{path}.{uuid4().hex}.part"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(partial, "wb") as stored:
+                shutil.copyfileobj(fileobj, stored, 1024 * 1024)
+            # readers never see a half-written file
+            os.replace(partial, path)
+        except OSError as e:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise StorageError(f"Storing {key} failed: {e}") from e
+
+    def get(self, key, fileobj):
+        """Copy the file ``key`` into ``fileobj``."""
+        try:
+            with open(self.path(key), "rb") as stored:
+                shutil.copyfileobj(stored, fileobj, 1024 * 1024)
+        except OSError as e:
+            raise StorageError(f"Reading {key} failed: {e}") from e
+
+    def head(self, key):
+        """Size of the file ``key`` and the content type guessed from its name, or None."""
+        try:
+            size = os.stat(self.path(key)).st_size
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            raise StorageError(f"Checking {key} failed: {e}") from e
+        return {"size": size, "content_type": mimetypes.guess_type(key)[0]}
+
+    def delete(self, keys):
+        """Remove the files ``keys``."""
+        for key in keys:
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                raise StorageError(f"Deleting {key} failed: {e}") from e
+
+    def send(self, key):
+        """Serve the file ``key`` with validators."""
+        return send_from_directory(
+            self.root,
+            key,
+            conditional=True,
+            cache_timeout=self.config["STORAGE_CACHE_TIMEOUT"],
+        )
+
+
+class MemoryBackend(StorageBackend):
+    """Files in a dict, private to the process; for tests and profiling."""
+
+    def __init__(self, config):
+        """Create instance."""
+        super().__init__(config)
+        self.lock = threading.Lock()
+        self.files = {}
+
+    def put(self, fileobj, key, content_type=None):
+        """Keep the contents of ``fileobj``."""
+        data = fileobj.read()
+        with self.lock:
+            self.files[key] = (data, content_type or "application/octet-stream")
+
+    def get(self, key, fileobj):
+        """Write the contents kept under ``key`` to ``fileobj``."""
+        try:
+            fileobj.write(self.files[key][0])
+        except KeyError as e:
+            raise StorageError(f"No file under {key}") from e
+
+    def head(self, key):
+        """Size and content type of the contents under ``key``, or None."""
+        try:
+            data, content_type = self.files[key]
+        except KeyError:
+            return None
+        return {"size": len(data), "content_type": content_type}
+
+    def delete(self, keys):
+        """Forget the contents under ``keys``."""
+        with self.lock:
+            for key in keys:
+                self.files.pop(key, None)
+
+    def send(self, key):
+        """Serve the contents under ``key`` with an ETag."""
+        try:
+            data, content_type = self.files[key]
+        except KeyError:
+            abort(404)
+        response = current_app.response_class(data, mimetype=content_type)
+        response.set_etag(hashlib.sha1(data).hexdigest())
+        response.cache_control.public = True
+        response.cache_control.max_age = self.config["STORAGE_CACHE_TIMEOUT"]
+        return response.make_conditional(request)
+
+
+#: ``STORAGE_BACKEND`` name -> backend class
+BACKENDS = {"s3": S3Backend, "local": LocalBackend, "memory": MemoryBackend}
+
+
+class Storage(object):
+    """Flask extension exposing the configured backend as ``storage.backend``."""
+
+    def __init__(self, app=None):
+        """Create instance."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the backend named by ``STORAGE_BACKEND``."""
+        app.extensions["storage"] = BACKENDS[app.config["STORAGE_BACKEND"]](app.config)
+
+    @property
+    def backend(self):
+        """The backend of the current app."""
+        return current_app.extensions["storage"]
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""Member directory: prefix search on usernames and names.
+
+Each searched column has an index on its lower case form,
+:class:`~food_journal.database.prefix_key`. A prefix is matched with the
+range ``prefix <= key < successor``: an index range scan that returns rows in
+index order, so the first page of a match costs the same whether a thousand
+or a million users match, see :func:`search`. ``LIKE`` and ``ILIKE`` patterns are not used; only
+some of them can use an index, depending on the database, its collation and
+the index's operator class.
+"""
+import base64
+import binascii
+
+from flask import current_app
+from sqlalchemy.ext import baked
+
+from food_journal.database import db, prefix_key
+from food_journal.user.models import User
+from food_journal.utils import InvalidCursor, Page
+
+bakery = baked.bakery()
+
+#: the columns searched, each with an index on its prefix_key next to the User model
+SEARCH_COLUMNS = (User.username, User.first_name, User.last_name)
+
+
+def normalize(prefix):
+    """The search key of a typed prefix; empty if there is nothing to search."""
+    return (prefix or "").strip().lower()
+
+
+def successor(prefix):
+    """The smallest string greater than every string starting with ``prefix``."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def matches(column, prefix="prefix"):
+    """Filter on ``column`` starting with the bound parameter ``prefix`` (and ``successor``)."""
+    key = prefix_key(column)
+    return db.and_(key >= db.bindparam(prefix), key < db.bindparam("successor"))
+
+
+def encode_cursor(key, user_id):
+    """Encode a ``(key, id)`` position as an opaque, URL-safe token."""
+    raw = f"{user_id}|{key}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token):
+    """Decode a token produced by :func:`encode_cursor`.
+
+    :raises InvalidCursor: if the token is malformed.
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        user_id, key = (
+            base64.urlsafe_b64decode(padded.encode("ascii"))
+            .decode("utf-8")
+            .split("|", 1)
+        )
+        return key, int(user_id)
+    except (binascii.Error, UnicodeError, ValueError) as e:
+        raise InvalidCursor(token) from e
+
+
+def search(prefix, after=None, limit=None):
+    """Up to ``limit`` ``(user, key)`` rows of active members matching ``prefix``, by key.
+
+    ``key`` is the member's smallest name that starts with ``prefix``, so a
+    member matching on several columns is listed once. Each column is a
+    separate index range scan of at most ``limit`` rows, merged by one
+    ``UNION ALL`` statement. The statement is built and compiled once per
+    ``limit``, which takes far longer than running it.
+
+    :param after: Opaque cursor; only members after it are returned.
+    """
+    params = {
+        "prefix": prefix,
+        "successor": successor(prefix),
+        "after_key": "",
+        "after_id": 0,
+    }
+    if after:
+        params["after_key"], params["after_id"] = decode_cursor(after)
+    query = bakery(lambda session: _search_query(session, limit), limit)
+    return query(db.session()).params(**params).all()
+
+
+def _search_query(session, limit):
+    streams = []
+    for index, column in enumerate(SEARCH_COLUMNS):
+        key = prefix_key(column)
+        conditions = [User.active.is_(True), matches(column)]
+        for other_index, other in enumerate(SEARCH_COLUMNS):
+            if other_index == index:
+                continue
+            # leave the member to the column listing them first, ties going to the earlier column
+            other_key = prefix_key(other)
+            listed_there = other_key <= key if other_index < index else other_key < key
+            conditions.append(
+                db.or_(other.is_(None), db.not_(db.and_(matches(other), listed_there)))
+            )
+        after_key = db.bindparam("after_key")
+        conditions.append(
+            db.or_(
+                key > after_key,
+                db.and_(key == after_key, User.id > db.bindparam("after_id")),
+            )
+        )
+        stream = (
+            db.select([User.id.label("id"), key.label("key")])
+            .where(db.and_(*conditions))
+            .order_by(key, User.id)
+            .limit(limit)
+            .alias()
+        )
+        streams.append(db.select([stream.c.id, stream.c.key]))
+    matched = db.union_all(*streams).alias("matched")
+    return (
+        session.query(User, matched.c.key)
+        .join(matched, matched.c.id == User.id)
+        .order_by(matched.c.key, User.id)
+        .limit(limit)
+    )
+
+
+def members_page(prefix=None, after=None, page_size=None):
+    """A :class:`~food_journal.utils.Page` of active members.
+
+    Members are ordered by username, or with a ``prefix``, by the username,
+    first or last name that starts with it.
+
+    :param after: Opaque cursor; only members after it are returned.
+    """
+    page_size = page_size or current_app.config["MEMBERS_PAGE_SIZE"]
+    prefix = normalize(prefix)
+    if prefix:
+        rows = search(prefix, after, page_size + 1)
+    else:
+        key = prefix_key(User.username)
+        query = db.session.query(User, key).filter(User.active.is_(True))
+        if after:
+            after_key, after_id = decode_cursor(after)
+            query = query.filter(
+                db.or_(key > after_key, db.and_(key == after_key, User.id > after_id))
+            )
+        rows = query.order_by(key, User.id).limit(page_size + 1).all()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last, last_key = rows[-1]
+        next_cursor = encode_cursor(last_key, last.id)
+    return Page([user for user, _ in rows], next_cursor)
+
+
+def typeahead(prefix, limit=None):
+    """Up to ``limit`` active members matching ``prefix``, as dicts for JSON."""
+    prefix = normalize(prefix)
+    if not prefix:
+        return []
+    return [
+        {
+            "id": user.id,
+            "username": user.username,
+            "first_name": user.first_name,
+            "last_name": user.last_name,
+        }
+        for user, _ in search(
+            prefix, limit=limit or current_app.config["TYPEAHEAD_LIMIT"]
+        )
+    ]
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Cached identity of logged-in users.
+
+Flask-Login loads the current user on every request. Instead of a primary
+key query each time, the user's row is cached for ``IDENTITY_CACHE_TIMEOUT``
+seconds under a key versioned per user, as the row cache stores it: see
+``SurrogatePK.to_cached_row`` and ``from_cached_row``, which attaches the
+rebuilt instance to the session without a query.
+
+Commits that change or delete a user bump that user's version, so a profile
+edit, a new password or a deactivation applies on the next request. Changes
+to nothing but ``last_seen`` are not worth a miss on every request, and are
+ignored. Like the row cache, this one leaves out the password hash; it is
+loaded if accessed.
+"""
+import threading
+
+from flask import current_app
+
+from food_journal.database import db
+from food_journal.extensions import cache
+from food_journal.routing import replica_reads
+from food_journal.user.models import User
+from food_journal.utils import bump_on_commit, cache_version, reads_for_version
+
+#: columns whose changes do not invalidate the cache
+IGNORED_COLUMNS = frozenset(["last_seen"])
+
+
+class _Counters(object):
+    """Hits and misses of the current process."""
+
+    def __init__(self):
+        """Create instance."""
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+def identity_version_key(user_id):
+    """Cache key holding the version of a user's cached identity."""
+    return f"user/{user_id}/identity/version"
+
+
+def load_identity(user_id):
+    """The user ``user_id``, from the cache when possible; None if there is no such user."""
+    version = cache_version(identity_version_key(user_id))
+    key = f"user/{user_id}/identity/row/{version}"
+    row = cache.get(key)
+    counters = _counters()
+    if row is not None:
+        with counters.lock:
+            counters.hits += 1
+        return User.from_cached_row(row)
+
+    with counters.lock:
+        counters.misses += 1
+    with replica_reads(), reads_for_version(version):
+        # not from the row cache: its entries outlive the version bumps of other processes
+        user = User.query.get(user_id)
+    if user is not None:
+        cache.set(
+            key,
+            User.to_cached_row(user),
+            timeout=current_app.config["IDENTITY_CACHE_TIMEOUT"],
+        )
+    return user
+
+
+def identity_cache_stats():
+    """Hits and misses of :func:`load_identity` in the current process."""
+    counters = _counters()
+    with counters.lock:
+        return {"hits": counters.hits, "misses": counters.misses}
+
+
+def _counters():
+    return current_app.extensions.setdefault("identity_cache", _Counters())
+
+
+def collect_changed_users(session, flush_context):
+    """Remember which users this flush changed or deleted."""
+    deleted = [model for model in session.deleted if isinstance(model, User)]
+    changed = [
+        model
+        for model in session.dirty
+        if isinstance(model, User) and _identity_changed(model)
+    ]
+    bump_on_commit(
+        session, [identity_version_key(model.id) for model in deleted + changed]
+    )
+
+
+def _identity_changed(user):
+    attrs = db.inspect(user).attrs
+    return any(
+        attrs[column.key].history.has_changes()
+        for column in User.__mapper__.column_attrs
+        if column.key not in IGNORED_COLUMNS
+    )
+
+
+db.event.listen(db.session, "after_flush", collect_changed_users)
@@ -1,22 +1,23 @@
 # -*- coding: utf-8 -*-
 """User models."""
 import datetime as dt
+from hashlib import md5
 
+from flask import current_app
 from flask_login import UserMixin
+from sqlalchemy.sql import ClauseElement
 
 from food_journal.database import (
     Column,
     Model,
     SurrogatePK,
     db,
+    prefix_key,
     reference_col,
     relationship,
 )
-from food_journal.extensions import bcrypt
-
-from food_journal.public.models import FoodItem
-
-from hashlib import md5
+from food_journal.extensions import passwords
+from food_journal.public.models import FoodItem, with_author
 
 
 class Role(SurrogatePK, Model):
@@ -35,14 +36,24 @@ class Role(SurrogatePK, Model):
         """Represent instance as a unique string."""
         return f"<Role({self.name})>"
 
-    
-followers = db.Table('followers', db.Column('follower_id', db.Integer, db.ForeignKey('users.id')), db.Column('followed_id', db.Integer, db.ForeignKey('users.id')))
-    
+
+followers = db.Table(
+    "followers",
+    db.Column("follower_id", db.Integer, db.ForeignKey("users.id"), primary_key=True),
+    db.Column("followed_id", db.Integer, db.ForeignKey("users.id"), primary_key=True),
+    # the primary key serves "who does X follow"; this serves "who follows X"
+    db.Index("ix_followers_followed_id", "followed_id", "follower_id"),
+)
+
 
 class User(UserMixin, SurrogatePK, Model):
     """A user of the app."""
 
     __tablename__ = "users"
+    __cache_by_id__ = True
+    __cache_by_id_exclude__ = frozenset(
+        ["password"]
+    )  # so a new password applies in every worker at once
     username = Column(db.String(80), unique=True, nullable=False)
     email = Column(db.String(80), unique=True, nullable=False)
     #: The hashed password
@@ -54,10 +65,25 @@ class User(UserMixin, SurrogatePK, Model):
     is_admin = Column(db.Boolean(), default=False)
     about_me = Column(db.String(140))
     last_seen = db.Column(db.DateTime, default=dt.datetime.utcnow)
+    #: Whether followers pull this user's dishes at read time instead of having them
+    #: pushed into their timelines (set once the follower count passes TIMELINE_FANOUT_LIMIT)
+    fanout_on_read = Column(db.Boolean(), nullable=False, default=False)
+    #: Denormalized counts, kept up to date by follow, unfollow and dish changes;
+    #: `flask reconcile-counters` recomputes them
+    follower_count = Column(db.Integer, nullable=False, default=0, server_default="0")
+    following_count = Column(db.Integer, nullable=False, default=0, server_default="0")
+    dish_count = Column(db.Integer, nullable=False, default=0, server_default="0")
     food_items = db.relationship("FoodItem", backref="author", lazy="dynamic")
-    
-    followed = db.relationship( 'User', secondary=followers, primaryjoin="(followers.c.follower_id == User.id)", secondaryjoin="(followers.c.followed_id == User.id)", backref=db.backref('followers', lazy='dynamic'), lazy='dynamic')
-    
+
+    followed = db.relationship(
+        "User",
+        secondary=followers,
+        primaryjoin="(followers.c.follower_id == User.id)",
+        secondaryjoin="(followers.c.followed_id == User.id)",
+        backref=db.backref("followers", lazy="dynamic"),
+        lazy="dynamic",
+    )
+
     def __init__(self, username, email, password=None, **kwargs):
         """Create instance."""
         db.Model.__init__(self, username=username, email=email, **kwargs)
@@ -68,33 +94,144 @@ class User(UserMixin, SurrogatePK, Model):
 
     def set_password(self, password):
         """Set password."""
-        self.password = bcrypt.generate_password_hash(password)
+        self.password = passwords.generate_password_hash(password)
 
     def check_password(self, value):
-        """Check password."""
-        return bcrypt.check_password_hash(self.password, value)
+        """Check password.
+
+        A correct password stored at another cost than ``BCRYPT_LOG_ROUNDS`` is
+        rehashed at the current cost; the caller's next commit saves it.
+        """
+        if not passwords.check_password_hash(self.password, value):
+            return False
+        if passwords.needs_rehash(self.password):
+            self.update(commit=False, password=passwords.generate_password_hash(value))
+        return True
 
     def avatar(self, size):
-        digest = md5(self.email.lower().encode('utf-8')).hexdigest()
-        return 'https://www.gravatar.com/avatar/{}?d=identicon&s={}'.format(
-            digest, size)
-    
+        """Gravatar URL of a ``size`` pixel square image for this user."""
+        digest = md5(self.email.lower().encode("utf-8")).hexdigest()
+        return "https://www.gravatar.com/avatar/{}?d=identicon&s={}".format(
+            digest, size
+        )
+
     def follow(self, user):
-        if not self.is_following(user):
+        """Follow ``user``, unless this user already does."""
+        if not self.follows_in_session(user):
             self.followed.append(user)
-            
+            if isinstance(user.__dict__.get("follower_count"), ClauseElement):
+                # an earlier follow's pending ``follower_count + 1`` has no value until written
+                db.session.flush()
+            if user.follower_count + 1 > current_app.config["TIMELINE_FANOUT_LIMIT"]:
+                user.fanout_on_read = True
+            self.add_to_counters(following_count=1)
+            user.add_to_counters(follower_count=1)
+            if not user.fanout_on_read:
+                TimelineEntry.backfill(self, user)
+
     def unfollow(self, user):
-        if self.is_following(user):
+        """Stop following ``user``, if this user does."""
+        if self.follows_in_session(user):
             self.followed.remove(user)
-            
-    def is_following(self, user):
+            self.add_to_counters(following_count=-1)
+            user.add_to_counters(follower_count=-1)
+            TimelineEntry.prune(self, user)
+
+    def follows_in_session(self, user):
+        """Whether this user follows ``user``, including uncommitted follows; one query."""
         return self.followed.filter(followers.c.followed_id == user.id).count() > 0
-    
+
+    def is_following(self, user):
+        """Whether this user follows ``user``, from the cached follow graph."""
+        return self.are_following([user.id])[user.id]
+
+    def are_following(self, user_ids):
+        """Map each of ``user_ids`` to whether this user follows them, from the cached follow graph.
+
+        The graph only reflects committed follows; see :mod:`food_journal.user.graph`.
+        """
+        from food_journal.user.graph import are_following
+
+        return are_following(self.id, user_ids)
+
+    def timeline_food_items(self):
+        """Dishes pushed into this user's precomputed timeline."""
+        return FoodItem.query.join(
+            TimelineEntry, TimelineEntry.food_id == FoodItem.id
+        ).filter(
+            TimelineEntry.user_id == self.id,
+            FoodItem.upload_state == FoodItem.UPLOAD_READY,
+        )
+
+    def pulled_food_items(self):
+        """Dishes by followed high-follower accounts, or None if this user follows none."""
+        pulled_ids = [
+            user_id
+            for user_id, in self.followed.filter(
+                User.fanout_on_read.is_(True)
+            ).with_entities(User.id)
+        ]
+        if not pulled_ids:
+            return None
+        return FoodItem.query.filter(
+            FoodItem.user_id.in_(pulled_ids),
+            FoodItem.upload_state == FoodItem.UPLOAD_READY,
+        )
+
     def followed_food_items(self):
-        followed = FoodItem.query.join(followers, (followers.c.followed_id == FoodItem.user_id)).filter(followers.c.follower_id == self.id)
-        own = FoodItem.query.filter_by(user_id=self.id)
-        return followed.union(own).order_by(FoodItem.created_at.desc())
-        
+        """Dishes by this user and the users they follow, newest first."""
+        timeline = self.timeline_food_items()
+        pulled = self.pulled_food_items()
+        if pulled is None:
+            query = timeline.order_by(
+                TimelineEntry.created_at.desc(), TimelineEntry.food_id.desc()
+            )
+        else:
+            query = timeline.union(pulled).order_by(
+                FoodItem.created_at.desc(), FoodItem.id.desc()
+            )
+        return query.options(with_author())
+
+    def add_to_counters(self, **deltas):
+        """Add ``deltas``, such as ``dish_count=1``, to counter columns.
+
+        For a stored user the flush writes ``count = count + delta``, so
+        concurrent transactions add up instead of overwriting each other.
+        """
+        stored = db.inspect(self).persistent
+        for name, delta in deltas.items():
+            pending = self.__dict__.get(name)
+            if isinstance(pending, ClauseElement):
+                setattr(self, name, pending + delta)
+            elif stored:
+                setattr(self, name, getattr(User, name) + delta)
+            else:
+                setattr(self, name, (pending or 0) + delta)
+
+    @classmethod
+    def reconcile_counters(cls):
+        """Recompute every user's counters from the rows they count.
+
+        Returns the number of users whose counters were wrong.
+        """
+
+        def count(column):
+            return db.select([db.func.count()]).where(column == cls.id).as_scalar()
+
+        counts = {
+            "follower_count": count(followers.c.followed_id),
+            "following_count": count(followers.c.follower_id),
+            "dish_count": count(FoodItem.user_id),
+        }
+        result = db.session.execute(
+            cls.__table__.update()
+            .where(
+                db.or_(*(getattr(cls, name) != value for name, value in counts.items()))
+            )
+            .values(**counts)
+        )
+        return result.rowcount
+
     @property
     def full_name(self):
         """Full user name."""
@@ -104,4 +241,206 @@ class User(UserMixin, SurrogatePK, Model):
         """Represent instance as a unique string."""
         return f"<User({self.username!r})>"
 
-    
+
+# prefix searches of the member directory, see food_journal.user.directory
+db.Index("ix_users_username_prefix", prefix_key(User.username), User.id)
+db.Index("ix_users_first_name_prefix", prefix_key(User.first_name), User.id)
+db.Index("ix_users_last_name_prefix", prefix_key(User.last_name), User.id)
+
+
+class TimelineEntry(Model):
+    """A dish in a user's precomputed home timeline (fan-out on write).
+
+    A row is written for the author and for each of their followers when a dish
+    is created, so reading a timeline is a single range scan over
+    ``(user_id, created_at, food_id)``. Authors flagged ``fanout_on_read`` are
+    skipped here and merged in when the timeline is read instead.
+    """
+
+    __tablename__ = "timeline"
+    __table_args__ = (
+        db.Index("ix_timeline_user_id_created_at", "user_id", "created_at", "food_id"),
+    )
+    user_id = Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    food_id = Column(
+        db.Integer, db.ForeignKey("food.id", ondelete="CASCADE"), primary_key=True
+    )
+    created_at = Column(db.DateTime, nullable=False)
+
+    @classmethod
+    def fan_out(cls, food):
+        """Push a newly flushed dish into its author's and their followers' timelines."""
+        rows = db.select(
+            [db.literal(food.user_id), db.literal(food.id), db.literal(food.created_at)]
+        )
+        # dishes created with only a user_id have no author loaded, and loading it here finds none
+        author = food.__dict__.get("author") or db.session.query(User).get(food.user_id)
+        if not author.fanout_on_read:
+            rows = rows.union(
+                db.select(
+                    [
+                        followers.c.follower_id,
+                        db.literal(food.id),
+                        db.literal(food.created_at),
+                    ]
+                ).where(followers.c.followed_id == food.user_id)
+            )
+        db.session.execute(
+            cls.__table__.insert().from_select(
+                ["user_id", "food_id", "created_at"], rows
+            )
+        )
+
+    @classmethod
+    def fan_out_many(cls, food_ids):
+        """Push dishes inserted without the ORM, such as bulk imports, into timelines in one statement."""
+        own = db.select([FoodItem.user_id, FoodItem.id, FoodItem.created_at]).where(
+            FoodItem.id.in_(food_ids)
+        )
+        pushed = (
+            db.select([followers.c.follower_id, FoodItem.id, FoodItem.created_at])
+            .select_from(
+                FoodItem.__table__.join(
+                    followers, followers.c.followed_id == FoodItem.user_id
+                ).join(User.__table__, User.id == FoodItem.user_id)
+            )
+            .where(db.and_(FoodItem.id.in_(food_ids), User.fanout_on_read.is_(False)))
+        )
+        db.session.execute(
+            cls.__table__.insert().from_select(
+                ["user_id", "food_id", "created_at"], own.union(pushed)
+            )
+        )
+
+    @classmethod
+    def backfill(cls, user, followed):
+        """Copy the most recent dishes of ``followed`` into ``user``'s timeline."""
+        recent = (
+            db.select([db.literal(user.id), FoodItem.id, FoodItem.created_at])
+            .where(FoodItem.user_id == followed.id)
+            .order_by(FoodItem.created_at.desc())
+            .limit(current_app.config["TIMELINE_BACKFILL_SIZE"])
+        )
+        db.session.execute(
+            cls.__table__.insert().from_select(
+                ["user_id", "food_id", "created_at"], recent
+            )
+        )
+
+    @classmethod
+    def prune(cls, user, unfollowed):
+        """Remove the dishes of ``unfollowed`` from ``user``'s timeline."""
+        db.session.execute(
+            cls.__table__.delete().where(
+                db.and_(
+                    cls.user_id == user.id,
+                    cls.food_id.in_(
+                        db.select([FoodItem.id]).where(
+                            FoodItem.user_id == unfollowed.id
+                        )
+                    ),
+                )
+            )
+        )
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute ``fanout_on_read`` and every timeline from scratch.
+
+        Returns the number of timeline entries written.
+        """
+        follower_count = (
+            db.select([db.func.count()])
+            .where(followers.c.followed_id == User.id)
+            .as_scalar()
+        )
+        db.session.execute(
+            User.__table__.update().values(
+                fanout_on_read=follower_count
+                > current_app.config["TIMELINE_FANOUT_LIMIT"]
+            )
+        )
+        db.session.execute(cls.__table__.delete())
+
+        own = db.select([FoodItem.user_id, FoodItem.id, FoodItem.created_at]).where(
+            FoodItem.user_id.isnot(None)
+        )
+        pushed = (
+            db.select([followers.c.follower_id, FoodItem.id, FoodItem.created_at])
+            .select_from(
+                FoodItem.__table__.join(
+                    followers, followers.c.followed_id == FoodItem.user_id
+                ).join(User.__table__, User.id == FoodItem.user_id)
+            )
+            .where(User.fanout_on_read.is_(False))
+        )
+        result = db.session.execute(
+            cls.__table__.insert().from_select(
+                ["user_id", "food_id", "created_at"], own.union(pushed)
+            )
+        )
+        return result.rowcount
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<TimelineEntry({self.user_id}, {self.food_id})>"
+
+
+class FollowSuggestion(Model):
+    """A user worth following, followed by people ``user_id`` follows.
+
+    Only each user's top FOLLOW_SUGGESTIONS_SIZE suggestions are kept, ranked
+    by ``mutual_count`` then by how recently the suggested user was active, so
+    showing them is one range scan over ``ix_follow_suggestions_rank``. See
+    :mod:`food_journal.user.suggestions` for how they are computed and kept up
+    to date.
+    """
+
+    __tablename__ = "follow_suggestions"
+    __table_args__ = (
+        db.Index(
+            "ix_follow_suggestions_rank",
+            "user_id",
+            "mutual_count",
+            "active_at",
+            "suggested_id",
+        ),
+    )
+    user_id = Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    suggested_id = Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    #: how many of the users ``user_id`` follows follow the suggested user
+    mutual_count = Column(db.Integer, nullable=False)
+    #: the suggested user's ``last_seen`` when the suggestion was computed
+    active_at = Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<FollowSuggestion({self.user_id}, {self.suggested_id})>"
+
+
+def count_food_items(session, flush_context, instances):
+    """Adjust the authors' ``dish_count`` for the dishes added or deleted in this flush."""
+    deltas = {}
+    for models, delta in ((session.new, 1), (session.deleted, -1)):
+        for model in models:
+            if not isinstance(model, FoodItem):
+                continue
+            # only an assigned author; loading it here would cache None on pending dishes
+            author = model.__dict__.get("author")
+            if author is None and model.user_id is not None:
+                author = session.query(User).get(model.user_id)
+            if author is not None:
+                deltas[author] = deltas.get(author, 0) + delta
+    for author, delta in deltas.items():
+        author.add_to_counters(dish_count=delta)
+
+
+def fan_out_food_items(session, flush_context):
+    """Fan newly created dishes out to timelines as part of the same transaction."""
+    for model in session.new:
+        if isinstance(model, FoodItem) and model.user_id is not None:
+            TimelineEntry.fan_out(model)
+
+
+db.event.listen(db.session, "before_flush", count_food_items)
+db.event.listen(db.session, "after_flush", fan_out_food_items)
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""Follow suggestions: friends of friends, precomputed per user.
+
+A user's candidates are the users followed by the people they follow, ranked
+by how many of those people follow them (``mutual_count``) and then by how
+recently they were active. Users already followed, inactive accounts and
+accounts not seen for FOLLOW_SUGGESTIONS_ACTIVE_DAYS are left out. Counting
+them means joining ``followers`` to itself, so it is not done when a page is
+shown: each user's top FOLLOW_SUGGESTIONS_SIZE are kept in the
+``follow_suggestions`` table (:class:`~food_journal.user.models.FollowSuggestion`),
+and :func:`suggested_users` reads them with one index range scan.
+
+:func:`rebuild` fills the table in batches of users and is run by
+``flask suggest-follows``. In between, each follow or unfollow recounts only the
+pairs it changes, in the same transaction (:func:`refresh_follow`):
+
+* the follower's candidates among the users the followed user follows, and the
+  followed user themselves;
+* the followed user as a candidate of each of the follower's followers. This is
+  skipped for users with ``fanout_on_read`` set, whose followers are too many to
+  update on a follow; the next rebuild catches them up.
+
+Counts only go down on an unfollow, and a candidate that was outside a user's
+top list is not brought back in then, so a list can fall short of the true top
+until the next rebuild.
+"""
+import datetime as dt
+
+from flask import current_app
+
+from food_journal.database import db
+from food_journal.user.models import FollowSuggestion, User, followers
+from food_journal.utils import pending_changes, pop_pending_changes
+
+suggestions = FollowSuggestion.__table__
+
+
+def _active_since():
+    return dt.datetime.utcnow() - dt.timedelta(
+        days=current_app.config["FOLLOW_SUGGESTIONS_ACTIVE_DAYS"]
+    )
+
+
+def mutual_counts(where, rank=False):
+    """Count the users followed by the users each user follows.
+
+    ``where`` is called with the ``mine`` and ``theirs`` aliases of ``followers``,
+    ``mine.follower_id`` being the user suggestions are for and
+    ``theirs.followed_id`` the suggested user, and returns the condition
+    selecting the pairs to count. With ``rank``, each row also gets its rank
+    among the user's suggestions.
+    """
+    mine, theirs, already = (
+        followers.alias("mine"),
+        followers.alias("theirs"),
+        followers.alias("already"),
+    )
+    mutual_count = db.func.count()
+    columns = [
+        mine.c.follower_id.label("user_id"),
+        theirs.c.followed_id.label("suggested_id"),
+        mutual_count.label("mutual_count"),
+        User.last_seen.label("active_at"),
+    ]
+    if rank:
+        order = [
+            mutual_count.desc(),
+            User.last_seen.desc(),
+            theirs.c.followed_id.desc(),
+        ]
+        columns.append(
+            db.func.row_number()
+            .over(partition_by=mine.c.follower_id, order_by=order)
+            .label("rank")
+        )
+    followed_already = db.exists().where(
+        db.and_(
+            already.c.follower_id == mine.c.follower_id,
+            already.c.followed_id == theirs.c.followed_id,
+        )
+    )
+    return (
+        db.select(columns)
+        .select_from(
+            mine.join(theirs, theirs.c.follower_id == mine.c.followed_id).join(
+                User.__table__, User.id == theirs.c.followed_id
+            )
+        )
+        .where(
+            db.and_(
+                where(mine, theirs),
+                theirs.c.followed_id != mine.c.follower_id,
+                User.active.is_(True),
+                User.last_seen >= _active_since(),
+                db.not_(followed_already),
+            )
+        )
+        .group_by(mine.c.follower_id, theirs.c.followed_id, User.last_seen)
+    )
+
+
+def _insert(rows):
+    return suggestions.insert().from_select(
+        ["user_id", "suggested_id", "mutual_count", "active_at"], rows
+    )
+
+
+def rebuild(batch_size=1000):
+    """Recompute every user's suggestions, committing after each batch of users.
+
+    Returns the number of suggestions written.
+    """
+    size = current_app.config["FOLLOW_SUGGESTIONS_SIZE"]
+    last_id = db.session.execute(db.select([db.func.max(User.id)])).scalar() or 0
+    written = 0
+    for first in range(1, last_id + 1, batch_size):
+        last = first + batch_size - 1
+        ranked = mutual_counts(
+            lambda mine, theirs: mine.c.follower_id.between(first, last), rank=True
+        ).alias()
+        db.session.execute(
+            suggestions.delete().where(suggestions.c.user_id.between(first, last))
+        )
+        result = db.session.execute(
+            _insert(
+                db.select(
+                    [
+                        ranked.c.user_id,
+                        ranked.c.suggested_id,
+                        ranked.c.mutual_count,
+                        ranked.c.active_at,
+                    ]
+                ).where(ranked.c.rank <= size)
+            )
+        )
+        written += result.rowcount
+        db.session.commit()
+    return written
+
+
+def trim(user_ids):
+    """Delete all but the top FOLLOW_SUGGESTIONS_SIZE suggestions of ``user_ids``.
+
+    ``user_ids`` is a list of ids or a select of them.
+    """
+    better = suggestions.alias("better")
+    rank = db.tuple_(
+        suggestions.c.mutual_count, suggestions.c.active_at, suggestions.c.suggested_id
+    )
+    outranked_by = (
+        db.select([db.func.count()])
+        .where(
+            db.and_(
+                better.c.user_id == suggestions.c.user_id,
+                db.tuple_(
+                    better.c.mutual_count, better.c.active_at, better.c.suggested_id
+                )
+                > rank,
+            )
+        )
+        .as_scalar()
+    )
+    db.session.execute(
+        suggestions.delete().where(
+            db.and_(
+                suggestions.c.user_id.in_(user_ids),
+                outranked_by >= current_app.config["FOLLOW_SUGGESTIONS_SIZE"],
+            )
+        )
+    )
+
+
+def refresh_follow(user, followed):
+    """Recount the suggestions changed by ``user`` following or unfollowing ``followed``.
+
+    Run after the change is flushed; the counts are read back from ``followers``.
+    """
+    user_id, followed_id = user.id, followed.id
+    candidates = db.select([followers.c.followed_id]).where(
+        followers.c.follower_id == followed_id
+    )
+    # the followed user's follows, and the followed user, as the follower's candidates
+    db.session.execute(
+        suggestions.delete().where(
+            db.and_(
+                suggestions.c.user_id == user_id,
+                db.or_(
+                    suggestions.c.suggested_id == followed_id,
+                    suggestions.c.suggested_id.in_(candidates),
+                ),
+            )
+        )
+    )
+    recounted = [
+        mutual_counts(
+            lambda mine, theirs: db.and_(
+                mine.c.follower_id == user_id,
+                db.or_(
+                    theirs.c.followed_id == followed_id,
+                    theirs.c.followed_id.in_(candidates),
+                ),
+            )
+        )
+    ]
+    affected = [user_id]
+    # the followed user as a candidate of the follower's followers
+    if not user.fanout_on_read:
+        user_followers = db.select([followers.c.follower_id]).where(
+            followers.c.followed_id == user_id
+        )
+        db.session.execute(
+            suggestions.delete().where(
+                db.and_(
+                    suggestions.c.suggested_id == followed_id,
+                    suggestions.c.user_id.in_(user_followers),
+                )
+            )
+        )
+        recounted.append(
+            mutual_counts(
+                lambda mine, theirs: db.and_(
+                    mine.c.follower_id.in_(user_followers),
+                    theirs.c.followed_id == followed_id,
+                )
+            )
+        )
+        affected = db.union(db.select([db.literal(user_id)]), user_followers)
+    db.session.execute(_insert(db.union_all(*recounted)))
+    trim(affected)
+
+
+def suggested_users(user, limit=None):
+    """Up to ``limit`` ``(user, mutual_count)`` suggestions for ``user``, best first."""
+    limit = limit or current_app.config["FOLLOW_SUGGESTIONS_SHOWN"]
+    return (
+        db.session.query(User, FollowSuggestion.mutual_count)
+        .join(FollowSuggestion, FollowSuggestion.suggested_id == User.id)
+        .filter(FollowSuggestion.user_id == user.id)
+        .order_by(
+            FollowSuggestion.mutual_count.desc(),
+            FollowSuggestion.active_at.desc(),
+            FollowSuggestion.suggested_id.desc(),
+        )
+        .limit(limit)
+        .all()
+    )
+
+
+def collect_follow_change(user, followed, initiator):
+    """Remember that ``user`` followed or unfollowed ``followed``."""
+    pending_changes(db.session, "follow_suggestion_changes", list).append(
+        (user, followed)
+    )
+
+
+def refresh_flushed_follows(session, flush_context):
+    """Update suggestions for the follows written by this flush, in the same transaction."""
+    changes = pop_pending_changes(session, "follow_suggestion_changes")
+    for user, followed in changes or ():
+        refresh_follow(user, followed)
+
+
+db.event.listen(db.session, "after_flush", refresh_flushed_follows)
+db.event.listen(User.followed, "append", collect_follow_change)
+db.event.listen(User.followed, "remove", collect_follow_change)
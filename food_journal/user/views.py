@@ -1,73 +1,115 @@
 # -*- coding: utf-8 -*-
 """User views."""
-from flask import Blueprint, render_template, request, flash, redirect, url_for
-from flask_login import login_required, current_user
-from food_journal.user.models import User
-from food_journal.user.forms import EditProfileForm
+from flask import (
+    Blueprint,
+    Response,
+    abort,
+    flash,
+    redirect,
+    render_template,
+    request,
+    url_for,
+)
+from flask_login import current_user, login_required
 
+from food_journal.compat import json_dumps
+from food_journal.routing import read_only
+from food_journal.user.directory import members_page, typeahead
+from food_journal.user.forms import EditProfileForm
+from food_journal.user.models import User
+from food_journal.user.suggestions import suggested_users
+from food_journal.utils import InvalidCursor
 
 blueprint = Blueprint("user", __name__, url_prefix="/users", static_folder="../static")
 
 
-
-
 @blueprint.route("/")
 @login_required
+@read_only
 def members():
-    """List members."""
-    return render_template("users/members.html")
+    """List members by username, or those whose username or name starts with ``q``."""
+    query = request.args.get("q", "")
+    try:
+        page = members_page(query, after=request.args.get("after"))
+    except InvalidCursor:
+        abort(400)
+    following = current_user.are_following([member.id for member in page])
+    suggested = (
+        [] if query or request.args.get("after") else suggested_users(current_user)
+    )
+    return render_template(
+        "users/members.html",
+        page=page,
+        query=query,
+        following=following,
+        suggested=suggested,
+    )
+
+
+@blueprint.route("/search")
+@login_required
+@read_only
+def search():
+    """Members whose username or name starts with ``q``, as JSON for typeahead."""
+    items = typeahead(request.args.get("q", ""))
+    for item in items:
+        item["url"] = url_for("user.profile", username=item["username"])
+    return Response(json_dumps({"items": items}), mimetype="application/json")
 
 
 @blueprint.route("/<username>")
 @login_required
+@read_only
 def profile(username):
-    """Return user's profile page"""
+    """Return user's profile page."""
     print("here")
     user = User.query.filter_by(username=username).first_or_404()
     return render_template("users/profile.html", user=user)
 
 
-@blueprint.route('/edit_profile', methods=['GET', 'POST'])
+@blueprint.route("/edit_profile", methods=["GET", "POST"])
 @login_required
 def edit_profile():
+    """Edit the logged-in user's profile."""
     form = EditProfileForm()
     if form.validate_on_submit():
         current_user.update(about_me=form.about_me.data)
         flash("Your changes have been saved.")
-        return redirect(url_for('user.edit_profile'))
-    elif request.method == 'GET':        
+        return redirect(url_for("user.edit_profile"))
+    elif request.method == "GET":
         form.about_me.data = current_user.about_me
-    return render_template('users/edit_profile.html', title='Edit Profile', form=form)
-        
+    return render_template("users/edit_profile.html", title="Edit Profile", form=form)
 
-@blueprint.route('/follow/<username>')
+
+@blueprint.route("/follow/<username>")
 @login_required
 def follow(username):
+    """Follow the user ``username``."""
     user = User.query.filter_by(username=username).first()
     if user is None:
-        flash('User {} not found'.format(username))
-        return redirect(url_for('index'))
+        flash("User {} not found".format(username))
+        return redirect(url_for("index"))
     if user == current_user:
-        flash('You cannot follow yourself!')
-        return redirect(url_for('user', username=username))
+        flash("You cannot follow yourself!")
+        return redirect(url_for("user", username=username))
     current_user.follow(user)
     current_user.save()
-    flash('You are now following {}!'.format(username))
-    return redirect(url_for('user.profile', username=username))
+    flash("You are now following {}!".format(username))
+    return redirect(url_for("user.profile", username=username))
+
 
-@blueprint.route('/unfollow/<username>')
+@blueprint.route("/unfollow/<username>")
 @login_required
 def unfollow(username):
+    """Stop following the user ``username``."""
     user = User.query.filter_by(username=username).first()
     if user is None:
-        flash('User {} not found.'.format(username))
-        return redirect(url_for('public.index'))
+        flash("User {} not found.".format(username))
+        return redirect(url_for("public.index"))
     if user == current_user:
-        flash('You cannot unfollow yourself!')
-        return redirect(url_for('user.profile', username=username))
+        flash("You cannot unfollow yourself!")
+        return redirect(url_for("user.profile", username=username))
     current_user.unfollow(user)
     current_user.save()
-    flash('You are not following {}.'.format(username))
-    return redirect(url_for('user.profile', username=username))
-
-        
\ No newline at end of file
+    flash("You are not following {}.".format(username))
+    return redirect(url_for("user.profile", username=username))
@@ -1,6 +1,43 @@
 # -*- coding: utf-8 -*-
 """Helper utilities and decorators."""
-from flask import flash
+import time
+from contextlib import contextmanager
+from uuid import uuid4
+
+from flask import current_app, flash
+
+from food_journal.extensions import cache, db
+from food_journal.routing import primary_reads
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+class Page(object):
+    """One page of a keyset-paginated listing, plus the cursor to fetch the next page."""
+
+    def __init__(self, items, next_cursor=None):
+        """Create instance."""
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_more(self):
+        """Whether there is a next page to fetch."""
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        """Iterate over the items on this page."""
+        return iter(self.items)
+
+    def __len__(self):
+        """Number of items on this page."""
+        return len(self.items)
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<Page({len(self.items)} items, next={self.next_cursor!r})>"
 
 
 def flash_errors(form, category="warning"):
@@ -8,3 +45,80 @@ def flash_errors(form, category="warning"):
     for field, errors in form.errors.items():
         for error in errors:
             flash(f"{getattr(form, field).label.text} - {error}", category)
+
+
+def cache_version(key):
+    """Return the current version token stored under ``key``.
+
+    Embedding the token in the keys of a group of cache entries lets the whole
+    group be invalidated at once with :func:`bump_cache_versions`.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid4().hex, timeout=0)
+        version = cache.get(key)
+    return version
+
+
+def bump_cache_versions(keys):
+    """Invalidate every cache entry built on the versions stored under ``keys``.
+
+    The new version starts with the time it was bumped, see :func:`reads_for_version`.
+    """
+    if keys:
+        version = f"{time.time():.6f}-{uuid4().hex}"
+        cache.set_many({key: version for key in keys}, timeout=0)
+
+
+def pending_changes(session, name, factory=set):
+    """The changes collected under ``name`` for the end of the session's transaction.
+
+    They are dropped if the transaction is rolled back.
+    """
+    return session.info.setdefault("pending_changes", {}).setdefault(name, factory())
+
+
+def pop_pending_changes(session, name):
+    """Take the changes collected under ``name``, or None."""
+    return session.info.get("pending_changes", {}).pop(name, None)
+
+
+def bump_on_commit(session, keys):
+    """Bump the versions stored under ``keys`` once the session's transaction is committed."""
+    pending_changes(session, "cache_version_bumps").update(keys)
+
+
+def bump_pending_versions(session):
+    """Bump the versions collected by :func:`bump_on_commit`."""
+    bump_cache_versions(pop_pending_changes(session, "cache_version_bumps"))
+
+
+def discard_pending_changes(session, previous_transaction):
+    """Nothing changed if the transaction was rolled back."""
+    # a savepoint rolled back within it does not undo the rest of the transaction
+    if previous_transaction.parent is None:
+        session.info.pop("pending_changes", None)
+
+
+db.event.listen(db.session, "after_commit", bump_pending_versions)
+db.event.listen(db.session, "after_soft_rollback", discard_pending_changes)
+
+
+@contextmanager
+def reads_for_version(version):
+    """Read from the primary within the block if ``version`` was bumped less than ``REPLICA_MAX_LAG`` ago.
+
+    Wrap code filling a cache entry under ``version``: the changes that bumped
+    it may not have reached the replicas yet, and a stale entry would be
+    served as current until it expires.
+    """
+    bumped_at, bumped, _ = (version or "").partition("-")
+    recent = (
+        bumped
+        and time.time() - float(bumped_at) < current_app.config["REPLICA_MAX_LAG"]
+    )
+    if recent:
+        with primary_reads():
+            yield
+    else:
+        yield
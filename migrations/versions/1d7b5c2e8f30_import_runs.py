@@ -0,0 +1,31 @@
+"""import runs
+
+Revision ID: 1d7b5c2e8f30
+Revises: 6e0f3a9d2b14
+Create Date: 2026-10-18 14:48:02.551930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1d7b5c2e8f30'
+down_revision = '6e0f3a9d2b14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('import_runs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=255), nullable=False),
+    sa.Column('rows_done', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('import_runs')
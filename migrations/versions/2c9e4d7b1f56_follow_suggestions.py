@@ -0,0 +1,40 @@
+"""follow suggestions
+
+Revision ID: 2c9e4d7b1f56
+Revises: 8f2d6c1a7e45
+Create Date: 2026-10-18 18:21:09.530417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2c9e4d7b1f56'
+down_revision = '8f2d6c1a7e45'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # filled by `flask suggest-follows`, then kept up to date on follow and unfollow
+    op.create_table('follow_suggestions',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('suggested_id', sa.Integer(), nullable=False),
+    sa.Column('mutual_count', sa.Integer(), nullable=False),
+    sa.Column('active_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['suggested_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'suggested_id')
+    )
+    op.create_index(
+        'ix_follow_suggestions_rank',
+        'follow_suggestions',
+        ['user_id', 'mutual_count', 'active_at', 'suggested_id'],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index('ix_follow_suggestions_rank', table_name='follow_suggestions')
+    op.drop_table('follow_suggestions')
@@ -0,0 +1,24 @@
+"""image variants
+
+Revision ID: 3f6b0d8e2c57
+Revises: e2b98f0c4a11
+Create Date: 2026-10-18 12:41:50.109342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6b0d8e2c57'
+down_revision = 'e2b98f0c4a11'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('food', sa.Column('image_variants', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('food', 'image_variants')
@@ -0,0 +1,35 @@
+"""user counters
+
+Revision ID: 4b8e1f6a2d93
+Revises: 1d7b5c2e8f30
+Create Date: 2026-10-18 15:02:37.118604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b8e1f6a2d93'
+down_revision = '1d7b5c2e8f30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('follower_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('users', sa.Column('following_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('users', sa.Column('dish_count', sa.Integer(), nullable=False, server_default='0'))
+    # count existing rows; `flask reconcile-counters` does the same at any time
+    op.execute(
+        "UPDATE users SET "
+        "follower_count = (SELECT count(*) FROM followers WHERE followers.followed_id = users.id), "
+        "following_count = (SELECT count(*) FROM followers WHERE followers.follower_id = users.id), "
+        "dish_count = (SELECT count(*) FROM food WHERE food.user_id = users.id)"
+    )
+
+
+def downgrade():
+    op.drop_column('users', 'dish_count')
+    op.drop_column('users', 'following_count')
+    op.drop_column('users', 'follower_count')
@@ -0,0 +1,44 @@
+"""timeline
+
+Revision ID: 5d1e7a3c9b20
+Revises: c35b4b518d09
+Create Date: 2026-10-18 09:12:41.402113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d1e7a3c9b20'
+down_revision = 'c35b4b518d09'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('fanout_on_read', sa.Boolean(), nullable=False, server_default=sa.false()))
+    op.create_table('timeline',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('food_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['food_id'], ['food.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'food_id')
+    )
+    op.create_index('ix_timeline_user_id_created_at', 'timeline', ['user_id', 'created_at', 'food_id'], unique=False)
+    # seed the timelines of existing users; `flask rebuild-timelines` does the same at any time
+    op.execute(
+        "INSERT INTO timeline (user_id, food_id, created_at) "
+        "SELECT user_id, id, created_at FROM food WHERE user_id IS NOT NULL "
+        "UNION "
+        "SELECT followers.follower_id, food.id, food.created_at FROM food "
+        "JOIN followers ON followers.followed_id = food.user_id "
+        "WHERE followers.follower_id IS NOT NULL"
+    )
+
+
+def downgrade():
+    op.drop_index('ix_timeline_user_id_created_at', table_name='timeline')
+    op.drop_table('timeline')
+    op.drop_column('users', 'fanout_on_read')
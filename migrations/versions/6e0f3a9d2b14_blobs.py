@@ -0,0 +1,46 @@
+"""content-addressed blobs
+
+Revision ID: 6e0f3a9d2b14
+Revises: 9c2a5f7e1b08
+Create Date: 2026-10-18 14:05:37.204815
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6e0f3a9d2b14'
+down_revision = '9c2a5f7e1b08'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('blobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('digest', sa.String(length=64), nullable=False),
+    sa.Column('aws_key', sa.String(length=100), nullable=False),
+    sa.Column('content_type', sa.String(length=100), nullable=True),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('image_variants', sa.JSON(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('digest')
+    )
+    # existing dishes keep their per-user keys and are simply not deduplicated against
+    with op.batch_alter_table('food') as batch_op:
+        batch_op.drop_constraint('food_aws_key_key', type_='unique')
+        batch_op.add_column(sa.Column('blob_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('food_blob_id_fkey', 'blobs', ['blob_id'], ['id'])
+    op.add_column('upload_jobs', sa.Column('digest', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    op.drop_column('upload_jobs', 'digest')
+    with op.batch_alter_table('food') as batch_op:
+        batch_op.drop_constraint('food_blob_id_fkey', type_='foreignkey')
+        batch_op.drop_column('blob_id')
+        batch_op.create_unique_constraint('food_aws_key_key', ['aws_key'])
+    op.drop_table('blobs')
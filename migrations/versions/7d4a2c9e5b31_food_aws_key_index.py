@@ -0,0 +1,24 @@
+"""index dishes by image key
+
+Revision ID: 7d4a2c9e5b31
+Revises: 2c9e4d7b1f56
+Create Date: 2026-10-18 16:12:40.318251
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d4a2c9e5b31'
+down_revision = '2c9e4d7b1f56'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_food_aws_key'), 'food', ['aws_key'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_food_aws_key'), table_name='food')
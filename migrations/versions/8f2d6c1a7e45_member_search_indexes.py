@@ -0,0 +1,39 @@
+"""member search indexes
+
+Revision ID: 8f2d6c1a7e45
+Revises: 4b8e1f6a2d93
+Create Date: 2026-10-18 15:31:09.426715
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f2d6c1a7e45'
+down_revision = '4b8e1f6a2d93'
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    'ix_users_username_prefix': 'username',
+    'ix_users_first_name_prefix': 'first_name',
+    'ix_users_last_name_prefix': 'last_name',
+}
+
+
+def prefix_key(column):
+    # must match food_journal.database.prefix_key, or searches will not use the index
+    if op.get_bind().dialect.name == 'postgresql':
+        return sa.text(f'lower({column}) COLLATE "C"')
+    return sa.text(f'lower({column})')
+
+
+def upgrade():
+    for name, column in INDEXES.items():
+        op.create_index(name, 'users', [prefix_key(column), 'id'], unique=False)
+
+
+def downgrade():
+    for name in INDEXES:
+        op.drop_index(name, table_name='users')
@@ -0,0 +1,27 @@
+"""upload jobs without a spooled file
+
+Revision ID: 9c2a5f7e1b08
+Revises: 3f6b0d8e2c57
+Create Date: 2026-10-18 13:30:12.660481
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c2a5f7e1b08'
+down_revision = '3f6b0d8e2c57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('upload_jobs') as batch_op:
+        batch_op.alter_column('spool_path', existing_type=sa.String(length=255), nullable=True)
+
+
+def downgrade():
+    op.execute("DELETE FROM upload_jobs WHERE spool_path IS NULL")
+    with op.batch_alter_table('upload_jobs') as batch_op:
+        batch_op.alter_column('spool_path', existing_type=sa.String(length=255), nullable=False)
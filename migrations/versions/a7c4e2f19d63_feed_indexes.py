@@ -0,0 +1,55 @@
+"""composite feed indexes and followers primary key
+
+Revision ID: a7c4e2f19d63
+Revises: 5d1e7a3c9b20
+Create Date: 2026-10-18 10:03:17.554912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c4e2f19d63'
+down_revision = '5d1e7a3c9b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_food_is_public_created_at', 'food', ['is_public', 'created_at', 'id'], unique=False)
+    op.create_index('ix_food_user_id_created_at', 'food', ['user_id', 'created_at', 'id'], unique=False)
+
+    # followers had no key, so it may hold duplicate or half-empty rows; copy the
+    # distinct pairs into a keyed table rather than altering it in place
+    op.create_table('followers_new',
+    sa.Column('follower_id', sa.Integer(), nullable=False),
+    sa.Column('followed_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['followed_id'], ['users.id'], name='followers_followed_id_fkey'),
+    sa.ForeignKeyConstraint(['follower_id'], ['users.id'], name='followers_follower_id_fkey'),
+    sa.PrimaryKeyConstraint('follower_id', 'followed_id', name='followers_pkey')
+    )
+    op.execute(
+        "INSERT INTO followers_new (follower_id, followed_id) "
+        "SELECT DISTINCT follower_id, followed_id FROM followers "
+        "WHERE follower_id IS NOT NULL AND followed_id IS NOT NULL"
+    )
+    op.drop_table('followers')
+    op.rename_table('followers_new', 'followers')
+    op.create_index('ix_followers_followed_id', 'followers', ['followed_id', 'follower_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_followers_followed_id', table_name='followers')
+    op.create_table('followers_old',
+    sa.Column('follower_id', sa.Integer(), nullable=True),
+    sa.Column('followed_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['followed_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['follower_id'], ['users.id'], )
+    )
+    op.execute("INSERT INTO followers_old (follower_id, followed_id) SELECT follower_id, followed_id FROM followers")
+    op.drop_table('followers')
+    op.rename_table('followers_old', 'followers')
+
+    op.drop_index('ix_food_user_id_created_at', table_name='food')
+    op.drop_index('ix_food_is_public_created_at', table_name='food')
@@ -0,0 +1,38 @@
+"""upload state and upload jobs
+
+Revision ID: e2b98f0c4a11
+Revises: a7c4e2f19d63
+Create Date: 2026-10-18 11:20:05.871290
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b98f0c4a11'
+down_revision = 'a7c4e2f19d63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('food', sa.Column('upload_state', sa.String(length=10), nullable=False, server_default='ready'))
+    op.create_table('upload_jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('food_id', sa.Integer(), nullable=False),
+    sa.Column('spool_path', sa.String(length=255), nullable=False),
+    sa.Column('content_type', sa.String(length=100), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('last_error', sa.String(length=255), nullable=True),
+    sa.ForeignKeyConstraint(['food_id'], ['food.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_upload_jobs_next_attempt_at'), 'upload_jobs', ['next_attempt_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_upload_jobs_next_attempt_at'), table_name='upload_jobs')
+    op.drop_table('upload_jobs')
+    op.drop_column('food', 'upload_state')
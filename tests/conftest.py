@@ -2,15 +2,24 @@
 """Defines fixtures available to all tests."""
 
 import logging
+from contextlib import contextmanager
 
+import boto3
 import pytest
 from webtest import TestApp
 
 from food_journal.app import create_app
 from food_journal.database import db as _db
+from food_journal.public.models import AWS_Mixin
+from food_journal.storage import S3Backend
 
 from .factories import UserFactory
 
+try:
+    from moto import mock_aws
+except ImportError:  # moto < 5
+    from moto import mock_s3 as mock_aws
+
 
 @pytest.fixture
 def app():
@@ -45,9 +54,59 @@ def db(app):
     _db.drop_all()
 
 
+@pytest.fixture
+def foreign_keys(db):
+    """Enforce foreign keys, as Postgres always does; the test database does not by default."""
+    db.session.remove()
+    db.engine.execute("PRAGMA foreign_keys=ON")
+
+    yield
+
+    db.session.remove()
+    db.engine.execute("PRAGMA foreign_keys=OFF")
+
+
+@pytest.fixture
+def count_queries(db):
+    """A context manager collecting the statements executed within its block."""
+
+    @contextmanager
+    def counting():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        db.event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            db.event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+    return counting
+
+
 @pytest.fixture
 def user(db):
     """Create user for the tests."""
     user = UserFactory(password="myprecious")
     db.session.commit()
     return user
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    """Skip S3 uploads; food items in tests carry their own ``aws_key``."""
+    monkeypatch.setattr(AWS_Mixin, "upload_to_s3", classmethod(lambda cls, model: True))
+
+
+@pytest.fixture
+def s3_bucket(app, monkeypatch):
+    """A local stand-in for the app's S3 bucket."""
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN"):
+        monkeypatch.setenv(name, "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setitem(app.extensions, "storage", S3Backend(app.config))
+    with mock_aws():
+        bucket = boto3.resource("s3").create_bucket(Bucket=app.config["S3_BUCKET_NAME"])
+        yield bucket
@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 """Factories to help in tests."""
-from factory import PostGenerationMethodCall, Sequence
+from factory import PostGenerationMethodCall, Sequence, SubFactory
 from factory.alchemy import SQLAlchemyModelFactory
 
 from food_journal.database import db
+from food_journal.public.models import FoodItem
 from food_journal.user.models import User
 
 
@@ -29,3 +30,17 @@ class UserFactory(BaseFactory):
         """Factory configuration."""
 
         model = User
+
+
+class FoodItemFactory(BaseFactory):
+    """Food item factory."""
+
+    title = Sequence(lambda n: f"dish{n}")
+    aws_key = Sequence(lambda n: f"dishes/dish{n}.jpg")
+    author = SubFactory(UserFactory)
+    is_public = True
+
+    class Meta:
+        """Factory configuration."""
+
+        model = FoodItem
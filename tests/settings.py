@@ -6,7 +6,48 @@ SECRET_KEY = "not-so-secret-in-tests"
 BCRYPT_LOG_ROUNDS = (
     4  # For faster tests; needs at least 4 to avoid "ValueError: Invalid rounds"
 )
+BCRYPT_POOL_SIZE = 2
 DEBUG_TB_ENABLED = False
 CACHE_TYPE = "simple"  # Can be "memcached", "redis", etc.
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+SQLALCHEMY_BINDS = {}
+REPLICA_MAX_LAG = 5.0
+BULK_CHUNK_SIZE = 1000
 WTF_CSRF_ENABLED = False  # Allows form testing
+FEED_PAGE_SIZE = 20
+STORAGE_BACKEND = "memory"  # the s3_bucket fixture switches to a mocked S3
+STORAGE_LOCAL_ROOT = "/tmp/food_journal_tests/media"
+STORAGE_CACHE_TIMEOUT = 3600
+S3_BUCKET_NAME = "food-journal-tests"
+S3_OBJECT_URL_TEMPLATE = "https://{}.s3.amazonaws.com/{}"
+S3_MULTIPART_THRESHOLD = 5 * 1024 * 1024  # the smallest part size S3 accepts
+S3_MULTIPART_CHUNKSIZE = 5 * 1024 * 1024
+S3_MAX_CONCURRENCY = 2
+MAX_CONTENT_LENGTH = 12 * 1024 * 1024
+S3_BLOB_PREFIX = "blobs/"
+S3_UPLOAD_MODE = "sync"
+S3_PRESIGNED_POST_EXPIRES = 600
+IMAGE_DERIVATIVE_FORMATS = ["webp"]
+IMAGE_QUALITY = 80
+S3_MAX_POOL_CONNECTIONS = 10
+S3_MAX_ATTEMPTS = 1
+S3_CONNECT_TIMEOUT = 5.0
+S3_READ_TIMEOUT = 30.0
+UPLOAD_SPOOL_DIR = "/tmp/food_journal_tests/uploads"
+UPLOAD_MAX_ATTEMPTS = 3
+UPLOAD_RETRY_BACKOFF = 5
+UPLOAD_WORKER_POLL_INTERVAL = 0.1
+TIMELINE_FANOUT_LIMIT = 5000
+TIMELINE_BACKFILL_SIZE = 200
+FEED_CACHE_TIMEOUT = 300
+IDENTITY_CACHE_TIMEOUT = 60
+FOLLOW_GRAPH_CACHE_TIMEOUT = 3600
+ROW_CACHE_TIMEOUT = 30
+ROW_CACHE_SIZE = 10000
+MEMBERS_PAGE_SIZE = 30
+TYPEAHEAD_LIMIT = 10
+FOLLOW_SUGGESTIONS_SIZE = 20
+FOLLOW_SUGGESTIONS_SHOWN = 5
+FOLLOW_SUGGESTIONS_ACTIVE_DAYS = 90
+LAST_SEEN_INTERVAL = 300
+LAST_SEEN_FLUSH_INTERVAL = 3600  # tests flush explicitly
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""last_seen buffering tests."""
+import datetime as dt
+import time
+
+from food_journal.extensions import activity
+from food_journal.user.models import User
+
+
+class TestActivityTracker:
+    """Buffered last_seen writes."""
+
+    def test_flush_writes_buffered_times(self, db, user):
+        """Times are written by the flush, not when they are recorded."""
+        user_id = user.id
+        user.update(last_seen=dt.datetime(2020, 1, 1))
+        activity.seen(user_id)
+        assert db.session.query(User.last_seen).filter_by(
+            id=user_id
+        ).scalar() == dt.datetime(2020, 1, 1)
+        assert activity.flush() == 1
+        assert db.session.query(User.last_seen).filter_by(
+            id=user_id
+        ).scalar() > dt.datetime(2020, 1, 1)
+
+    def test_users_are_written_once_per_interval(
+        self, app, db, monkeypatch, count_queries
+    ):
+        """Repeated visits within LAST_SEEN_INTERVAL are dropped; later ones are recorded again."""
+        users = [
+            User.create(username=f"user{i}", email=f"user{i}@example.com")
+            for i in range(3)
+        ]
+        for _ in range(5):
+            for user in users:
+                activity.seen(user.id)
+        with count_queries() as statements:
+            assert activity.flush() == 3
+        assert (
+            len(
+                [
+                    statement
+                    for statement in statements
+                    if statement.startswith("UPDATE")
+                ]
+            )
+            == 1
+        )
+        activity.seen(users[0].id)
+        assert activity.flush() == 0
+
+        later = time.monotonic() + app.config["LAST_SEEN_INTERVAL"]
+        monkeypatch.setattr("time.monotonic", lambda: later)
+        activity.seen(users[0].id)
+        assert activity.flush() == 1
+        assert app.extensions["activity"].flushed == 4
+
+    def test_flushing_thread_starts_per_process(self, app, db, user, monkeypatch):
+        """A forked process starts its own thread with an empty buffer."""
+        state = app.extensions["activity"]
+        activity.seen(user.id)
+        assert state.pid is not None and state.pending
+        monkeypatch.setattr("os.getpid", lambda: -1)
+        activity.seen(user.id)
+        assert state.pid == -1
+        assert list(state.pending) == [user.id]
+
+
+def test_page_views_do_not_write(db, user, testapp, count_queries):
+    """A logged-in page view runs no statements; its visit is written by the next flush."""
+    testapp.post("/login", {"username": user.username, "password": "myprecious"})
+    testapp.get("/about/")
+    with count_queries() as statements:
+        testapp.get("/about/")
+    assert statements == []
+    assert activity.flush() == 1
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Member directory tests."""
+import pytest
+from flask import url_for
+
+from food_journal.database import db as _db
+from food_journal.user.directory import members_page, typeahead
+from food_journal.utils import InvalidCursor
+
+from .factories import UserFactory
+
+
+@pytest.fixture
+def members(db):
+    """Four active members and an inactive one."""
+    members = [
+        UserFactory(username="annie", first_name="Ann", last_name="Baker"),
+        UserFactory(username="Bob", first_name="Robert", last_name="Annan"),
+        UserFactory(username="carla", first_name="Carla", last_name="Cook"),
+        UserFactory(username="anna2", first_name="Anna", last_name="Zed"),
+        UserFactory(username="zoe", active=False),
+    ]
+    db.session.commit()
+    return members
+
+
+def usernames(page):
+    """The usernames on ``page``, in order."""
+    return [member.username for member in page]
+
+
+class TestMembersPage:
+    """Browsing and searching the directory."""
+
+    def test_lists_active_members_by_username(self, members):
+        """Usernames sort case-insensitively; inactive members are left out."""
+        assert usernames(members_page()) == ["anna2", "annie", "Bob", "carla"]
+
+    def test_prefix_matches_usernames_and_names(self, members):
+        """A prefix matches the start of the username, first or last name, in any case.
+
+        Members are ordered by the name that matched.
+        """
+        assert usernames(members_page("AN")) == ["annie", "anna2", "Bob"]
+        assert usernames(members_page(" rob")) == ["Bob"]
+        assert usernames(members_page("nn")) == []
+
+    def test_keyset_pages(self, members):
+        """Pages follow each other without gaps or repeats."""
+        first = members_page("an", page_size=2)
+        assert usernames(first) == ["annie", "anna2"]
+        second = members_page("an", after=first.next_cursor, page_size=2)
+        assert usernames(second) == ["Bob"]
+        assert not second.has_more
+
+    def test_invalid_cursor(self, members):
+        """Malformed cursors are rejected."""
+        with pytest.raises(InvalidCursor):
+            members_page(after="not a cursor!")
+
+    def test_uses_prefix_index(self, members):
+        """Username prefixes are index range scans."""
+        plan = " ".join(
+            str(row)
+            for row in _db.session.execute(
+                "EXPLAIN QUERY PLAN SELECT id FROM users WHERE lower(username) >= 'an' AND lower(username) < 'ao'"
+            )
+        )
+        assert "ix_users_username_prefix" in plan
+
+
+class TestTypeahead:
+    """Suggestions while typing."""
+
+    def test_merges_columns_without_duplicates(self, members):
+        """Members are ordered by their first name that matched and listed once."""
+        assert [item["username"] for item in typeahead("an")] == [
+            "annie",
+            "anna2",
+            "Bob",
+        ]
+
+    def test_limit(self, members):
+        """No more than the limit is returned; blank input returns nothing."""
+        assert len(typeahead("an", limit=2)) == 2
+        assert typeahead("  ") == []
+
+    def test_endpoint(self, members, testapp):
+        """The JSON endpoint links each member's profile."""
+        UserFactory(username="searcher", password="myprecious")
+        _db.session.commit()
+        testapp.post("/login", {"username": "searcher", "password": "myprecious"})
+        res = testapp.get(url_for("user.search"), {"q": "car"})
+        assert res.json["items"] == [
+            {
+                "id": members[2].id,
+                "username": "carla",
+                "first_name": "Carla",
+                "last_name": "Cook",
+                "url": url_for("user.profile", username="carla"),
+            }
+        ]
+        res = testapp.get(url_for("user.members"), {"q": "an"})
+        assert "annie" in res and "carla" not in res
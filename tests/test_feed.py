@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""Feed pagination tests."""
+import datetime as dt
+
+import pytest
+
+from food_journal.public.feed import (
+    PUBLIC_FEED_VERSION_KEY,
+    InvalidCursor,
+    decode_cursor,
+    encode_cursor,
+    followed_feed,
+    public_feed,
+    render_followed_feed,
+    render_public_feed,
+)
+from food_journal.user.models import TimelineEntry, User
+from food_journal.utils import cache_version
+
+from .factories import FoodItemFactory, UserFactory
+
+
+def make_dishes(db, count, **kwargs):
+    """Create ``count`` dishes, one minute apart, oldest first."""
+    start = dt.datetime(2020, 1, 1)
+    dishes = [
+        FoodItemFactory(created_at=start + dt.timedelta(minutes=i), **kwargs)
+        for i in range(count)
+    ]
+    db.session.commit()
+    return dishes
+
+
+class TestCursor:
+    """Cursor encoding."""
+
+    def test_round_trip(self):
+        """Decoding an encoded cursor returns the original position."""
+        created_at = dt.datetime(2020, 2, 3, 4, 5, 6, 789)
+        assert decode_cursor(encode_cursor(created_at, 42)) == (created_at, 42)
+
+    def test_invalid_cursor(self):
+        """Garbage tokens are rejected."""
+        with pytest.raises(InvalidCursor):
+            decode_cursor("not-a-cursor")
+
+
+@pytest.mark.usefixtures("s3")
+class TestPublicFeed:
+    """Public feed."""
+
+    def test_pages_walk_the_whole_feed(self, db):
+        """Following cursors visits every public dish once, newest first."""
+        dishes = make_dishes(db, 5)
+        seen = []
+        page = public_feed(page_size=2)
+        while True:
+            seen.extend(page.items)
+            if not page.has_more:
+                break
+            page = public_feed(before=page.next_cursor, page_size=2)
+        assert seen == list(reversed(dishes))
+
+    def test_ties_on_created_at_are_broken_by_id(self, db):
+        """Dishes sharing a timestamp are neither skipped nor repeated."""
+        created_at = dt.datetime(2020, 1, 1)
+        dishes = [FoodItemFactory(created_at=created_at) for _ in range(3)]
+        db.session.commit()
+        first = public_feed(page_size=2)
+        second = public_feed(before=first.next_cursor, page_size=2)
+        assert first.items + second.items == sorted(dishes, key=lambda d: -d.id)
+        assert not second.has_more
+
+    def test_private_dishes_are_hidden(self, db):
+        """Only public dishes are listed."""
+        make_dishes(db, 2, is_public=False)
+        assert public_feed().items == []
+
+
+@pytest.mark.usefixtures("s3")
+class TestFollowedFeed:
+    """Followed feed."""
+
+    def test_includes_own_and_followed_dishes(self, db):
+        """Own and followed dishes are listed; others are not."""
+        user, followed, stranger = UserFactory(), UserFactory(), UserFactory()
+        user.follow(followed)
+        db.session.commit()
+        own = make_dishes(db, 1, author=user)
+        theirs = make_dishes(db, 2, author=followed)
+        make_dishes(db, 2, author=stranger)
+
+        first = followed_feed(user, page_size=2)
+        second = followed_feed(user, before=first.next_cursor, page_size=2)
+        assert set(first.items + second.items) == set(own + theirs)
+        assert not second.has_more
+
+
+@pytest.mark.usefixtures("s3")
+class TestTimeline:
+    """Materialized timelines."""
+
+    def test_new_dish_is_pushed_to_followers(self, db):
+        """Creating a dish writes a timeline entry for the author and each follower."""
+        author, follower = UserFactory(), UserFactory()
+        follower.follow(author)
+        db.session.commit()
+        dish = FoodItemFactory(author=author)
+        db.session.commit()
+        entries = {(e.user_id, e.food_id) for e in TimelineEntry.query.all()}
+        assert entries == {(author.id, dish.id), (follower.id, dish.id)}
+
+    @pytest.mark.usefixtures("foreign_keys")
+    def test_deleting_a_dish_removes_it_from_timelines(self, db):
+        """Timeline entries go with their dish."""
+        author, follower = UserFactory(), UserFactory()
+        follower.follow(author)
+        db.session.commit()
+        dish = FoodItemFactory(author=author)
+        db.session.commit()
+        dish.delete()
+        assert TimelineEntry.query.count() == 0
+        assert followed_feed(follower).items == []
+
+    def test_follow_backfills_and_unfollow_prunes(self, db):
+        """Existing dishes appear on follow and disappear on unfollow."""
+        user, author = UserFactory(), UserFactory()
+        dishes = make_dishes(db, 2, author=author)
+        user.follow(author)
+        db.session.commit()
+        assert set(followed_feed(user).items) == set(dishes)
+        user.unfollow(author)
+        db.session.commit()
+        assert followed_feed(user).items == []
+
+    def test_high_follower_accounts_are_pulled_on_read(self, app, db):
+        """Dishes by accounts over the fan-out limit are merged in at read time."""
+        app.config["TIMELINE_FANOUT_LIMIT"] = 1
+        author, first, second = UserFactory(), UserFactory(), UserFactory()
+        first.follow(author)
+        second.follow(author)
+        db.session.commit()
+        assert author.fanout_on_read
+        dish = FoodItemFactory(author=author)
+        db.session.commit()
+        assert TimelineEntry.query.filter_by(user_id=second.id).count() == 0
+        assert followed_feed(second).items == [dish]
+
+    def test_rebuild(self, db):
+        """Rebuilding reproduces the timelines written incrementally."""
+        author, follower = UserFactory(), UserFactory()
+        follower.follow(author)
+        make_dishes(db, 3, author=author)
+        before = {(e.user_id, e.food_id) for e in TimelineEntry.query.all()}
+        assert TimelineEntry.rebuild() == len(before)
+        db.session.commit()
+        assert {(e.user_id, e.food_id) for e in TimelineEntry.query.all()} == before
+
+
+@pytest.mark.usefixtures("s3")
+class TestAuthorLoading:
+    """Authors are loaded with the feed, not one query per dish."""
+
+    def render(self, db, count_queries, feed):
+        """Queries run to render ``feed()`` with its authors, as a new request would."""
+        db.session.expunge_all()
+        with count_queries() as statements:
+            [food.author.username for food in feed()]
+        return len(statements)
+
+    @pytest.mark.parametrize("pulled", [False, True])
+    def test_followed_feed_query_count_is_constant(
+        self, app, db, pulled, count_queries
+    ):
+        """Rendering authors costs the same for 2 or 6 dishes by distinct users."""
+        if pulled:
+            app.config["TIMELINE_FANOUT_LIMIT"] = 0
+        user = UserFactory()
+        db.session.commit()
+
+        def add_followed_dishes(count):
+            for _ in range(count):
+                dish = FoodItemFactory()
+                user.follow(dish.author)
+            db.session.commit()
+
+        user_id = user.id
+        add_followed_dishes(2)
+        small = self.render(
+            db, count_queries, lambda: followed_feed(User.query.get(user_id))
+        )
+        user = User.query.get(user_id)
+        add_followed_dishes(4)
+        assert (
+            self.render(
+                db, count_queries, lambda: followed_feed(User.query.get(user_id))
+            )
+            == small
+        )
+
+    def test_public_feed_query_count_is_constant(self, db, count_queries):
+        """Rendering authors costs the same for 2 or 6 dishes by distinct users."""
+        FoodItemFactory.create_batch(2)
+        db.session.commit()
+        small = self.render(db, count_queries, public_feed)
+        FoodItemFactory.create_batch(4)
+        db.session.commit()
+        assert self.render(db, count_queries, public_feed) == small == 2
+
+    def test_cached_authors_cost_no_query(self, db, count_queries):
+        """Authors come from the row cache once a feed has loaded them."""
+        FoodItemFactory.create_batch(3)
+        db.session.commit()
+        self.render(db, count_queries, public_feed)
+        assert self.render(db, count_queries, public_feed) == 1
+
+
+@pytest.mark.usefixtures("s3")
+class TestFeedCache:
+    """Rendered feed pages are cached and invalidated on commit."""
+
+    def test_anonymous_home_page_is_served_from_cache(self, db, testapp, count_queries):
+        """A repeated anonymous visit does not touch the database."""
+        FoodItemFactory.create_batch(2)
+        db.session.commit()
+        testapp.get("/")
+        with count_queries() as statements:
+            res = testapp.get("/")
+        assert statements == []
+        assert "Look what I made" in res
+
+    def test_new_public_dish_invalidates_public_feed(self, db):
+        """The public feed shows a dish as soon as it is committed."""
+        render_public_feed()
+        dish = FoodItemFactory()
+        db.session.commit()
+        assert dish.title in render_public_feed()
+
+    def test_new_dish_invalidates_followers_feeds(self, db):
+        """Followers' feeds show a dish as soon as it is committed."""
+        author, follower = UserFactory(), UserFactory()
+        follower.follow(author)
+        db.session.commit()
+        render_followed_feed(follower)
+        dish = FoodItemFactory(author=author)
+        db.session.commit()
+        assert dish.title in render_followed_feed(follower)
+
+    def test_follow_and_unfollow_invalidate_feed(self, db):
+        """Following or unfollowing someone changes the follower's feed immediately."""
+        user = UserFactory()
+        dish = FoodItemFactory()
+        db.session.commit()
+        assert dish.title not in render_followed_feed(user)
+        user.follow(dish.author)
+        db.session.commit()
+        assert dish.title in render_followed_feed(user)
+        user.unfollow(dish.author)
+        db.session.commit()
+        assert dish.title not in render_followed_feed(user)
+
+    def test_rolled_back_changes_keep_cache(self, db):
+        """Nothing is invalidated when the transaction is rolled back."""
+        dish = FoodItemFactory()
+        db.session.commit()
+        version = cache_version(PUBLIC_FEED_VERSION_KEY)
+        dish.title = "renamed"
+        db.session.flush()
+        db.session.rollback()
+        assert cache_version(PUBLIC_FEED_VERSION_KEY) == version
+
+
+@pytest.mark.usefixtures("s3")
+class TestFeedApi:
+    """JSON feed endpoint."""
+
+    def test_returns_page_fields_and_cursor(self, db, testapp):
+        """Each item carries only what the carousel shows, plus a cursor to the next page."""
+        dishes = make_dishes(db, 3)
+        testapp.app.config["FEED_PAGE_SIZE"] = 2
+        res = testapp.get("/api/feed")
+        assert [item["id"] for item in res.json["items"]] == [
+            dishes[2].id,
+            dishes[1].id,
+        ]
+        assert set(res.json["items"][0]) == {
+            "id",
+            "title",
+            "comment",
+            "author",
+            "image_url",
+            "image_srcset",
+            "created_at",
+        }
+        assert res.json["items"][0]["author"] == dishes[2].author.username
+
+        res = testapp.get("/api/feed", {"before": res.json["next"]})
+        assert [item["id"] for item in res.json["items"]] == [dishes[0].id]
+        assert res.json["next"] is None
+
+    def test_unchanged_page_is_not_modified(self, db, testapp):
+        """Revalidating an unchanged page returns 304; a new dish changes the ETag."""
+        make_dishes(db, 1)
+        res = testapp.get("/api/feed")
+        assert res.headers["Last-Modified"]
+        testapp.get("/api/feed", headers={"If-None-Match": res.etag}, status=304)
+
+        FoodItemFactory()
+        db.session.commit()
+        testapp.get("/api/feed", headers={"If-None-Match": res.etag}, status=200)
+
+    def test_rejects_invalid_cursor(self, db, testapp):
+        """A malformed cursor is a bad request."""
+        testapp.get("/api/feed?before=garbage", status=400)
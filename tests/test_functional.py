@@ -3,11 +3,16 @@
 
 See: http://webtest.readthedocs.org/
 """
+import io
+
+import pytest
 from flask import url_for
+from PIL import Image
 
+from food_journal.public.models import Blob, FoodItem
 from food_journal.user.models import User
 
-from .factories import UserFactory
+from .factories import FoodItemFactory, UserFactory
 
 
 class TestLoggingIn:
@@ -118,3 +123,141 @@ class TestRegistering:
         res = form.submit()
         # sees error
         assert "Username already registered" in res
+
+
+@pytest.mark.usefixtures("s3")
+class TestHomeFeed:
+    """Home page feed."""
+
+    def test_links_to_older_dishes(self, db, testapp):
+        """A full page links to the next, older page."""
+        FoodItemFactory.create_batch(3)
+        db.session.commit()
+        testapp.app.config["FEED_PAGE_SIZE"] = 2
+        res = testapp.get("/")
+        res = res.click("Older dishes")
+        assert res.status_code == 200
+        assert "Older dishes" not in res
+
+    def test_rejects_invalid_cursor(self, db, testapp):
+        """A malformed cursor is a bad request."""
+        testapp.get("/?before=garbage", status=400)
+
+
+class TestDirectUpload:
+    """Adding a dish whose image the browser uploaded straight to S3."""
+
+    @pytest.fixture
+    def logged_in(self, user, testapp):
+        """The user, logged in."""
+        res = testapp.get("/")
+        form = res.forms["loginForm"]
+        form["username"] = user.username
+        form["password"] = "myprecious"
+        form.submit()
+        return user
+
+    def test_presign_limits_key_type_and_size(self, logged_in, testapp, s3_bucket):
+        """The policy only allows an image under the user's prefix, up to MAX_CONTENT_LENGTH."""
+        res = testapp.post(url_for("public.presign_dish"), {"filename": "dinner.JPG"})
+        assert res.json["key"].startswith(f"{logged_in.username}/uploads/")
+        assert res.json["key"].endswith(".jpg")
+        assert res.json["fields"]["key"] == res.json["key"]
+        assert res.json["fields"]["Content-Type"] == "image/jpeg"
+        assert res.json["fields"]["acl"] == "public-read"
+        assert "policy" in res.json["fields"]
+
+    def test_presign_rejects_other_files(self, logged_in, testapp, s3_bucket):
+        """Only image extensions can be presigned."""
+        testapp.post(
+            url_for("public.presign_dish"), {"filename": "dinner.exe"}, status=400
+        )
+
+    def test_presign_requires_login(self, db, testapp):
+        """Anonymous users cannot upload."""
+        testapp.post(
+            url_for("public.presign_dish"), {"filename": "dinner.jpg"}, status=401
+        )
+
+    def test_finalize_creates_dish(self, logged_in, testapp, s3_bucket):
+        """An uploaded image becomes a dish without passing through the app."""
+        key = testapp.post(
+            url_for("public.presign_dish"), {"filename": "dinner.jpg"}
+        ).json["key"]
+        s3_bucket.put_object(
+            Key=key, Body=b"not really a jpeg", ContentType="image/jpeg"
+        )
+        res = testapp.post(
+            url_for("public.finalize_dish"),
+            {"title": "Dinner", "comment": "", "key": key},
+        )
+        assert res.json["redirect"] == url_for("public.index")
+        food = FoodItem.query.filter_by(aws_key=key).one()
+        assert food.author == logged_in
+        assert food.upload_state == FoodItem.UPLOAD_READY
+
+    def upload(self, testapp, s3_bucket, data):
+        """Upload ``data`` the way the browser does; return its key."""
+        key = testapp.post(
+            url_for("public.presign_dish"), {"filename": "dinner.jpg"}
+        ).json["key"]
+        s3_bucket.put_object(Key=key, Body=data, ContentType="image/jpeg")
+        return key
+
+    def test_finalize_derives_and_deduplicates(self, logged_in, testapp, s3_bucket):
+        """Direct uploads get derivatives and share the blob of identical images."""
+        original = io.BytesIO()
+        Image.new("RGB", (400, 300), "red").save(original, "JPEG")
+        first_key = self.upload(testapp, s3_bucket, original.getvalue())
+        testapp.post(
+            url_for("public.finalize_dish"), {"title": "Dinner", "key": first_key}
+        )
+        first = FoodItem.query.filter_by(aws_key=first_key).one()
+        assert list(first.image_variants) == ["thumb"]
+        assert first.blob.ref_count == 1
+
+        second_key = self.upload(testapp, s3_bucket, original.getvalue())
+        testapp.post(
+            url_for("public.finalize_dish"), {"title": "Lunch", "key": second_key}
+        )
+        second = FoodItem.query.filter_by(title="Lunch").one()
+        assert (second.aws_key, second.blob) == (first_key, first.blob)
+        assert Blob.query.one().ref_count == 2
+        assert second_key not in [stored.key for stored in s3_bucket.objects.all()]
+
+    def test_finalize_rejects_used_key(self, logged_in, testapp, s3_bucket):
+        """Each upload makes one dish."""
+        key = self.upload(testapp, s3_bucket, b"not really a jpeg")
+        testapp.post(url_for("public.finalize_dish"), {"title": "Dinner", "key": key})
+        testapp.post(
+            url_for("public.finalize_dish"), {"title": "Dinner", "key": key}, status=400
+        )
+        assert FoodItem.query.count() == 1
+
+    def test_finalize_rejects_foreign_key(self, logged_in, testapp, s3_bucket):
+        """Users can only claim objects under their own upload prefix."""
+        s3_bucket.put_object(
+            Key="someone/uploads/a.jpg", Body=b"x", ContentType="image/jpeg"
+        )
+        testapp.post(
+            url_for("public.finalize_dish"),
+            {"title": "Dinner", "key": "someone/uploads/a.jpg"},
+            status=400,
+        )
+        assert FoodItem.query.count() == 0
+
+    def test_finalize_rejects_missing_object(self, logged_in, testapp, s3_bucket):
+        """The image must actually have been uploaded."""
+        key = f"{logged_in.username}/uploads/missing.jpg"
+        testapp.post(
+            url_for("public.finalize_dish"), {"title": "Dinner", "key": key}, status=400
+        )
+
+    def test_finalize_rejects_large_object(self, logged_in, testapp, s3_bucket):
+        """Objects over MAX_CONTENT_LENGTH are refused."""
+        key = f"{logged_in.username}/uploads/big.jpg"
+        s3_bucket.put_object(Key=key, Body=b"x" * 4096, ContentType="image/jpeg")
+        testapp.app.config["MAX_CONTENT_LENGTH"] = 1024
+        testapp.post(
+            url_for("public.finalize_dish"), {"title": "Dinner", "key": key}, status=400
+        )
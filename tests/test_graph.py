@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Follow graph cache tests."""
+from food_journal.extensions import cache
+from food_journal.user.graph import followed_ids, followed_version_key
+from food_journal.utils import cache_version
+
+from .factories import UserFactory
+
+
+class TestFollowGraph:
+    """Cached follow lists."""
+
+    def test_batch_check_is_one_query_then_none(self, db, count_queries):
+        """A cold check reads the follow list once; warm checks read nothing."""
+        user = UserFactory()
+        others = UserFactory.create_batch(5)
+        db.session.commit()
+        for other in others[1::2]:
+            user.follow(other)
+        db.session.commit()
+        ids = [other.id for other in others]
+        assert user.id  # loads the user expired by the commit
+
+        with count_queries() as statements:
+            first = user.are_following(ids)
+        assert len(statements) == 1
+        with count_queries() as statements:
+            assert user.are_following(ids) == first
+        assert statements == []
+        assert first == {other.id: i % 2 == 1 for i, other in enumerate(others)}
+
+    def test_stored_as_sorted_array(self, db):
+        """Follow lists are kept as four bytes per followed user."""
+        user = UserFactory()
+        others = UserFactory.create_batch(3)
+        db.session.commit()
+        for other in reversed(others):
+            user.follow(other)
+        db.session.commit()
+        assert list(followed_ids(user.id)) == sorted(other.id for other in others)
+        key = f"user/{user.id}/followed/{cache_version(followed_version_key(user.id))}"
+        assert len(cache.get(key)) == 12
+
+    def test_follow_and_unfollow_invalidate(self, db):
+        """Committed follows and unfollows show up in the next check."""
+        user, other = UserFactory(), UserFactory()
+        db.session.commit()
+        assert not user.is_following(other)
+        user.follow(other)
+        db.session.commit()
+        assert user.is_following(other)
+        user.unfollow(other)
+        db.session.commit()
+        assert not user.is_following(other)
+
+    def test_rolled_back_follow_keeps_cache(self, db):
+        """Nothing is invalidated when the transaction is rolled back."""
+        user, other = UserFactory(), UserFactory()
+        db.session.commit()
+        version = cache_version(followed_version_key(user.id))
+        user.follow(other)
+        db.session.flush()
+        db.session.rollback()
+        assert cache_version(followed_version_key(user.id)) == version
+        assert not user.is_following(other)
+
+    def test_following_twice_before_commit(self, db):
+        """follow() sees uncommitted follows, so a repeated follow adds one row."""
+        user, other = UserFactory(), UserFactory()
+        db.session.commit()
+        user.follow(other)
+        user.follow(other)
+        db.session.commit()
+        assert user.followed.count() == 1
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""Identity cache tests."""
+from food_journal.user.identity import (
+    identity_cache_stats,
+    identity_version_key,
+    load_identity,
+)
+from food_journal.user.models import User
+from food_journal.utils import bump_cache_versions, cache_version
+
+from .factories import UserFactory
+
+
+class TestIdentityCache:
+    """Loading the logged-in user."""
+
+    def test_hit_rebuilds_user_without_queries(self, db, user, count_queries):
+        """The second load comes from the cache and is attached to the session."""
+        assert load_identity(user.id) == user
+        db.session.remove()
+        with count_queries() as statements:
+            cached = load_identity(user.id)
+            assert (cached.username, cached.email, cached.active) == (
+                user.username,
+                user.email,
+                user.active,
+            )
+        assert statements == []
+        assert cached in db.session
+        assert identity_cache_stats() == {"hits": 1, "misses": 1}
+
+    def test_password_is_loaded_on_access(self, db, user):
+        """The password hash is not cached."""
+        load_identity(user.id)
+        db.session.remove()
+        assert load_identity(user.id).check_password("myprecious")
+
+    def test_unknown_user(self, db):
+        """Missing users are None and not cached."""
+        assert load_identity(404) is None
+        assert load_identity(404) is None
+        assert identity_cache_stats()["misses"] == 2
+
+    def test_changes_invalidate(self, db, user):
+        """Profile edits, new passwords and deactivation apply on the next load."""
+        user_id = user.id
+        load_identity(user_id)
+        user.update(about_me="Cooking")
+        db.session.remove()
+        assert load_identity(user_id).about_me == "Cooking"
+
+        load_identity(user_id).update(active=False)
+        db.session.remove()
+        assert load_identity(user_id).active is False
+        assert identity_cache_stats() == {"hits": 1, "misses": 3}
+
+    def test_changes_by_other_processes_invalidate(self, db, user):
+        """A miss reads the user from the database, not from this process's row cache."""
+        load_identity(user.id)
+        db.session.remove()
+        assert User.get_by_id(user.id).active  # now in the row cache
+        db.session.remove()
+        # another worker deactivates the user; only its own row cache is evicted
+        db.engine.execute(
+            User.__table__.update().where(User.id == user.id).values(active=False)
+        )
+        bump_cache_versions([identity_version_key(user.id)])
+        assert load_identity(user.id).active is False
+
+    def test_last_seen_changes_do_not_invalidate(self, db, user):
+        """Only last_seen changing keeps the cached identity."""
+        load_identity(user.id)
+        version = cache_version(identity_version_key(user.id))
+        user.update(last_seen=user.created_at)
+        assert cache_version(identity_version_key(user.id)) == version
+
+    def test_deletion_invalidates(self, db):
+        """A deleted user is no longer loaded."""
+        user = UserFactory()
+        db.session.commit()
+        load_identity(user.id)
+        user.delete()
+        assert load_identity(user.id) is None
+
+    def test_rolled_back_changes_keep_cache(self, db, user):
+        """Nothing is invalidated when the transaction is rolled back."""
+        load_identity(user.id)
+        version = cache_version(identity_version_key(user.id))
+        user.about_me = "Baking"
+        db.session.flush()
+        db.session.rollback()
+        assert cache_version(identity_version_key(user.id)) == version
+
+    def test_savepoint_rollback_keeps_invalidations(self, db, user):
+        """Rolling back a savepoint does not undo the rest of the transaction."""
+        load_identity(user.id)
+        version = cache_version(identity_version_key(user.id))
+        user.about_me = "Baking"
+        db.session.flush()
+        db.session.begin_nested()
+        db.session.rollback()
+        db.session.commit()
+        assert cache_version(identity_version_key(user.id)) != version
+
+
+def test_logged_in_requests_do_not_select_the_user(db, user, testapp, count_queries):
+    """With the identity cached, a logged-in page view reads nothing from the database."""
+    testapp.post("/login", {"username": user.username, "password": "myprecious"})
+    testapp.get("/about/")
+    with count_queries() as statements:
+        res = testapp.get("/about/")
+    assert user.username in res
+    assert not [
+        statement
+        for statement in statements
+        if statement.lstrip().upper().startswith("SELECT")
+    ]
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""Bulk import tests."""
+import csv
+import datetime as dt
+import io
+import json
+import zipfile
+
+import pytest
+from PIL import Image
+
+from food_journal.commands import import_dishes as import_dishes_command
+from food_journal.extensions import storage
+from food_journal.public.imports import (
+    ImageSource,
+    import_dishes,
+    parse_timestamp,
+    read_manifest,
+)
+from food_journal.public.models import Blob, FoodItem, ImportRun
+from food_journal.storage import StorageError
+from food_journal.user.models import TimelineEntry
+
+from .factories import UserFactory
+
+
+def jpeg(color):
+    """A small JPEG filled with ``color``."""
+    image = io.BytesIO()
+    Image.new("RGB", (40, 30), color).save(image, "JPEG")
+    return image.getvalue()
+
+
+def write_manifest(path, rows):
+    """Write ``rows`` as a CSV manifest at ``path``."""
+    with open(path, "w", newline="") as manifest:
+        writer = csv.DictWriter(
+            manifest,
+            ["image", "title", "comment", "is_public", "created_at", "username"],
+        )
+        writer.writeheader()
+        writer.writerows(rows)
+    return str(path)
+
+
+@pytest.fixture
+def authors(db):
+    """The users the manifests refer to."""
+    authors = [UserFactory(username="ann"), UserFactory(username="bob")]
+    db.session.commit()
+    return authors
+
+
+@pytest.fixture
+def images(tmp_path):
+    """A directory of images, two of them identical."""
+    directory = tmp_path / "images"
+    directory.mkdir()
+    for name, color in (
+        ("red.jpg", "red"),
+        ("green.jpg", "green"),
+        ("copy-of-red.jpg", "red"),
+    ):
+        (directory / name).write_bytes(jpeg(color))
+    return directory
+
+
+def rows(count=3):
+    """``count`` manifest rows cycling through the images and authors."""
+    return [
+        {
+            "image": ["red.jpg", "green.jpg", "copy-of-red.jpg"][i % 3],
+            "title": f"Dish {i}",
+            "comment": "",
+            "is_public": "yes" if i % 2 == 0 else "no",
+            "created_at": f"2019-05-0{i + 1}T12:00:00",
+            "username": ["ann", "bob"][i % 2],
+        }
+        for i in range(count)
+    ]
+
+
+class TestImportDishes:
+    """Importing a directory of images."""
+
+    def test_imports_rows_with_their_fields(self, authors, images):
+        """Dishes keep their manifest fields and authors."""
+        stats = import_dishes(ImageSource(str(images)), rows(), "test", workers=2)
+        assert stats.imported == 3
+        dishes = FoodItem.query.order_by(FoodItem.created_at).all()
+        assert [dish.title for dish in dishes] == ["Dish 0", "Dish 1", "Dish 2"]
+        assert [dish.author for dish in dishes] == [authors[0], authors[1], authors[0]]
+        assert [author.dish_count for author in authors] == [2, 1]
+        assert [dish.is_public for dish in dishes] == [True, False, True]
+        assert dishes[0].created_at == dt.datetime(2019, 5, 1, 12)
+        assert dishes[0].upload_state == FoodItem.UPLOAD_READY
+        assert dishes[0].image_variants["thumb"]["width"] == 40
+        assert storage.backend.head(dishes[1].aws_key)["content_type"] == "image/jpeg"
+
+    def test_identical_images_are_stored_once(self, authors, images):
+        """Images with the same content share a blob, within and across runs."""
+        stats = import_dishes(ImageSource(str(images)), rows(), "first")
+        assert stats.deduplicated == 0
+        assert stats.bytes_stored == len(jpeg("red")) + len(jpeg("green"))
+        stats = import_dishes(ImageSource(str(images)), rows(1), "second")
+        assert stats.deduplicated == 1
+        assert stats.bytes_stored == 0
+        red = Blob.query.filter_by(
+            aws_key=FoodItem.query.filter_by(title="Dish 2").one().aws_key
+        ).one()
+        assert red.ref_count == 3
+        assert Blob.query.count() == 2
+
+    def test_batches_fan_out_to_timelines(self, authors, images, db):
+        """Imported dishes reach their authors' followers."""
+        follower = UserFactory()
+        follower.follow(authors[0])
+        db.session.commit()
+        import_dishes(ImageSource(str(images)), rows(), "test", batch_size=2)
+        food_ids = {
+            entry.food_id
+            for entry in TimelineEntry.query.filter_by(user_id=follower.id)
+        }
+        assert {FoodItem.get_by_id(food_id).title for food_id in food_ids} == {
+            "Dish 0",
+            "Dish 2",
+        }
+        assert TimelineEntry.query.filter_by(user_id=authors[1].id).count() == 1
+
+    def test_skips_bad_rows(self, authors, images):
+        """Rows with an unknown user, a missing image or no title are skipped."""
+        manifest = rows(3)
+        manifest[0]["username"] = "nobody"
+        manifest[1]["image"] = "missing.jpg"
+        manifest[2]["title"] = ""
+        stats = import_dishes(ImageSource(str(images)), manifest + rows(1), "test")
+        assert (stats.rejected, stats.imported, stats.done) == (3, 1, 4)
+        assert FoodItem.query.count() == 1
+
+    def test_resumes_after_the_last_committed_batch(self, authors, images, monkeypatch):
+        """A failed upload stops the import; running it again picks up where it stopped."""
+        manifest = rows(3)
+        manifest[2]["image"] = "blue.jpg"
+        (images / "blue.jpg").write_bytes(jpeg("blue"))
+        put = storage.backend.put
+
+        def fail_on_blue(fileobj, key, content_type=None):
+            if fileobj.getvalue() == jpeg("blue"):
+                raise StorageError("connection reset")
+            put(fileobj, key, content_type)
+
+        monkeypatch.setattr(storage.backend, "put", fail_on_blue)
+        with pytest.raises(StorageError):
+            import_dishes(ImageSource(str(images)), manifest, "test", batch_size=2)
+        assert FoodItem.query.count() == 2
+        assert ImportRun.query.one().rows_done == 2
+
+        monkeypatch.setattr(storage.backend, "put", put)
+        stats = import_dishes(ImageSource(str(images)), manifest, "test", batch_size=2)
+        assert stats.imported == 1
+        assert FoodItem.query.count() == 3
+        assert ImportRun.query.one().rows_done == 3
+
+    def test_reads_zip_archives(self, authors, tmp_path):
+        """Images can come from a zip archive."""
+        archive = tmp_path / "dishes.zip"
+        with zipfile.ZipFile(archive, "w") as out:
+            out.writestr("photos/red.jpg", jpeg("red"))
+        manifest = [dict(rows(1)[0], image="photos/red.jpg")]
+        assert (
+            import_dishes(
+                ImageSource(str(archive)), manifest, "test", workers=4
+            ).imported
+            == 1
+        )
+
+
+class TestManifest:
+    """Manifest formats."""
+
+    def test_json_and_json_lines(self, tmp_path):
+        """JSON lists and JSON Lines read the same rows."""
+        (tmp_path / "dishes.json").write_text(json.dumps(rows(2)))
+        (tmp_path / "dishes.jsonl").write_text(
+            "\n".join(json.dumps(row) for row in rows(2))
+        )
+        assert read_manifest(str(tmp_path / "dishes.json")) == read_manifest(
+            str(tmp_path / "dishes.jsonl")
+        )
+
+    def test_unknown_format(self, tmp_path):
+        """Other files are refused."""
+        (tmp_path / "dishes.txt").write_text("")
+        with pytest.raises(ValueError):
+            read_manifest(str(tmp_path / "dishes.txt"))
+
+    @pytest.mark.parametrize(
+        "value, expected",
+        [
+            ("2019-05-01", dt.datetime(2019, 5, 1)),
+            ("2019-05-01T12:30:00.25Z", dt.datetime(2019, 5, 1, 12, 30, 0, 250000)),
+            ("2019-05-01 12:30+02:00", dt.datetime(2019, 5, 1, 10, 30)),
+            ("2019-05-01T23:30:00-0100", dt.datetime(2019, 5, 2, 0, 30)),
+        ],
+    )
+    def test_timestamps_are_read_as_utc(self, value, expected):
+        """created_at accepts ISO 8601 dates and times, with or without a UTC offset."""
+        assert parse_timestamp(value) == expected
+
+    @pytest.mark.parametrize("value", ["yesterday", "2019-13-01", "2019-05-01T25:00"])
+    def test_invalid_timestamps(self, value):
+        """Invalid timestamps are rejected."""
+        with pytest.raises(ValueError):
+            parse_timestamp(value)
+
+
+def test_command_reports_progress(app, authors, images, tmp_path):
+    """The CLI prints a line per batch with its throughput."""
+    manifest = write_manifest(tmp_path / "dishes.csv", rows())
+    result = app.test_cli_runner().invoke(
+        import_dishes_command,
+        [str(images), "--manifest", manifest, "--batch-size", "2"],
+    )
+    assert result.exit_code == 0, result.output
+    lines = result.output.splitlines()
+    assert lines[0].startswith("2/3 rows: 2 imported")
+    assert lines[1].startswith("3/3 rows: 3 imported")
+    assert "rows/s" in lines[1]
+    assert ImportRun.query.one().name == "dishes.csv"
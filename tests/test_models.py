@@ -1,12 +1,22 @@
 # -*- coding: utf-8 -*-
 """Model unit tests."""
 import datetime as dt
+import hashlib
+import io
+import os
 
 import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
 
-from food_journal.user.models import Role, User
+from food_journal.extensions import s3
+from food_journal.public.feed import public_feed
+from food_journal.public.images import make_derivatives
+from food_journal.public.models import Blob, FoodItem, UploadJob
+from food_journal.public.uploads import claim_job, process_job, prune_blobs, run_worker
+from food_journal.user.models import Role, TimelineEntry, User
 
-from .factories import UserFactory
+from .factories import FoodItemFactory, UserFactory
 
 
 @pytest.mark.usefixtures("db")
@@ -64,3 +74,529 @@ class TestUser:
         user.roles.append(role)
         user.save()
         assert role in user.roles
+
+
+@pytest.mark.usefixtures("db", "s3")
+class TestUserCounters:
+    """Denormalized follower, following and dish counts."""
+
+    def counts(self, user):
+        """The user's follower, following and dish counts."""
+        return user.follower_count, user.following_count, user.dish_count
+
+    def test_follow_and_unfollow(self, db):
+        """Both users' counts change with the follow, in its transaction."""
+        user, other = UserFactory(), UserFactory()
+        db.session.commit()
+        user.follow(other)
+        db.session.commit()
+        assert (self.counts(user), self.counts(other)) == ((0, 1, 0), (1, 0, 0))
+        user.unfollow(other)
+        db.session.commit()
+        assert (self.counts(user), self.counts(other)) == ((0, 0, 0), (0, 0, 0))
+
+    def test_increments_are_relative(self, db):
+        """A follow adds to the stored count, even when this session's copy is stale."""
+        user, other = UserFactory(), UserFactory()
+        db.session.commit()
+        db.session.execute(
+            User.__table__.update().where(User.id == other.id).values(follower_count=41)
+        )
+        user.follow(other)
+        db.session.commit()
+        assert other.follower_count == 42
+
+    def test_follows_before_a_flush(self, app, db):
+        """A second follow sees the first one's pending count when checking the fan-out limit."""
+        app.config["TIMELINE_FANOUT_LIMIT"] = 1
+        author, first, second = UserFactory(), UserFactory(), UserFactory()
+        db.session.commit()
+        with db.session.no_autoflush:
+            first.follow(author)
+            second.follow(author)
+        db.session.commit()
+        assert author.follower_count == 2
+        assert author.fanout_on_read
+
+    def test_dishes(self, db):
+        """Adding and deleting dishes counts them for their authors, new or stored."""
+        dish = FoodItemFactory()
+        db.session.commit()
+        author = dish.author
+        assert author.dish_count == 1
+        FoodItem.create(title="Soup", aws_key="soup.jpg", author=author)
+        FoodItemFactory.create_batch(2, author=author)
+        db.session.commit()
+        assert author.dish_count == 4
+        dish.delete()
+        assert author.dish_count == 3
+
+    def test_reconcile(self, db):
+        """Drifted counters are recomputed; correct ones are left alone."""
+        user, other = UserFactory(), UserFactory()
+        FoodItemFactory(author=other)
+        db.session.commit()
+        user.follow(other)
+        db.session.commit()
+        db.session.execute(
+            User.__table__.update()
+            .values(follower_count=7, dish_count=0)
+            .where(User.id == other.id)
+        )
+        assert User.reconcile_counters() == 1
+        db.session.commit()
+        assert self.counts(other) == (1, 0, 1)
+        assert User.reconcile_counters() == 0
+
+
+@pytest.mark.usefixtures("db", "s3")
+class TestBulkOperations:
+    """CRUDMixin bulk writes."""
+
+    def rows(self, count):
+        """``count`` new user rows, as the bulk methods take them."""
+        return [
+            {
+                "username": f"bulk{i}",
+                "email": f"bulk{i}@example.com",
+                "first_name": "Bulk",
+            }
+            for i in range(count)
+        ]
+
+    def test_bulk_create_in_chunks(self, db, count_queries):
+        """Rows go one chunk per statement and get their column defaults."""
+        with count_queries() as statements:
+            assert User.bulk_create(self.rows(5), chunk_size=2) is None
+        assert (
+            len(
+                [
+                    statement
+                    for statement in statements
+                    if statement.startswith("INSERT")
+                ]
+            )
+            == 3
+        )
+        users = User.query.order_by(User.id).all()
+        assert [user.username for user in users] == [f"bulk{i}" for i in range(5)]
+        assert all(isinstance(user.created_at, dt.datetime) for user in users)
+
+    def test_bulk_create_returns_keys(self, db):
+        """Primary keys come back in the order of the rows."""
+        ids = User.bulk_create(self.rows(3), return_keys=True)
+        assert [User.get_by_id(user_id).username for user_id in ids] == [
+            "bulk0",
+            "bulk1",
+            "bulk2",
+        ]
+        ids = User.bulk_create(self.rows(5)[3:], return_keys=True, orm_events=True)
+        assert [User.get_by_id(user_id).username for user_id in ids] == [
+            "bulk3",
+            "bulk4",
+        ]
+
+    def test_returned_keys_are_matched_to_rows(self, db, monkeypatch):
+        """Keys RETURNING gives back in another order are put in the order of the rows by ``match``."""
+        monkeypatch.setattr(User, "_dialect", classmethod(lambda cls: "postgresql"))
+        monkeypatch.setattr(
+            db.session,
+            "execute",
+            lambda statement: [(3, "bulk2"), (1, "bulk0"), (2, "bulk1")],
+        )
+        assert User.bulk_create(
+            self.rows(3), return_keys=True, match="username", commit=False
+        ) == [1, 2, 3]
+
+    def test_orm_events_are_opt_in(self, db):
+        """Only rows written through the session count towards their author's dishes."""
+        author = UserFactory()
+        db.session.commit()
+        dishes = [{"title": "Soup", "aws_key": "soup.jpg", "user_id": author.id}] * 2
+        FoodItem.bulk_create(dishes)
+        assert author.dish_count == 0
+        FoodItem.bulk_create(dishes, orm_events=True)
+        assert author.dish_count == 2
+        assert FoodItem.query.count() == 4
+
+    def test_bulk_update(self, db):
+        """Given columns are set by primary key, with or without the ORM."""
+        ids = User.bulk_create(self.rows(3), return_keys=True)
+        User.bulk_update(
+            [{"id": user_id, "first_name": f"Name{user_id}"} for user_id in ids[:2]],
+            chunk_size=1,
+        )
+        User.bulk_update([{"id": ids[2], "about_me": "Cooks"}], orm_events=True)
+        users = User.query.order_by(User.id).all()
+        assert [user.first_name for user in users] == [
+            f"Name{ids[0]}",
+            f"Name{ids[1]}",
+            "Bulk",
+        ]
+        assert users[2].about_me == "Cooks"
+
+    def test_bulk_delete(self, db):
+        """Records are deleted by primary key, composite ones by tuple."""
+        ids = User.bulk_create(self.rows(4), return_keys=True)
+        assert User.bulk_delete(ids[:2], chunk_size=1) == 2
+        assert User.bulk_delete(ids[2:3], orm_events=True) == 1
+        assert [user.id for user in User.query] == ids[3:]
+
+        dish = FoodItemFactory()
+        db.session.commit()
+        assert TimelineEntry.query.count() == 1
+        assert TimelineEntry.bulk_delete([(dish.user_id, dish.id)]) == 1
+        assert TimelineEntry.query.count() == 0
+
+    def test_upsert(self, db):
+        """Existing records are updated, new ones inserted."""
+        User.bulk_create(self.rows(2))
+        rows = [dict(row, first_name="Again") for row in self.rows(3)]
+        User.upsert(
+            rows, index_elements=["username"], update=["first_name"], chunk_size=2
+        )
+        assert [
+            (user.username, user.first_name) for user in User.query.order_by(User.id)
+        ] == [("bulk0", "Again"), ("bulk1", "Again"), ("bulk2", "Again")]
+        User.upsert(
+            [dict(rows[0], first_name="Untouched")],
+            index_elements=["username"],
+            update=[],
+        )
+        assert User.query.filter_by(username="bulk0").one().first_name == "Again"
+
+
+@pytest.mark.usefixtures("db")
+class TestFoodItem:
+    """Food item tests."""
+
+    def image(self, data, filename="dish.jpg"):
+        """``data`` as an uploaded JPEG file."""
+        return FileStorage(
+            io.BytesIO(data), filename=filename, content_type="image/jpeg"
+        )
+
+    def test_small_image_is_uploaded_on_commit(self, s3_bucket):
+        """The image is stored under its content hash before the row is committed."""
+        data = os.urandom(1024)
+        dish = FoodItem.create(
+            title="Soup", image=self.image(data, "Dish.JPG"), author=UserFactory()
+        )
+        assert dish.persistent
+        assert dish.aws_key == f"blobs/{hashlib.sha256(data).hexdigest()}.jpg"
+        stored = s3_bucket.Object(dish.aws_key).get()
+        assert stored["Body"].read() == data
+        assert stored["ContentType"] == "image/jpeg"
+        assert dish.blob.size == 1024
+        assert dish.blob.ref_count == 1
+
+    def test_duplicate_image_is_not_uploaded_again(self, s3_bucket, monkeypatch):
+        """Identical images share one blob, its key and its derivatives."""
+        original = io.BytesIO()
+        Image.new("RGB", (400, 300), "red").save(original, "JPEG")
+        first = FoodItem.create(
+            title="Soup", image=self.image(original.getvalue()), author=UserFactory()
+        )
+
+        uploads = []
+        monkeypatch.setattr(
+            FoodItem, "put_to_s3", classmethod(lambda cls, *args: uploads.append(args))
+        )
+        second = FoodItem.create(
+            title="Again",
+            image=self.image(original.getvalue(), "x.jpg"),
+            author=UserFactory(),
+        )
+        assert uploads == []
+        assert second.persistent
+        assert second.aws_key == first.aws_key
+        assert second.image_variants == first.image_variants
+        assert Blob.query.one().ref_count == 2
+
+    def test_racing_first_uploads_share_one_blob(self, s3_bucket, monkeypatch):
+        """An upload losing the race to store the same image references the winner's blob."""
+        original = io.BytesIO()
+        Image.new("RGB", (400, 300), "green").save(original, "JPEG")
+        first = FoodItem.create(
+            title="Soup", image=self.image(original.getvalue()), author=UserFactory()
+        )
+        find = Blob.find.__func__
+        misses = []
+
+        def find_after_the_race(cls, digest):
+            # the second upload looked before the first one committed
+            if not misses:
+                misses.append(digest)
+                return None
+            return find(cls, digest)
+
+        monkeypatch.setattr(Blob, "find", classmethod(find_after_the_race))
+        second = FoodItem.create(
+            title="Again", image=self.image(original.getvalue()), author=UserFactory()
+        )
+        assert second.persistent
+        assert second.blob == first.blob
+        assert Blob.query.one().ref_count == 2
+        assert FoodItem.query.count() == 2
+
+    def test_deleted_dishes_release_their_blob(self, s3_bucket):
+        """Blobs are pruned from S3 once no dish references them."""
+        original = io.BytesIO()
+        Image.new("RGB", (400, 300), "blue").save(original, "JPEG")
+        dishes = [
+            FoodItem.create(
+                title="Soup",
+                image=self.image(original.getvalue()),
+                author=UserFactory(),
+            )
+            for _ in range(2)
+        ]
+        blob = dishes[0].blob
+        dishes[0].delete()
+        assert prune_blobs() == 0
+        dishes[1].delete()
+        assert blob.ref_count == 0
+        assert (
+            len(list(s3_bucket.objects.all())) == 3
+        )  # original, WebP and JPEG thumbnails
+        assert prune_blobs() == 1
+        assert list(s3_bucket.objects.all()) == []
+        assert Blob.query.count() == 0
+
+    def test_bulk_deleted_dishes_release_their_blob(self, db, s3_bucket):
+        """Deleting dishes without the ORM drops their references too."""
+        dishes = [
+            FoodItem.create(
+                title="Soup", image=self.image(b"soup"), author=UserFactory()
+            )
+            for _ in range(3)
+        ]
+        blob = dishes[0].blob
+        assert blob.ref_count == 3
+        assert FoodItem.bulk_delete([dish.id for dish in dishes[:2]]) == 2
+        db.session.refresh(blob)
+        assert blob.ref_count == 1
+        FoodItem.bulk_delete([dishes[2].id])
+        assert prune_blobs() == 1
+        assert list(s3_bucket.objects.all()) == []
+
+    def test_large_image_is_uploaded_in_parts(self, app, s3_bucket):
+        """Images near MAX_CONTENT_LENGTH are sent as a multipart upload."""
+        data = os.urandom(app.config["MAX_CONTENT_LENGTH"] - 1024)
+        dish = FoodItem.create(
+            title="Feast", image=self.image(data, "big.jpg"), author=UserFactory()
+        )
+        stored = s3_bucket.Object(dish.aws_key)
+        assert stored.get()["Body"].read() == data
+        assert stored.e_tag.strip('"').endswith("-3")  # three 5MB parts
+
+    def test_derivatives_are_resized_and_stripped(self, s3_bucket):
+        """Resized WebP and JPEG copies are stored without metadata, never upscaled."""
+        original = io.BytesIO()
+        exif = Image.Exif()
+        exif[0x010F] = "Camera maker"
+        Image.new("RGB", (1500, 1000), "orange").save(original, "JPEG", exif=exif)
+        dish = FoodItem.create(
+            title="Soup", image=self.image(original.getvalue()), author=UserFactory()
+        )
+
+        assert list(dish.image_variants) == ["thumb", "carousel"]
+        assert dish.image_variants["carousel"]["width"] == 1024
+        for variant in dish.image_variants.values():
+            for fmt, content_type in (("webp", "image/webp"), ("jpeg", "image/jpeg")):
+                stored = s3_bucket.Object(variant[fmt]).get()
+                assert stored["ContentType"] == content_type
+                image = Image.open(io.BytesIO(stored["Body"].read()))
+                assert image.width == variant["width"]
+                assert not image.getexif()
+        assert dish.image_url("full").endswith("-carousel.jpg")
+        assert dish.srcset("webp").endswith("-carousel.webp 1024w")
+
+    def test_non_image_keeps_original_url(self, s3_bucket):
+        """Files Pillow cannot read are served as uploaded."""
+        dish = FoodItem.create(
+            title="Soup", image=self.image(b"not an image"), author=UserFactory()
+        )
+        assert dish.image_variants is None
+        assert dish.image_url() == dish.aws_url
+        assert dish.srcset() is None
+
+    def test_decompression_bomb_keeps_original_url(self, s3_bucket, monkeypatch):
+        """Images too large to decode safely are stored without derivatives."""
+        original = io.BytesIO()
+        Image.new("RGB", (400, 300), "white").save(original, "PNG")
+        monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+        assert make_derivatives(io.BytesIO(original.getvalue())) == []
+        dish = FoodItem.create(
+            title="Soup",
+            image=self.image(original.getvalue(), "soup.png"),
+            author=UserFactory(),
+        )
+        assert dish.persistent
+        assert dish.image_variants is None
+
+    def test_failed_upload_is_not_saved(self, app, s3_bucket):
+        """Nothing is committed when the upload fails."""
+        app.config["S3_BUCKET_NAME"] = "no-such-bucket"
+        dish = FoodItem.create(
+            title="Soup", image=self.image(b"soup"), author=UserFactory()
+        )
+        assert not dish.persistent
+        assert FoodItem.query.count() == 0
+
+
+@pytest.mark.usefixtures("db")
+class TestAsyncUpload:
+    """Uploads queued for the background worker."""
+
+    @pytest.fixture(autouse=True)
+    def async_mode(self, app, tmp_path):
+        """Queue uploads, spooling them under a temporary directory."""
+        app.config["S3_UPLOAD_MODE"] = "async"
+        app.config["UPLOAD_SPOOL_DIR"] = str(tmp_path)
+
+    def create_dish(self):
+        """A dish whose image is queued for the worker."""
+        image = FileStorage(
+            io.BytesIO(b"soup"), filename="soup.jpg", content_type="image/jpeg"
+        )
+        return FoodItem.create(title="Soup", image=image, author=UserFactory())
+
+    def test_commit_queues_upload_and_hides_dish(self, s3_bucket):
+        """The dish is committed pending, with its image spooled, and stays out of feeds."""
+        dish = self.create_dish()
+        assert dish.persistent
+        assert dish.upload_state == FoodItem.UPLOAD_PENDING
+        job = UploadJob.query.one()
+        with open(job.spool_path, "rb") as spooled:
+            assert spooled.read() == b"soup"
+        assert list(s3_bucket.objects.all()) == []
+        assert public_feed().items == []
+
+    def test_worker_uploads_and_marks_ready(self, s3_bucket):
+        """The worker sends the spooled image to S3 and publishes the dish."""
+        dish = self.create_dish()
+        spool_path = UploadJob.query.one().spool_path
+        assert run_worker(once=True) == 1
+        assert dish.upload_state == FoodItem.UPLOAD_READY
+        assert s3_bucket.Object(dish.aws_key).get()["Body"].read() == b"soup"
+        assert UploadJob.query.count() == 0
+        assert not os.path.exists(spool_path)
+        assert public_feed().items == [dish]
+
+    def test_duplicate_image_is_not_queued(self, s3_bucket):
+        """An image that is already stored is referenced at once, without a job."""
+        first = self.create_dish()
+        run_worker(once=True)
+        assert first.blob.digest == hashlib.sha256(b"soup").hexdigest()
+
+        second = self.create_dish()
+        assert second.upload_state == FoodItem.UPLOAD_READY
+        assert second.blob == first.blob
+        assert UploadJob.query.count() == 0
+
+    def test_worker_skips_content_stored_while_queued(self, s3_bucket):
+        """Identical images queued together are only sent to S3 once."""
+        dishes = [self.create_dish(), self.create_dish()]
+        assert UploadJob.query.count() == 2
+        assert run_worker(once=True) == 2
+        assert [dish.upload_state for dish in dishes] == [FoodItem.UPLOAD_READY] * 2
+        assert dishes[0].blob == dishes[1].blob
+        assert Blob.query.one().ref_count == 2
+
+    def test_worker_retries_with_backoff_then_gives_up(self, app, s3_bucket):
+        """Failed uploads are retried later, and marked failed after the last attempt."""
+        dish = self.create_dish()
+        app.config["S3_BUCKET_NAME"] = "no-such-bucket"
+        now = dt.datetime.utcnow()
+        job = claim_job(now)
+        assert not process_job(job, now)
+        assert job.attempts == 1
+        assert job.next_attempt_at == now + dt.timedelta(
+            seconds=app.config["UPLOAD_RETRY_BACKOFF"]
+        )
+        assert claim_job(now) is None
+
+        for attempt in range(2, app.config["UPLOAD_MAX_ATTEMPTS"] + 1):
+            later = dt.datetime.utcnow() + dt.timedelta(days=attempt)
+            process_job(claim_job(later), later)
+        assert dish.upload_state == FoodItem.UPLOAD_FAILED
+        assert UploadJob.query.count() == 0
+
+    def test_unexpected_errors_count_as_failed_attempts(
+        self, db, s3_bucket, monkeypatch
+    ):
+        """A job failing in an unexpected way is retried later instead of stopping the worker."""
+        dish = self.create_dish()
+
+        def broken(job):
+            job.food.title = "Half-written"
+            db.session.flush()
+            raise ValueError("truncated image")
+
+        def rolled_back(session, previous_transaction):
+            if previous_transaction.parent is None:
+                released.append(previous_transaction)
+
+        released = []
+        monkeypatch.setattr("food_journal.public.uploads.upload_spooled", broken)
+        db.event.listen(db.session, "after_soft_rollback", rolled_back)
+        try:
+            assert not process_job(claim_job())
+        finally:
+            db.event.remove(db.session, "after_soft_rollback", rolled_back)
+        assert released == []  # the job stayed locked until its failure was recorded
+        job = UploadJob.query.one()
+        assert job.attempts == 1
+        assert job.last_error == "ValueError: truncated image"
+        assert (dish.title, dish.upload_state) == ("Soup", FoodItem.UPLOAD_PENDING)
+
+    @pytest.mark.usefixtures("foreign_keys")
+    def test_dish_with_queued_upload_can_be_deleted(self, s3_bucket):
+        """Deleting a dish drops its upload job."""
+        self.create_dish().delete()
+        assert UploadJob.query.count() == 0
+
+    def test_worker_derives_images_uploaded_directly(self, s3_bucket):
+        """Dishes whose image is already in S3 only wait for their derivatives."""
+        original = io.BytesIO()
+        Image.new("RGB", (400, 300), "green").save(original, "JPEG")
+        s3_bucket.put_object(
+            Key="someone/uploads/soup.jpg",
+            Body=original.getvalue(),
+            ContentType="image/jpeg",
+        )
+        dish = FoodItem.create(
+            title="Soup", aws_key="someone/uploads/soup.jpg", author=UserFactory()
+        )
+        assert dish.upload_state == FoodItem.UPLOAD_PENDING
+        assert UploadJob.query.one().spool_path is None
+
+        assert run_worker(once=True) == 1
+        assert dish.upload_state == FoodItem.UPLOAD_READY
+        assert list(dish.image_variants) == ["thumb"]
+        assert (
+            s3_bucket.Object(dish.image_variants["thumb"]["webp"]).get()["ContentType"]
+            == "image/webp"
+        )
+
+
+class TestS3Client:
+    """Process-wide S3 client."""
+
+    def test_client_is_reused(self, app):
+        """Every upload in a process shares one client."""
+        assert s3.client is s3.client
+
+    def test_client_is_rebuilt_after_fork(self, app, monkeypatch):
+        """A forked worker gets its own client and connection pool."""
+        parent_client = s3.client
+        monkeypatch.setattr(os, "getpid", lambda: -1)
+        assert s3.client is not parent_client
+
+    def test_client_uses_pool_settings(self, app):
+        """Pool size, timeouts and retries come from the settings."""
+        config = s3.client.meta.config
+        assert config.max_pool_connections == app.config["S3_MAX_POOL_CONNECTIONS"]
+        assert config.connect_timeout == app.config["S3_CONNECT_TIMEOUT"]
+        assert config.retries["mode"] == "standard"
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""Password hashing pool tests."""
+import threading
+import time
+
+from food_journal.commands import bcrypt_calibrate
+from food_journal.extensions import passwords
+from food_journal.passwords import (
+    MIN_RECOMMENDED_ROUNDS,
+    MIN_ROUNDS,
+    calibrate,
+    hash_rounds,
+    time_hash,
+)
+from food_journal.user.models import User
+
+
+class TestPasswordHasher:
+    """Hashing off the calling thread."""
+
+    def test_hashes_on_pool_threads(self, app):
+        """Hashes run on the pool, and the result comes back to the caller."""
+        ran_on = []
+
+        def hash_name(password):
+            ran_on.append(threading.current_thread().name)
+            return password.upper()
+
+        assert passwords.run(hash_name, "secret") == "SECRET"
+        assert ran_on[0].startswith("bcrypt")
+        assert passwords.metrics()["completed"] == 1
+
+    def test_user_passwords_round_trip(self, app):
+        """Users hash and check their passwords through the pool."""
+        user = User(username="foo", email="foo@bar.com", password="foobarbaz123")
+        assert user.check_password("foobarbaz123")
+        assert not user.check_password("barfoobaz")
+        assert passwords.metrics()["completed"] == 3
+
+    def test_reports_queue_depth(self, app):
+        """Hashes beyond the pool size wait, and the deepest queue is recorded."""
+        app.extensions["passwords"].size = 1
+        release = threading.Event()
+
+        def call():
+            with app.app_context():
+                passwords.run(release.wait)
+
+        callers = [threading.Thread(target=call) for _ in range(3)]
+        for caller in callers:
+            caller.start()
+        deadline = time.time() + 5
+        while passwords.metrics()["in_flight"] < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        metrics = passwords.metrics()
+        assert (metrics["in_flight"], metrics["queued"], metrics["max_queued"]) == (
+            3,
+            2,
+            2,
+        )
+
+        release.set()
+        for caller in callers:
+            caller.join()
+        metrics = passwords.metrics()
+        assert (metrics["in_flight"], metrics["queued"], metrics["completed"]) == (
+            0,
+            0,
+            3,
+        )
+        assert metrics["wait_seconds"] >= 0
+
+    def test_size_zero_hashes_inline(self, app):
+        """With no pool, hashing stays on the calling thread."""
+        app.extensions["passwords"].size = 0
+        assert (
+            passwords.run(lambda: threading.current_thread())
+            is threading.current_thread()
+        )
+
+    def test_pool_is_rebuilt_after_fork(self, app, monkeypatch):
+        """A forked worker gets its own threads."""
+        state = app.extensions["passwords"]
+        passwords.run(lambda: None)
+        parent = state.executor
+        monkeypatch.setattr("os.getpid", lambda: -1)
+        passwords.run(lambda: None)
+        assert state.executor is not parent
+
+
+class TestCalibration:
+    """Choosing and migrating to a bcrypt cost."""
+
+    def test_picks_highest_cost_within_target(self):
+        """Costs are timed upwards until one is too slow."""
+        rounds, timings = calibrate(
+            0.1, measure=lambda cost: 0.001 * 2 ** (cost - 4), minimum=MIN_ROUNDS
+        )
+        assert rounds == 10  # 64 ms; 11 rounds take 128 ms
+        assert list(timings) == list(range(4, 12))
+
+    def test_never_goes_below_minimum(self):
+        """A slow host or a small target still gets the minimum cost."""
+        rounds, timings = calibrate(0.001, measure=lambda cost: 1.0)
+        assert (rounds, list(timings)) == (
+            MIN_RECOMMENDED_ROUNDS,
+            [MIN_RECOMMENDED_ROUNDS],
+        )
+        rounds, timings = calibrate(0.001, measure=lambda cost: 1.0, minimum=MIN_ROUNDS)
+        assert (rounds, list(timings)) == (MIN_ROUNDS, [MIN_ROUNDS])
+
+    def test_measures_real_hashes(self):
+        """The default measurement hashes with bcrypt."""
+        assert time_hash(4, samples=1) > 0
+
+    def test_login_rehashes_at_current_cost(self, app, db):
+        """A correct password stored at another cost is rehashed; a wrong one is not."""
+        user = User.create(username="foo", email="foo@bar.com", password="foobarbaz123")
+        assert hash_rounds(user.password) == 4
+        app.config["BCRYPT_LOG_ROUNDS"] = 5
+
+        assert not user.check_password("barfoobaz")
+        assert hash_rounds(user.password) == 4
+        assert user.check_password("foobarbaz123")
+        assert user in db.session.dirty  # saved by the caller's commit
+        db.session.commit()
+        db.session.expire(user)
+        assert hash_rounds(user.password) == 5
+        assert user.check_password("foobarbaz123")
+
+    def test_login_saves_rehashed_password(self, app, db, user, testapp):
+        """The login view commits the rehash."""
+        user_id = user.id
+        app.config["BCRYPT_LOG_ROUNDS"] = 5
+        res = testapp.get("/")
+        form = res.forms["loginForm"]
+        form["username"] = user.username
+        form["password"] = "myprecious"
+        form.submit().follow()
+        db.session.remove()
+        assert hash_rounds(User.query.get(user_id).password) == 5
+
+    def test_command_writes_env_file(self, app, tmp_path, monkeypatch):
+        """The command prints the timings and can set the cost in a .env file."""
+        monkeypatch.setattr(
+            "food_journal.passwords.time_hash", lambda cost: 0.001 * 2 ** (cost - 4)
+        )
+        env_file = tmp_path / ".env"
+        env_file.write_text("SECRET_KEY=x\nBCRYPT_LOG_ROUNDS=13\n")
+        result = app.test_cli_runner().invoke(
+            bcrypt_calibrate, ["--target-ms", "100", "--write-env", str(env_file)]
+        )
+        assert result.exit_code == 0, result.output
+        assert "10 rounds:      64.0 ms <- recommended" in result.output
+        assert env_file.read_text() == "SECRET_KEY=x\nBCRYPT_LOG_ROUNDS=10\n"
+
+    def test_command_keeps_the_minimum_on_slow_hosts(self, app, tmp_path, monkeypatch):
+        """The command recommends and writes no less than --min-rounds."""
+        monkeypatch.setattr(
+            "food_journal.passwords.time_hash", lambda cost: 0.001 * 2 ** (cost - 4)
+        )
+        env_file = tmp_path / ".env"
+        runner = app.test_cli_runner()
+        result = runner.invoke(
+            bcrypt_calibrate, ["--target-ms", "10", "--write-env", str(env_file)]
+        )
+        assert result.exit_code == 0, result.output
+        assert "Even 10 rounds, the minimum, take longer than 10 ms" in result.output
+        assert env_file.read_text() == "BCRYPT_LOG_ROUNDS=10\n"
+        result = runner.invoke(
+            bcrypt_calibrate,
+            ["--target-ms", "10", "--min-rounds", "4", "--write-env", str(env_file)],
+        )
+        assert result.exit_code == 0, result.output
+        assert env_file.read_text() == "BCRYPT_LOG_ROUNDS=7\n"
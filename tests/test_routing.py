@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Read replica routing tests, against a second in-memory database as the replica."""
+import time
+
+import pytest
+from flask import session, url_for
+
+from food_journal.extensions import cache, row_cache
+from food_journal.routing import (
+    PRIMARY_UNTIL,
+    primary_reads,
+    reads_from_replica,
+    replica_reads,
+)
+from food_journal.user.models import User
+from food_journal.utils import bump_cache_versions, cache_version, reads_for_version
+
+from .factories import UserFactory
+
+
+@pytest.fixture
+def replica(app, db):
+    """An empty replica with the app's schema; :func:`replicate` copies the primary into it."""
+    app.config["SQLALCHEMY_BINDS"] = {"replica0": "sqlite://"}
+    db.session.remove()
+    engine = db.get_engine(app, bind="replica0")
+    db.Model.metadata.create_all(engine)
+    yield engine
+    db.session.remove()
+    db.Model.metadata.drop_all(engine)
+
+
+def replicate(db, replica):
+    """Make the replica a copy of the primary, as if it had caught up."""
+    with replica.begin() as connection:
+        for table in reversed(db.Model.metadata.sorted_tables):
+            connection.execute(table.delete())
+        for table in db.Model.metadata.sorted_tables:
+            rows = [dict(row) for row in db.session.execute(table.select())]
+            if rows:
+                connection.execute(table.insert(), rows)
+    db.session.remove()
+
+
+def next_request(db):
+    """Start over as a request from another user would."""
+    db.session.remove()
+    session.pop(PRIMARY_UNTIL, None)
+
+
+def usernames():
+    """The usernames the current session's reads see."""
+    return [
+        username
+        for username, in User.query.with_entities(User.username).order_by(User.username)
+    ]
+
+
+class TestRouting:
+    """Which database a session reads from."""
+
+    def test_reads_use_the_primary_unless_marked(self, db, replica, user):
+        """Only reads within replica_reads go to the replica."""
+        username = user.username
+        next_request(db)
+        assert usernames() == [username]
+        with replica_reads():
+            assert reads_from_replica()
+            assert usernames() == []
+        assert usernames() == [username]
+
+    def test_writes_keep_the_session_on_the_primary(self, db, replica, user):
+        """Once a session has written, it reads its own writes for the rest of its life."""
+        username = user.username
+        next_request(db)
+        with replica_reads():
+            UserFactory(username="newcomer")
+            db.session.commit()
+            assert not reads_from_replica()
+            assert usernames() == ["newcomer", username]
+        db.session.remove()
+        with replica_reads():
+            assert not reads_from_replica()  # nor does the user's next request
+        next_request(db)
+        with replica_reads():
+            assert usernames() == []
+
+    def test_primary_reads_win(self, db, replica, user):
+        """primary_reads sends a block of a marked view to the primary."""
+        username = user.username
+        next_request(db)
+        with replica_reads(), primary_reads():
+            assert not reads_from_replica()
+            assert usernames() == [username]
+
+    def test_recently_bumped_versions_read_from_the_primary(self, app, db, replica):
+        """Cache entries are not filled from replicas that may not have the change yet."""
+        bump_cache_versions(["routing/version"])
+        version = cache_version("routing/version")
+        with replica_reads():
+            with reads_for_version(version):
+                assert not reads_from_replica()
+            with reads_for_version(cache_version("routing/never-bumped")):
+                assert reads_from_replica()
+            later = time.time() + app.config["REPLICA_MAX_LAG"]
+            with pytest.MonkeyPatch.context() as monkeypatch:
+                monkeypatch.setattr(time, "time", lambda: later)
+                with reads_for_version(version):
+                    assert reads_from_replica()
+
+    def test_no_replicas(self, db, user):
+        """Without replicas everything reads from the primary."""
+        with replica_reads():
+            assert not reads_from_replica()
+            assert usernames() == [user.username]
+
+
+class TestReadYourWrites:
+    """Marked views after the user's own changes."""
+
+    def test_user_reads_from_the_primary_after_a_write(
+        self, app, db, replica, user, testapp, monkeypatch
+    ):
+        """For REPLICA_MAX_LAG seconds after committing, the user's marked views read from the primary."""
+        profile = url_for("user.profile", username=user.username)
+        res = testapp.get("/")
+        form = res.forms["loginForm"]
+        form["username"] = user.username
+        form["password"] = "myprecious"
+        replicate(db, replica)
+        form.submit().follow()
+
+        testapp.post(url_for("user.edit_profile"), {"about_me": "Fresh pasta"})
+        # requests share the test's app context; end their sessions as its teardown would
+        db.session.remove()
+        assert "Fresh pasta" in testapp.get(profile)
+        db.session.remove()
+
+        later = time.time() + app.config["REPLICA_MAX_LAG"]
+        monkeypatch.setattr(time, "time", lambda: later)
+        cache.clear()  # as once the cached identity and rows expire
+        row_cache.clear()
+        res = testapp.get(profile)
+        assert res.status_code == 200
+        assert "Fresh pasta" not in res  # the replica has not caught up
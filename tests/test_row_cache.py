@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""Row cache tests."""
+import time
+
+from food_journal.extensions import row_cache
+from food_journal.user.models import Role, User
+
+from .factories import UserFactory
+
+
+def selects(statements):
+    """The SELECT statements among ``statements``."""
+    return [
+        statement
+        for statement in statements
+        if statement.lstrip().upper().startswith("SELECT")
+    ]
+
+
+class TestRowCache:
+    """get_by_id and get_many_by_id across sessions."""
+
+    def test_next_session_reads_nothing(self, db, user, count_queries):
+        """A row loaded once is rebuilt from the cache and attached to the new session."""
+        user_id = user.id
+        db.session.remove()
+        assert User.get_by_id(user_id).username == user.username
+        db.session.remove()
+        with count_queries() as statements:
+            cached = User.get_by_id(str(user_id))
+            assert (cached.username, cached.email, cached.active) == (
+                user.username,
+                user.email,
+                True,
+            )
+        assert statements == []
+        assert cached in db.session
+        assert row_cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+    def test_get_many_loads_misses_in_one_query(self, db, count_queries):
+        """Only the ids that are neither in the session nor cached are queried, all at once."""
+        users = UserFactory.create_batch(4)
+        db.session.commit()
+        ids = [user.id for user in users]
+        db.session.remove()
+        User.get_by_id(ids[0])
+        in_session = User.get_by_id(ids[1])
+        db.session.expunge_all()
+        db.session.add(in_session)
+
+        with count_queries() as statements:
+            found = User.get_many_by_id(list(reversed(ids)) + [404])
+        assert list(found) == list(reversed(ids))
+        assert found[ids[1]] is in_session
+        assert [user.username for user in found.values()] == [
+            user.username for user in reversed(users)
+        ]
+        assert len(statements) == 1 and " IN (" in statements[0]
+
+    def test_excluded_columns_are_loaded_on_access(self, db, user):
+        """The password hash is never cached."""
+        user_id = user.id
+        db.session.remove()
+        User.get_by_id(user_id)
+        db.session.remove()
+        cached = User.get_by_id(user_id)
+        assert "password" not in cached.__dict__
+        assert cached.check_password("myprecious")
+
+    def test_commits_evict_changed_and_deleted_rows(self, db, user):
+        """Updates, bulk updates and deletes apply on the next load."""
+        user_id = user.id
+        User.get_by_id(user_id).update(about_me="Cooking")
+        db.session.remove()
+        assert User.get_by_id(user_id).about_me == "Cooking"
+        db.session.remove()
+        User.get_by_id(user_id).update(about_me="Grilling")  # a cached copy
+        db.session.remove()
+        assert User.get_by_id(user_id).about_me == "Grilling"
+
+        User.bulk_update([{"id": user_id, "about_me": "Baking"}])
+        db.session.remove()
+        assert User.get_by_id(user_id).about_me == "Baking"
+
+        other = UserFactory()
+        db.session.commit()
+        other_id = other.id
+        db.session.remove()
+        User.get_by_id(other_id)
+        db.session.remove()
+        User.get_by_id(other_id).delete()  # a cached copy
+        db.session.remove()
+        assert User.get_by_id(other_id) is None
+
+    def test_rolled_back_writes_are_not_cached(self, db, user):
+        """Rows read after a write in the same transaction are left out of the cache."""
+        other = UserFactory()
+        db.session.commit()
+        user_id, other_id = user.id, other.id
+        db.session.remove()
+        User.get_by_id(user_id).about_me = "Uncommitted"
+        db.session.flush()
+        db.session.execute(
+            User.__table__.update()
+            .where(User.id == other_id)
+            .values(about_me="Uncommitted")
+        )
+        assert User.get_by_id(other_id).about_me == "Uncommitted"
+        db.session.rollback()
+        db.session.remove()
+        assert User.get_by_id(user_id).about_me is None
+        assert User.get_by_id(other_id).about_me is None
+
+    def test_least_recently_used_and_expired_rows_go(
+        self, app, db, monkeypatch, count_queries
+    ):
+        """The cache holds ROW_CACHE_SIZE rows for ROW_CACHE_TIMEOUT seconds."""
+        app.config["ROW_CACHE_SIZE"] = 2
+        app.extensions["row_cache"].size = 2
+        users = UserFactory.create_batch(3)
+        db.session.commit()
+        ids = [user.id for user in users]
+        db.session.remove()
+        User.get_many_by_id(ids[:2])
+        db.session.remove()
+        User.get_by_id(ids[0])  # now the most recently used
+        User.get_by_id(ids[2])
+        assert list(app.extensions["row_cache"].entries) == [
+            ("User", ids[0]),
+            ("User", ids[2]),
+        ]
+        db.session.remove()
+        with count_queries() as statements:
+            User.get_many_by_id(ids)
+        assert len(selects(statements)) == 1 and selects(statements)[
+            0
+        ].rstrip().endswith("IN (?)")
+
+        now = time.monotonic()
+        monkeypatch.setattr(
+            time, "monotonic", lambda: now + app.config["ROW_CACHE_TIMEOUT"] + 1
+        )
+        db.session.remove()
+        User.get_by_id(ids[0])
+        assert row_cache.stats()["misses"] == 5
+
+    def test_uncached_models_use_the_session(self, db):
+        """Models that do not opt in are not cached."""
+        role = Role.create(name="admin")
+        role_id = role.id
+        db.session.remove()
+        assert Role.get_by_id(role_id).name == "admin"
+        assert row_cache.stats()["size"] == 0
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Storage backend tests."""
+import io
+import os
+
+import pytest
+from flask import url_for
+from werkzeug.datastructures import FileStorage
+
+from food_journal.extensions import storage
+from food_journal.public.models import FoodItem
+from food_journal.storage import LocalBackend, MemoryBackend, StorageError
+
+from .factories import UserFactory
+
+
+@pytest.fixture(params=["memory", "local"])
+def backend(request, app, tmp_path, monkeypatch):
+    """Each backend the app serves itself."""
+    if request.param == "local":
+        app.config["STORAGE_LOCAL_ROOT"] = str(tmp_path)
+        backend = LocalBackend(app.config)
+    else:
+        backend = MemoryBackend(app.config)
+    monkeypatch.setitem(app.extensions, "storage", backend)
+    return backend
+
+
+class TestBackends:
+    """Behaviour shared by the backends."""
+
+    def test_put_get_head_delete(self, backend):
+        """Stored files can be read back, inspected and deleted."""
+        backend.put(io.BytesIO(b"soup"), "blobs/soup.jpg", "image/jpeg")
+        assert backend.head("blobs/soup.jpg") == {
+            "size": 4,
+            "content_type": "image/jpeg",
+        }
+        read = io.BytesIO()
+        backend.get("blobs/soup.jpg", read)
+        assert read.getvalue() == b"soup"
+
+        backend.delete(["blobs/soup.jpg", "blobs/missing.jpg"])
+        assert backend.head("blobs/soup.jpg") is None
+        with pytest.raises(StorageError):
+            backend.get("blobs/soup.jpg", io.BytesIO())
+
+    def test_serves_files_with_validators(self, backend, testapp):
+        """Files are served cacheable, and revalidated with 304s."""
+        backend.put(io.BytesIO(b"soup"), "blobs/soup.jpg", "image/jpeg")
+        res = testapp.get(backend.url("blobs/soup.jpg"))
+        assert res.body == b"soup"
+        assert res.content_type == "image/jpeg"
+        assert res.cache_control.max_age == 3600
+        res = testapp.get(
+            backend.url("blobs/soup.jpg"),
+            headers={"If-None-Match": res.etag},
+            status=304,
+        )
+        assert res.body == b""
+
+    def test_missing_file_is_not_found(self, backend, testapp):
+        """Unknown keys are a 404."""
+        testapp.get(url_for("public.media", key="blobs/missing.jpg"), status=404)
+
+    def test_upload_path_stores_dish_images(self, backend, db):
+        """Dishes are stored with the configured backend and linked to the app's media URL."""
+        image = FileStorage(
+            io.BytesIO(b"soup"), filename="soup.jpg", content_type="image/jpeg"
+        )
+        dish = FoodItem.create(title="Soup", image=image, author=UserFactory())
+        assert dish.persistent
+        assert dish.aws_url == url_for("public.media", key=dish.aws_key)
+        assert backend.head(dish.aws_key)["size"] == 4
+
+    def test_no_direct_uploads(self, backend, user, testapp):
+        """Browsers post the form instead."""
+        res = testapp.get("/")
+        form = res.forms["loginForm"]
+        form["username"] = user.username
+        form["password"] = "myprecious"
+        form.submit()
+        testapp.post(
+            url_for("public.presign_dish"), {"filename": "dinner.jpg"}, status=404
+        )
+
+
+class TestLocalBackend:
+    """Files on the local disk."""
+
+    def test_keys_cannot_escape_the_root(self, app, tmp_path):
+        """Keys are confined to STORAGE_LOCAL_ROOT."""
+        app.config["STORAGE_LOCAL_ROOT"] = str(tmp_path / "media")
+        with pytest.raises(StorageError):
+            LocalBackend(app.config).put(io.BytesIO(b"x"), "../escaped.jpg")
+        assert not os.path.exists(tmp_path / "escaped.jpg")
+
+    def test_failed_writes_leave_nothing_behind(self, app, tmp_path):
+        """A failing upload leaves neither the file nor a partial copy."""
+        app.config["STORAGE_LOCAL_ROOT"] = str(tmp_path)
+
+        class Broken(io.RawIOBase):
+            def read(self, size=-1):
+                raise OSError("connection reset")
+
+        with pytest.raises(StorageError):
+            LocalBackend(app.config).put(Broken(), "blobs/soup.jpg")
+        assert os.listdir(tmp_path / "blobs") == []
+
+
+def test_backend_is_selected_by_setting(app):
+    """STORAGE_BACKEND picks the backend."""
+    assert isinstance(storage.backend, MemoryBackend)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Follow suggestion tests."""
+import datetime as dt
+import random
+
+from flask import url_for
+
+from food_journal.user.models import FollowSuggestion
+from food_journal.user.suggestions import rebuild, suggested_users
+
+from .factories import UserFactory
+
+
+def stored(db):
+    """Every stored suggestion as ``(user_id, suggested_id, mutual_count)``."""
+    return sorted(
+        db.session.query(
+            FollowSuggestion.user_id,
+            FollowSuggestion.suggested_id,
+            FollowSuggestion.mutual_count,
+        )
+    )
+
+
+def follow_all(db, follows):
+    """Make each user follow the others listed with them, and commit."""
+    for user, others in follows:
+        for other in others:
+            user.follow(other)
+    db.session.commit()
+
+
+class TestFollowSuggestions:
+    """Friends of friends, ranked."""
+
+    def test_ranked_by_mutual_follows_then_activity(self, db):
+        """More mutual follows first; ties go to the user seen most recently."""
+        me, a, b, c, x, y, z = UserFactory.create_batch(7)
+        db.session.commit()
+        now = dt.datetime.utcnow()
+        x.update(last_seen=now - dt.timedelta(days=2))
+        y.update(last_seen=now - dt.timedelta(days=1))
+        follow_all(db, [(me, [a, b, c]), (a, [x, y, z, me]), (b, [x, y, c]), (c, [z])])
+        rebuild()
+
+        ranked = [(user.id, mutual_count) for user, mutual_count in suggested_users(me)]
+        # c is followed already and me is never suggested to myself
+        assert ranked == [(z.id, 2), (y.id, 2), (x.id, 2)]
+        assert [user for user, _ in suggested_users(me, limit=1)] == [z]
+
+    def test_leaves_out_inactive_users(self, db):
+        """Deactivated users and users not seen for a while are not suggested."""
+        me, friend, gone, stale, fresh = UserFactory.create_batch(5)
+        db.session.commit()
+        gone.update(active=False)
+        stale.update(last_seen=dt.datetime.utcnow() - dt.timedelta(days=365))
+        follow_all(db, [(me, [friend]), (friend, [gone, stale, fresh])])
+        rebuild(batch_size=2)
+        assert [user for user, _ in suggested_users(me)] == [fresh]
+
+    def test_keeps_the_top_suggestions(self, app, db):
+        """Only FOLLOW_SUGGESTIONS_SIZE suggestions are stored per user, also after a follow."""
+        app.config["FOLLOW_SUGGESTIONS_SIZE"] = 2
+        me, a, b = UserFactory.create_batch(3)
+        x, y, z = UserFactory.create_batch(3)
+        db.session.commit()
+        follow_all(db, [(me, [a]), (a, [x, y, z]), (b, [z])])
+        rebuild()
+        assert len(stored(db)) == 2
+
+        me.follow(b)
+        db.session.commit()
+        assert [(user, count) for user, count in suggested_users(me)][0] == (z, 2)
+        assert len(stored(db)) == 2
+
+    def test_follow_and_unfollow_match_a_rebuild(self, app, db):
+        """Updating on each follow and unfollow gives what a rebuild computes."""
+        app.config["FOLLOW_SUGGESTIONS_SIZE"] = 100
+        users = UserFactory.create_batch(12)
+        db.session.commit()
+        rng = random.Random(3)
+        for _ in range(60):
+            user, other = rng.sample(users, 2)
+            if user.follows_in_session(other):
+                user.unfollow(other)
+            else:
+                user.follow(other)
+            db.session.commit()
+            incremental = stored(db)
+            rebuild()
+            assert stored(db) == incremental
+
+    def test_rolled_back_follow_changes_nothing(self, db):
+        """The suggestions are written in the follow's own transaction."""
+        me, friend, other = UserFactory.create_batch(3)
+        db.session.commit()
+        follow_all(db, [(friend, [other])])
+        me.follow(friend)
+        db.session.flush()
+        assert [user for user, _ in suggested_users(me)] == [other]
+        db.session.rollback()
+        assert stored(db) == []
+
+    def test_shown_on_members_page(self, db, testapp):
+        """The members page lists suggestions with a follow link."""
+        me = UserFactory(password="myprecious")
+        friend, cook = UserFactory.create_batch(2)
+        db.session.commit()
+        follow_all(db, [(friend, [cook]), (me, [friend])])
+        testapp.post("/login", {"username": me.username, "password": "myprecious"})
+        res = testapp.get(url_for("user.members"))
+        assert "Suggested cooks" in res
+        assert url_for("user.follow", username=cook.username) in res